@@ -0,0 +1,49 @@
+"""
+Compares two benchmark reports and flags regressions.
+
+    cd be && python -m benchmarks.compare baseline.json candidate.json --threshold 10
+
+Exits with status 1 when any p95 latency grows, or throughput drops, by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def _index(report: dict) -> dict:
+    return {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed change in percent")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = _index(json.load(f))
+    with open(args.candidate) as f:
+        candidate = _index(json.load(f))
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key], candidate[key]
+        p95 = _change(before["p95_ms"], after["p95_ms"])
+        rps = _change(before["throughput_rps"], after["throughput_rps"])
+        regressed = p95 > args.threshold or rps < -args.threshold
+        regressions += regressed
+        print(f"{key[0]:<16} c={key[1]:<3} p95 {before['p95_ms']:>9.1f} -> {after['p95_ms']:>9.1f}ms ({p95:+6.1f}%) "
+              f"rps {before['throughput_rps']:>8.1f} -> {after['throughput_rps']:>8.1f} ({rps:+6.1f}%)"
+              f"{'  REGRESSION' if regressed else ''}")
+    for key in sorted(baseline.keys() ^ candidate.keys()):
+        print(f"{key[0]:<16} c={key[1]:<3} only in {'baseline' if key in baseline else 'candidate'}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Local stand-ins for the Gmail v1 and Calendar v3 REST endpoints used by the backend.
+
+The server only implements the calls MailMate makes, backed by a synthetic mailbox.
+Point the backend at it with GOOGLE_API_ENDPOINT=<FakeGoogle.url>.
+"""
+import base64
+import copy
+import itertools
+import json
+import random
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MIME_SHAPES = ("plain", "html", "alternative", "mixed")
+
+_SENDERS = [
+    "Alice Tan <alice@example.com>",
+    "Bob Lee <bob@example.com>",
+    "Carol Ng <carol@example.org>",
+    "Newsletter <news@updates.example.net>",
+    "GitHub <notifications@github.example.com>",
+    "HR Team <hr@company.example.com>",
+]
+TOPICS = ["quarterly report", "project sync", "invoice", "team lunch", "release notes",
+          "security alert", "budget review", "offsite planning", "weekly digest"]
+# Message fetches served, for the rotating attachment ids
+_fetches = itertools.count(1)
+_FILLER = ("Please find the latest details below. Let me know if you have any questions "
+           "or if anything needs to change before we proceed. ")
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def _part(mime_type: str, text: str, filename: str = "") -> dict:
+    data = text.encode()
+    return {"mimeType": mime_type, "filename": filename, "headers": [],
+            "body": {"size": len(data), "data": _b64(data)}}
+
+
+def _number_parts(part: dict, part_id: str = ""):
+    """ Sets partId the way Gmail does: "" for the payload, then "0", "1", "0.1", ... """
+    part["partId"] = part_id
+    for i, child in enumerate(part.get("parts", [])):
+        _number_parts(child, f"{part_id}.{i}" if part_id else str(i))
+
+
+def _rotate_attachment_ids(part: dict, fetch: int):
+    # Like Gmail, every fetch of a message hands out new attachment ids
+    if part.get("body", {}).get("attachmentId"):
+        part["body"] = dict(part["body"], attachmentId=f"{part['body']['attachmentId']}.{fetch}")
+    for child in part.get("parts", []):
+        _rotate_attachment_ids(child, fetch)
+
+
+class Mailbox:
+    """ A seeded synthetic mailbox and calendar, shared by all requests to the fake server """
+
+    def __init__(self, messages: int = 200, events: int = 50, shapes: tuple[str, ...] = MIME_SHAPES,
+                 body_bytes: int = 2000, seed: int = 0):
+        self.size = messages
+        self.event_count = events
+        self.shapes = shapes
+        self.body_bytes = body_bytes
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Regenerates the mailbox so every benchmark scenario starts from the same state """
+        rng = random.Random(self.seed)
+        now = datetime(2025, 4, 1, 9, 0, tzinfo=timezone.utc)
+        with self.lock:
+            self.history_id = 1000
+            self.calendar_version = 1
+            self.messages: dict[str, dict] = {}
+            self.order: list[str] = []
+            self.sent: list[dict] = []
+            self.history: list[dict] = []
+            self.delivered = 0
+            self._rng = random.Random(self.seed + 1)
+            for i in range(self.size):
+                msg = self._make_message(rng, i, now - timedelta(minutes=17 * i))
+                self.messages[msg["id"]] = msg
+                self.order.append(msg["id"])
+            self.events: list[dict] = []
+            for i in range(self.event_count):
+                start = now + timedelta(hours=rng.randint(0, 24 * 30))
+                self.events.append(self._make_event(i, start, start + timedelta(minutes=rng.choice([30, 60, 90]))))
+            self.events.sort(key=lambda e: e["start"]["dateTime"])
+
+    def _make_message(self, rng: random.Random, index: int, date: datetime) -> dict:
+        sender = rng.choice(_SENDERS)
+        topic = rng.choice(TOPICS)
+        subject = f"{topic.title()} #{index}"
+        text = (f"Hi, this is about the {topic}. " + _FILLER * (self.body_bytes // len(_FILLER) + 1))[:self.body_bytes]
+        html = f"<html><body><p>{text}</p><a href='https://example.com'>link</a></body></html>"
+        shape = self.shapes[index % len(self.shapes)]
+        if shape == "plain":
+            payload = _part("text/plain", text)
+        elif shape == "html":
+            payload = _part("text/html", html)
+        elif shape == "alternative":
+            payload = {"mimeType": "multipart/alternative", "body": {"size": 0},
+                       "parts": [_part("text/plain", text), _part("text/html", html)]}
+        else:
+            attachment = _part("application/pdf", "%PDF-1.4 " + "x" * self.body_bytes, f"report-{index}.pdf")
+            attachment["body"] = {"size": attachment["body"]["size"], "attachmentId": f"att-{index}"}
+            alternative = {"mimeType": "multipart/alternative", "body": {"size": 0},
+                           "parts": [_part("text/plain", text), _part("text/html", html)]}
+            payload = {"mimeType": "multipart/mixed", "body": {"size": 0},
+                       "parts": [alternative, attachment]}
+        _number_parts(payload)
+        payload["headers"] = [
+            {"name": "From", "value": sender},
+            {"name": "To", "value": "Me <me@example.com>"},
+            {"name": "Subject", "value": subject},
+            {"name": "Date", "value": date.strftime("%a, %d %b %Y %H:%M:%S %z")},
+            {"name": "Message-ID", "value": f"<{index:016x}@mail.example.com>"},
+        ]
+        labels = ["INBOX"]
+        if rng.random() < 0.7:
+            labels.append("UNREAD")
+        if rng.random() < 0.2:
+            labels.append("IMPORTANT")
+        msg_id = f"{index:016x}"
+        return {
+            "id": msg_id,
+            "threadId": f"{index // 3:016x}",
+            "labelIds": labels,
+            "snippet": text[:100],
+            "historyId": str(1000 - index),
+            "internalDate": str(int(date.timestamp() * 1000)),
+            "sizeEstimate": self.body_bytes * 2,
+            "payload": payload,
+            "_search": f"{sender} {subject} {text}".lower(),
+        }
+
+    @staticmethod
+    def _make_event(index: int, start: datetime, end: datetime) -> dict:
+        return {
+            "kind": "calendar#event",
+            "id": f"evt{index:06d}",
+            "status": "confirmed",
+            "etag": f'"{index}-1"',
+            "updated": "2025-03-01T00:00:00+00:00",
+            "summary": f"Meeting {index}",
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": end.isoformat()},
+        }
+
+    def matches(self, msg: dict, query: str) -> bool:
+        """ Evaluates the subset of Gmail search syntax the backend generates """
+        if "in:inbox" in query and "INBOX" not in msg["labelIds"]:
+            return False
+        if "in:sent" in query and "SENT" not in msg["labelIds"]:
+            return False
+        if "is:unread" in query and "UNREAD" not in msg["labelIds"]:
+            return False
+        keywords = re.findall(r'"([^"]+)"', query)
+        return not keywords or any(kw.lower() in msg["_search"] for kw in keywords)
+
+    def bump_history(self, record: dict | None = None) -> str:
+        """ Advances the historyId, logging `record` (a Gmail history entry) for history.list """
+        self.history_id += 1
+        if record is not None:
+            self.history.append(dict(record, id=str(self.history_id)))
+        return str(self.history_id)
+
+    def deliver(self, count: int = 1) -> list[str]:
+        """ Simulates `count` new unread messages arriving in the inbox """
+        ids = []
+        with self.lock:
+            for _ in range(count):
+                index = self.size + self.delivered
+                self.delivered += 1
+                msg = self._make_message(self._rng, index, datetime.now(timezone.utc))
+                if "UNREAD" not in msg["labelIds"]:
+                    msg["labelIds"].append("UNREAD")
+                self.messages[msg["id"]] = msg
+                self.order.insert(0, msg["id"])
+                ref = {"id": msg["id"], "threadId": msg["threadId"], "labelIds": list(msg["labelIds"])}
+                msg["historyId"] = self.bump_history({"messages": [ref], "messagesAdded": [{"message": ref}]})
+                ids.append(msg["id"])
+        return ids
+
+
+class _Handler(BaseHTTPRequestHandler):
+    mailbox: Mailbox
+
+    routes = [
+        ("GET", re.compile(r"^/gmail/v1/users/[^/]+/profile$"), "get_profile"),
+        ("GET", re.compile(r"^/gmail/v1/users/[^/]+/history$"), "list_history"),
+        ("GET", re.compile(r"^/gmail/v1/users/[^/]+/messages$"), "list_messages"),
+        ("GET", re.compile(r"^/gmail/v1/users/[^/]+/messages/(?P<id>[^/]+)$"), "get_message"),
+        ("GET", re.compile(r"^/gmail/v1/users/[^/]+/messages/(?P<id>[^/]+)/attachments/(?P<attachment>[^/]+)$"),
+         "get_attachment"),
+        ("GET", re.compile(r"^/gmail/v1/users/[^/]+/threads/(?P<id>[^/]+)$"), "get_thread"),
+        ("POST", re.compile(r"^/gmail/v1/users/[^/]+/messages/(?P<id>[^/]+)/modify$"), "modify_message"),
+        ("POST", re.compile(r"^/gmail/v1/users/[^/]+/messages/send$"), "send_message"),
+        ("POST", re.compile(r"^/gmail/v1/users/[^/]+/messages/batchModify$"), "batch_modify"),
+        ("GET", re.compile(r"^/calendar/v3/calendars/(?P<calendar>[^/]+)/events$"), "list_events"),
+        ("POST", re.compile(r"^/calendar/v3/calendars/(?P<calendar>[^/]+)/events$"), "insert_event"),
+        ("POST", re.compile(r"^/calendar/v3/freeBusy$"), "free_busy"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method: str):
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        self.json_body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                status, body = getattr(self, name)(**match.groupdict())
+                return self._send(status, body)
+        self._send(404, {"error": {"code": 404, "message": f"No fake for {method} {url.path}"}})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _send(self, status: int, body: dict | None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Gmail
+
+    def get_profile(self):
+        mb = self.mailbox
+        return 200, {"emailAddress": "me@example.com", "messagesTotal": len(mb.messages),
+                     "threadsTotal": len(mb.messages) // 3 + 1, "historyId": str(mb.history_id)}
+
+    def list_history(self):
+        mb = self.mailbox
+        start = int(self.query.get("pageToken") or self.query.get("startHistoryId", 0))
+        max_results = int(self.query.get("maxResults", 100))
+        with mb.lock:
+            if start < 1000:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            records = [r for r in mb.history if int(r["id"]) > start]
+            body = {"historyId": str(mb.history_id)}
+        if records:
+            body["history"] = records[:max_results]
+        if len(records) > max_results:
+            body["nextPageToken"] = records[max_results - 1]["id"]
+        return 200, body
+
+    def list_messages(self):
+        mb = self.mailbox
+        query = self.query.get("q", "")
+        max_results = int(self.query.get("maxResults", 100))
+        offset = int(self.query.get("pageToken", 0))
+        msgid = re.search(r"rfc822msgid:(\S+)", query)
+        if msgid:
+            # Lets the outbox check whether a send went through
+            with mb.lock:
+                found = [{"id": s["id"], "threadId": s["threadId"]} for s in mb.sent
+                         if f"Message-ID: {msgid.group(1)}" in base64.urlsafe_b64decode(s["raw"]).decode(errors="replace")]
+            body = {"resultSizeEstimate": len(found)}
+            if found:
+                body["messages"] = found
+            return 200, body
+        with mb.lock:
+            ids = [m for m in mb.order if mb.matches(mb.messages[m], query)]
+        page = ids[offset:offset + max_results]
+        body = {"messages": [{"id": m, "threadId": mb.messages[m]["threadId"]} for m in page],
+                "resultSizeEstimate": len(ids)}
+        if offset + max_results < len(ids):
+            body["nextPageToken"] = str(offset + max_results)
+        if not page:
+            body.pop("messages")
+        return 200, body
+
+    def get_message(self, id: str):
+        msg = self.mailbox.messages.get(id)
+        if msg is None:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        body = {k: v for k, v in msg.items() if not k.startswith("_")}
+        if self.query.get("format") == "minimal":
+            body.pop("payload")
+        else:
+            body["payload"] = copy.deepcopy(body["payload"])
+            _rotate_attachment_ids(body["payload"], next(_fetches))
+        return 200, body
+
+    def get_attachment(self, id: str, attachment: str):
+        msg = self.mailbox.messages.get(id)
+        index = int(id, 16) if msg is not None else -1
+        if msg is None or attachment.split(".")[0] != f"att-{index}":
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        data = ("%PDF-1.4 " + "x" * self.mailbox.body_bytes).encode()
+        return 200, {"attachmentId": attachment, "size": len(data), "data": _b64(data)}
+
+    def get_thread(self, id: str):
+        mb = self.mailbox
+        with mb.lock:
+            messages = [{k: v for k, v in m.items() if not k.startswith("_")}
+                        for m in mb.messages.values() if m["threadId"] == id]
+        if not messages:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        messages.sort(key=lambda m: int(m["internalDate"]))
+        return 200, {"id": id, "historyId": max((m["historyId"] for m in messages), key=int), "messages": messages}
+
+    def modify_message(self, id: str):
+        mb = self.mailbox
+        with mb.lock:
+            msg = mb.messages.get(id)
+            if msg is None:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            self._apply_labels(msg, self.json_body)
+        return 200, {"id": id, "threadId": msg["threadId"], "labelIds": msg["labelIds"]}
+
+    def batch_modify(self):
+        mb = self.mailbox
+        with mb.lock:
+            for id in self.json_body.get("ids", []):
+                if id in mb.messages:
+                    self._apply_labels(mb.messages[id], self.json_body)
+        return 204, None
+
+    def _apply_labels(self, msg: dict, body: dict):
+        """ Applies add/removeLabelIds to a message and logs the change (caller holds the lock) """
+        remove = [l for l in body.get("removeLabelIds", []) if l in msg["labelIds"]]
+        add = [l for l in body.get("addLabelIds", []) if l not in msg["labelIds"]]
+        msg["labelIds"] = [l for l in msg["labelIds"] if l not in remove] + add
+        ref = {"id": msg["id"], "threadId": msg["threadId"], "labelIds": list(msg["labelIds"])}
+        record = {"messages": [ref]}
+        if remove:
+            record["labelsRemoved"] = [{"message": ref, "labelIds": remove}]
+        if add:
+            record["labelsAdded"] = [{"message": ref, "labelIds": add}]
+        msg["historyId"] = self.mailbox.bump_history(record)
+
+    def send_message(self):
+        mb = self.mailbox
+        with mb.lock:
+            msg_id = f"sent{len(mb.sent):012x}"
+            thread_id = self.json_body.get("threadId") or msg_id
+            mb.sent.append({"id": msg_id, "threadId": thread_id, "raw": self.json_body.get("raw", "")})
+            ref = {"id": msg_id, "threadId": thread_id, "labelIds": ["SENT"]}
+            mb.bump_history({"messages": [ref], "messagesAdded": [{"message": ref}]})
+        return 200, {"id": msg_id, "threadId": thread_id, "labelIds": ["SENT"]}
+
+    # Calendar
+
+    def list_events(self, calendar: str):
+        mb = self.mailbox
+        time_min = self.query.get("timeMin")
+        time_max = self.query.get("timeMax")
+        updated_min = self.query.get("updatedMin")
+        max_results = int(self.query.get("maxResults", 250))
+        with mb.lock:
+            items = [e for e in mb.events
+                     if (not time_min or e["end"]["dateTime"] > time_min)
+                     and (not time_max or e["start"]["dateTime"] < time_max)
+                     and (not updated_min
+                          or datetime.fromisoformat(e["updated"]) >= datetime.fromisoformat(updated_min))]
+            updated = max((e["updated"] for e in mb.events), key=datetime.fromisoformat, default=None)
+        return 200, {"kind": "calendar#events", "summary": calendar, "etag": f'"{mb.calendar_version}"',
+                     "updated": updated, "items": items[:max_results]}
+
+    def insert_event(self, calendar: str):
+        mb = self.mailbox
+        with mb.lock:
+            mb.calendar_version += 1
+            event = dict(self.json_body, id=f"evt{len(mb.events):06d}", status="confirmed",
+                         etag=f'"{len(mb.events)}-{mb.calendar_version}"',
+                         updated=datetime.now(timezone.utc).isoformat())
+            mb.events.append(event)
+            mb.events.sort(key=lambda e: e["start"]["dateTime"])
+        return 200, event
+
+    def free_busy(self):
+        mb = self.mailbox
+        time_min = datetime.fromisoformat(self.json_body["timeMin"])
+        time_max = datetime.fromisoformat(self.json_body["timeMax"])
+        with mb.lock:
+            busy = [{"start": e["start"]["dateTime"], "end": e["end"]["dateTime"]} for e in mb.events
+                    if datetime.fromisoformat(e["end"]["dateTime"]) > time_min
+                    and datetime.fromisoformat(e["start"]["dateTime"]) < time_max]
+        # Every requested calendar shares the synthetic events
+        calendars = {item["id"]: {"busy": busy} for item in self.json_body.get("items", [])}
+        return 200, {"kind": "calendar#freeBusy", "timeMin": self.json_body["timeMin"],
+                     "timeMax": self.json_body["timeMax"], "calendars": calendars}
+
+
+class FakeGoogle:
+    """ Runs the fake Gmail/Calendar server on a background thread """
+
+    def __init__(self, mailbox: Mailbox, host: str = "127.0.0.1", port: int = 0):
+        handler = type("Handler", (_Handler,), {"mailbox": mailbox})
+        self.mailbox = mailbox
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,68 @@
+import hashlib
+import re
+import time
+from typing import Any
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9']{3,}")
+_SEARCH_HINTS = ("find", "search", "look for", "from ", "about", "which email")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for the Gemini chat model.
+    The same prompt always produces the same answer after `latency_ms`, so runs are comparable.
+    """
+    latency_ms: float = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "mailmate-fake"
+
+    def bind_tools(self, tools: list, **kwargs: Any):
+        names = [getattr(t, "name", None) or t.__name__ for t in tools]
+        return self.bind(tool_names=names, **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None,
+                  tool_names: list[str] | None = None, **kwargs: Any) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        prompt = "\n".join(str(m.content) for m in messages)
+        if tool_names:
+            message = self._tool_call(prompt, tool_names)
+        else:
+            message = AIMessage(content=self._answer(prompt))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _tool_call(self, prompt: str, tool_names: list[str]) -> AIMessage:
+        lowered = prompt.lower()
+        call_id = "call_" + _digest(prompt)
+        if "summar" in lowered and "generate_inbox_summary" in tool_names:
+            return AIMessage(content="", tool_calls=[
+                {"name": "generate_inbox_summary", "args": {}, "id": call_id}])
+        if any(hint in lowered for hint in _SEARCH_HINTS) and "search_emails_tool" in tool_names:
+            return AIMessage(content="", tool_calls=[
+                {"name": "search_emails_tool", "args": {"query": prompt.strip()}, "id": call_id}])
+        return AIMessage(content=self._answer(prompt))
+
+    def _answer(self, prompt: str) -> str:
+        digest = _digest(prompt)
+        if "comma-separated list" in prompt:
+            query = prompt.rsplit("User Query:", 1)[-1]
+            return ", ".join(_WORD_RE.findall(query)[:3])
+        if "calendar event" in prompt:
+            return "{}"
+        if "===Variation" in prompt:
+            return "\n".join(
+                f"===Variation {i}===\nDear sender,\nReply {i} ({digest}).\nBest regards,\nMailMate"
+                for i in range(1, 4))
+        if "JSON array" in prompt or "list of dictionaries" in prompt:
+            return "[]"
+        return f"Fake response {digest} for a prompt of {len(prompt)} characters."
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
@@ -0,0 +1,110 @@
+"""
+Memory and CPU cost of email listings held as wire dicts versus EmailRecords.
+
+    cd be && python -m benchmarks.records --messages 10000
+
+Builds the same listing both ways, then reports the memory it takes (tracemalloc), the
+time to attach priorities (a copy per email, as prioritize does), the time to re-map it into
+the inbox summary's entries (which used to parse the ISO date of every email) and the time
+to serialize it to JSON the way FastJSONResponse and the shared state backend do.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import orjson
+
+from benchmarks.run import RESULTS_DIR
+from src.utils.records import EmailRecord, json_default
+
+_START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_records(n: int) -> list[EmailRecord]:
+    return [EmailRecord(
+        id=f"{i:016x}", thread_id=f"{i // 3:016x}", sender=f"Sender {i % 97} <sender{i % 97}@example.com>",
+        subject=f"Subject line number {i}", snippet=f"Snippet of message {i}, first words of the body...",
+        raw=f"Body of message {i}. " * 20, date=_START + timedelta(minutes=i),
+        label_ids=("INBOX", "UNREAD") if i % 2 else ("INBOX",),
+    ) for i in range(n)]
+
+
+def make_dicts(n: int) -> list[dict]:
+    # What parse_message used to return
+    return [record.to_wire() for record in make_records(n)]
+
+
+def _measure(build) -> tuple[object, int]:
+    tracemalloc.start()
+    value = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size
+
+
+def _time(fn, repeat: int) -> float:
+    """ Best of `repeat` runs, in milliseconds """
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def run(n: int, repeat: int) -> dict:
+    dicts, dicts_bytes = _measure(lambda: make_dicts(n))
+    records, records_bytes = _measure(lambda: make_records(n))
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+    return {
+        "messages": n,
+        "memory_bytes": {"dicts": dicts_bytes, "records": records_bytes},
+        "priority_ms": {
+            "dicts": _time(lambda: [dict(e, priorityScore=0.5, priority="High") for e in dicts], repeat),
+            "records": _time(lambda: [e.with_priority("High", 0.5) for e in records], repeat),
+        },
+        "remap_ms": {
+            "dicts": _time(lambda: [{"id": e["id"], "threadId": e["threadId"], "subject": e["subject"],
+                                     "sender": e["from"], "summary": e["raw"],
+                                     "date": datetime.fromisoformat(e["date"])} for e in dicts], repeat),
+            "records": _time(lambda: [{"id": e.id, "threadId": e.thread_id, "subject": e.subject,
+                                       "sender": e.sender, "summary": e.raw, "date": e.date} for e in records], repeat),
+        },
+        "serialize_ms": {
+            "dicts": _time(lambda: orjson.dumps(dicts, option=options), repeat),
+            "records": _time(lambda: orjson.dumps(records, default=json_default, option=options), repeat),
+        },
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000, help="emails in the listing")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs (the best one is reported)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/records-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    report = run(args.messages, args.repeat)
+    memory = report["memory_bytes"]
+    print(f"{args.messages} messages: dicts {memory['dicts'] / 2**20:.1f}MiB "
+          f"({memory['dicts'] / args.messages:.0f}B each), records {memory['records'] / 2**20:.1f}MiB "
+          f"({memory['records'] / args.messages:.0f}B each, {memory['records'] / memory['dicts']:.0%})")
+    for name in ("priority_ms", "remap_ms", "serialize_ms"):
+        print(f"  {name:<14} dicts {report[name]['dicts']:>8.1f}ms  records {report[name]['records']:>8.1f}ms")
+
+    report = {"created_at": datetime.now(timezone.utc).isoformat(), "python": sys.version.split()[0], **report}
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "records-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
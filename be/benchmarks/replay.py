@@ -0,0 +1,190 @@
+"""
+Replays traffic captured with TRAFFIC_CAPTURE_FILE against a backend running on local stand-ins.
+
+    cd be && python -m benchmarks.replay capture.jsonl --speed 2
+
+Requests are re-issued at their original relative times divided by --speed. Redacted
+text is filled with synthetic values of the same size, times are moved into the coming days,
+and message ids (in bodies and paths) are mapped onto the fake mailbox. Pass --target to replay against an already running server instead.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from benchmarks.fake_google import TOPICS, FakeGoogle, Mailbox
+from benchmarks.run import BENCH_TOKEN, RESULTS_DIR, backend, percentile
+
+_QUESTIONS = ["Summarize my inbox", "Find emails about the {topic}"]
+
+
+def load_capture(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["ts"])
+
+
+def _fill(value: str, replacement: str) -> str:
+    """ Swaps a redacted placeholder for synthetic text of the same length """
+    if not value or set(value) != {"x"}:
+        return value
+    return (replacement * (len(value) // len(replacement) + 1))[:len(value)]
+
+
+def _redacted(value) -> bool:
+    return isinstance(value, str) and bool(value) and set(value) == {"x"}
+
+
+def _fill_all(value, replacement: str = "lorem ipsum "):
+    """ Fills every redacted string left in a body """
+    if isinstance(value, str):
+        return _fill(value, replacement)
+    if isinstance(value, list):
+        return [_fill_all(v, replacement) for v in value]
+    if isinstance(value, dict):
+        return {k: _fill_all(v, replacement) for k, v in value.items()}
+    return value
+
+
+def _fill_time(value, n: int):
+    """ A redacted time (or {"dateTime", "timeZone"}) becomes one in the coming days """
+    when = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(hours=n % 72)
+    if _redacted(value):
+        return when.isoformat()
+    if isinstance(value, dict) and _redacted(value.get("dateTime")):
+        return {**value, "dateTime": when.isoformat(), "timeZone": "UTC"}
+    return value
+
+
+def rehydrate(record: dict, mailbox: Mailbox, n: int) -> tuple[str, str, dict, dict | None]:
+    """ Turns a captured record into (method, path, params, json body) for the fake mailbox """
+    topic = TOPICS[n % len(TOPICS)]
+    message_id = mailbox.order[n % len(mailbox.order)]
+    # Redacted message ids in the path, e.g. /email/xxxxxxxxxxxxxxxx/drafts
+    path = "/".join(message_id if _redacted(segment) else segment
+                    for segment in record["path"].split("/"))
+    params = {}
+    for k, values in (record.get("query") or {}).items():
+        if k in ("start", "end"):
+            params[k] = [_fill_time(v, n if k == "start" else n + 24) for v in values]
+        else:
+            params[k] = [_fill(v, topic) for v in values]
+    body = record.get("body")
+    if isinstance(body, dict):
+        body = dict(body)
+        if isinstance(body.get("ids"), list):
+            start = (n * len(body["ids"])) % max(len(mailbox.order), 1)
+            body["ids"] = [mailbox.order[(start + i) % len(mailbox.order)] for i in range(len(body["ids"]))]
+        if isinstance(body.get("id"), str):
+            body["id"] = message_id
+            if isinstance(body.get("threadId"), str):
+                body["threadId"] = mailbox.messages[message_id]["threadId"]
+        if isinstance(body.get("messages"), str):
+            question = _QUESTIONS[n % len(_QUESTIONS)].format(topic=topic)
+            body["messages"] = question if set(body["messages"]) <= {"x"} else body["messages"]
+        if _redacted(body.get("sessionId")):
+            # The captured conversation does not exist here; start a new one
+            body["sessionId"] = None
+        if isinstance(body.get("calendars"), list):
+            body["calendars"] = ["primary"] * len(body["calendars"])
+        for key, offset in (("start", n), ("end", n + 1), ("preferred", n)):
+            if key in body:
+                body[key] = _fill_time(body[key], offset)
+        if isinstance(body.get("to"), str):
+            body["to"] = _fill(body["to"], "me@example.com")
+        body = _fill_all(body)
+    return record["method"], path, params, body
+
+
+def replay(url: str, records: list[dict], mailbox: Mailbox, speed: float, max_inflight: int) -> list[dict]:
+    local = threading.local()
+    outcomes: list[dict] = []
+    lock = threading.Lock()
+
+    def issue(n: int, record: dict, scheduled: float):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.cookies.set("key", BENCH_TOKEN)
+        method, path, params, body = rehydrate(record, mailbox, n)
+        started = time.perf_counter()
+        try:
+            status = local.session.request(method, url + path, params=params, json=body, timeout=120).status_code
+        except requests.RequestException:
+            status = 0
+        with lock:
+            outcomes.append({"path": path, "method": method, "status": status,
+                             "latency": time.perf_counter() - started, "lag": started - scheduled})
+
+    t0 = records[0]["ts"] if records else 0
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        for n, record in enumerate(records):
+            scheduled = begin + (record["ts"] - t0) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(issue, n, record, scheduled)
+    return outcomes
+
+
+def summarize(outcomes: list[dict]) -> dict:
+    groups = defaultdict(list)
+    for o in outcomes:
+        groups[f"{o['method']} {o['path']}"].append(o)
+    groups["all"] = outcomes
+    summary = {}
+    for key, items in groups.items():
+        latencies = sorted(o["latency"] for o in items)
+        summary[key] = {
+            "requests": len(items),
+            "errors": sum(1 for o in items if not 200 <= o["status"] < 400),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_lag_ms": round(max((o["lag"] for o in items), default=0) * 1000, 3),
+        }
+    return summary
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="JSONL file written by TRAFFIC_CAPTURE_FILE")
+    parser.add_argument("--speed", type=float, default=1.0, help="rate multiplier (2 = twice as fast)")
+    parser.add_argument("--max-inflight", type=int, default=64, help="cap on concurrent requests")
+    parser.add_argument("--target", help="replay against this running server instead of starting one")
+    parser.add_argument("--messages", type=int, default=200, help="synthetic mailbox size")
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/replay-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    records = load_capture(args.capture)
+    mailbox = Mailbox(args.messages)
+    with FakeGoogle(mailbox) as google:
+        server = nullcontext(args.target) if args.target else backend(google.url, args.llm_latency_ms)
+        with server as url:
+            outcomes = replay(url, records, mailbox, args.speed, args.max_inflight)
+
+    summary = summarize(outcomes)
+    for key, s in sorted(summary.items()):
+        print(f"{key:<32} n={s['requests']:<5} p50={s['p50_ms']:>9.1f}ms p95={s['p95_ms']:>9.1f}ms "
+              f"p99={s['p99_ms']:>9.1f}ms errors={s['errors']} max_lag={s['max_lag_ms']:.1f}ms")
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "replay-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump({"created_at": datetime.now(timezone.utc).isoformat(), "params": vars(args),
+                   "summary": summary}, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
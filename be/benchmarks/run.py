@@ -0,0 +1,229 @@
+"""
+Offline latency/throughput benchmark for the backend.
+
+    cd be && python -m benchmarks.run --messages 500 --concurrency 1,4,16
+
+Starts the fake Gmail/Calendar server, launches `uvicorn main:app` against it with the fake
+chat model, drives the endpoints at each concurrency level and writes a JSON report that
+`python -m benchmarks.compare` can diff against a previous run.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from benchmarks.fake_google import MIME_SHAPES, FakeGoogle, Mailbox
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BE_DIR, "benchmarks", "results")
+BENCH_TOKEN = "bench-token"
+BENCH_ADMIN_TOKEN = "bench-admin-token"
+
+
+def _scenarios(mailbox: Mailbox) -> dict:
+    """ name -> (method, path, json body factory) """
+    ids = mailbox.order[:10]
+    # Distinct instructions per request, so replies are generated rather than served from cache
+    reply_numbers = itertools.count()
+    with_attachment = next((m for m in mailbox.order if mailbox.messages[m]["payload"]["mimeType"] == "multipart/mixed"),
+                           ids[0])
+    return {
+        "email": ("GET", "/email/?count=10", None),
+        "calendar": ("GET", "/calendar/", None),
+        "assistant_chat": ("POST", "/assistant/chat",
+                           lambda: {"messages": "Summarize my inbox", "system": "You are a helpful assistant."}),
+        # Repeated turns of one conversation reuse the session's earlier tool results
+        "assistant_followup": ("POST", "/assistant/chat",
+                               lambda: {"messages": "Summarize my inbox", "system": "You are a helpful assistant.",
+                                        "sessionId": "bench-session"}),
+        "mark_as_read": ("POST", "/email/mark-as-read", lambda: {"ids": ids}),
+        "smart_replies": ("POST", f"/email/{ids[0]}/replies",
+                          lambda: {"tone": "Friendly", "count": 3, "instructions": f"ref {next(reply_numbers)}"}),
+        "attachment": ("GET", f"/email/{with_attachment}/attachments/1", None),
+        # A month of free/busy times, searched minute by minute within working hours
+        "suggest_slots": ("POST", "/calendar/suggest-slots",
+                          lambda: {"start": datetime.now(timezone.utc).isoformat(),
+                                   "end": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+                                   "durationMinutes": 60, "count": 5}),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def backend(google_url: str, llm_latency_ms: float, port: int | None = None, extra_env: dict | None = None):
+    """ Runs `uvicorn main:app` against the fake Google server and yields its base URL """
+    port = port or free_port()
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({BENCH_TOKEN: {"credentials": {
+            "access_token": "fake-access-token",
+            "refresh_token": "fake-refresh-token",
+            "token_uri": f"{google_url}/token",
+            "client_id": "bench",
+            "client_secret": "bench",
+            "scopes": [],
+        }}}, f)
+        tokens_file = f.name
+    scratch_dir = tempfile.TemporaryDirectory()
+    env = {**os.environ,
+           "GOOGLE_API_ENDPOINT": google_url,
+           "LLM_PROVIDER": "fake",
+           "FAKE_LLM_LATENCY_MS": str(llm_latency_ms),
+           "USER_TOKENS_FILE": tokens_file,
+           "ADMIN_TOKEN": BENCH_ADMIN_TOKEN,
+           "ATTACHMENT_CACHE_DIR": os.path.join(scratch_dir.name, "attachments"),
+           "OUTBOX_DB": os.path.join(scratch_dir.name, "outbox.db"),
+           "SEARCH_INDEX_DIR": os.path.join(scratch_dir.name, "search_index"),
+           # A snapshot left by an earlier run would make the first requests warm
+           "CACHE_SNAPSHOT_FILE": os.path.join(scratch_dir.name, "cache_snapshot.bin"),
+           # Background warm-ups would skew cold-path measurements; opt in via extra_env
+           "PREFETCH_INTERVAL": "0",
+           **(extra_env or {})}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BE_DIR, env=env)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_up(url, proc)
+        yield url
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        os.unlink(tokens_file)
+        scratch_dir.cleanup()
+
+
+def _wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {proc.returncode}")
+        try:
+            requests.get(url + "/", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise TimeoutError("Backend did not start in time")
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def drive(url: str, method: str, path: str, body_factory, concurrency: int, total: int) -> dict:
+    """ Issues `total` requests with `concurrency` workers and summarises the latencies """
+    def worker(n: int) -> tuple[list[float], int]:
+        latencies, errors = [], 0
+        with requests.Session() as session:
+            session.cookies.set("key", BENCH_TOKEN)
+            for _ in range(n):
+                started = time.perf_counter()
+                try:
+                    response = session.request(method, url + path,
+                                               json=body_factory() if body_factory else None, timeout=120)
+                    if response.status_code >= 400:
+                        errors += 1
+                except requests.RequestException:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+        return latencies, errors
+
+    shares = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(worker, shares))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for outcome in outcomes for l in outcome[0])
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(outcome[1] for outcome in outcomes),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BE_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200, help="synthetic mailbox size")
+    parser.add_argument("--events", type=int, default=50, help="synthetic calendar size")
+    parser.add_argument("--body-bytes", type=int, default=2000, help="plain-text body size per message")
+    parser.add_argument("--shapes", default=",".join(MIME_SHAPES), help="MIME shapes to cycle through")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario and level")
+    parser.add_argument("--llm-latency-ms", type=float, default=50, help="fake chat model latency")
+    parser.add_argument("--scenarios", default="email,calendar,assistant_chat,mark_as_read")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(",")]
+    mailbox = Mailbox(args.messages, args.events, tuple(args.shapes.split(",")), args.body_bytes, args.seed)
+    scenarios = _scenarios(mailbox)
+
+    results = []
+    with FakeGoogle(mailbox) as google, backend(google.url, args.llm_latency_ms) as url:
+        for name in args.scenarios.split(","):
+            method, path, body_factory = scenarios[name]
+            for level in levels:
+                mailbox.reset()
+                result = drive(url, method, path, body_factory, level, args.requests)
+                result["scenario"] = name
+                results.append(result)
+                print(f"{name:<16} c={level:<3} p50={result['p50_ms']:>9.1f}ms p95={result['p95_ms']:>9.1f}ms "
+                      f"p99={result['p99_ms']:>9.1f}ms {result['throughput_rps']:>8.1f} req/s "
+                      f"errors={result['errors']}")
+        quota = requests.get(url + "/metrics/quota", timeout=10,
+                             headers={"Authorization": f"Bearer {BENCH_ADMIN_TOKEN}"}).json()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "results": results,
+        "google_quota": quota,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
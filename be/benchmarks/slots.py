@@ -0,0 +1,73 @@
+"""
+Scaling of the free-slot finder with the window length and the number of calendars.
+
+    cd be && python -m benchmarks.slots --days 7,30,90,365 --calendars 1,10,50
+
+Runs find_slots (no Google calls) over synthetic busy times: each calendar has a couple of
+30-90 minute meetings a week at any time of day (teammates in other time zones). Reports the
+best of a few runs per combination.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.run import RESULTS_DIR
+from src.services.slots import find_slots
+
+MEETINGS_PER_WEEK = 2
+
+
+def make_busy(start: datetime, days: int, calendars: int, seed: int = 0) -> list[list[str]]:
+    rng = random.Random(seed)
+    busy = []
+    for _ in range(calendars * days * MEETINGS_PER_WEEK // 7):
+        meeting = start + timedelta(days=rng.randrange(days), minutes=rng.randrange(0, 24 * 60, 15))
+        busy.append([meeting.isoformat(), (meeting + timedelta(minutes=rng.choice([30, 60, 90]))).isoformat()])
+    return busy
+
+
+def run(days: int, calendars: int, repeat: int) -> dict:
+    start = datetime(2026, 1, 5, 1, tzinfo=timezone.utc)
+    busy = make_busy(start, days, calendars)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        slots = find_slots(busy, start, start + timedelta(days=days), 60, 5)
+        best = min(best, time.perf_counter() - started)
+    return {"days": days, "calendars": calendars, "busy_times": len(busy), "slots": len(slots),
+            "ms": round(best * 1000, 3)}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", default="7,30,90,365", help="comma-separated window lengths")
+    parser.add_argument("--calendars", default="1,10,50", help="comma-separated calendar counts")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs (the best one is reported)")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/slots-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for days in (int(d) for d in args.days.split(",")):
+        for calendars in (int(c) for c in args.calendars.split(",")):
+            result = run(days, calendars, args.repeat)
+            results.append(result)
+            print(f"{days:>4} days x {calendars:>3} calendars ({result['busy_times']:>6} busy times): "
+                  f"{result['ms']:>8.1f}ms, {result['slots']} slots")
+
+    report = {"created_at": datetime.now(timezone.utc).isoformat(), "python": sys.version.split()[0],
+              "results": results}
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "slots-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
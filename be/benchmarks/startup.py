@@ -0,0 +1,125 @@
+"""
+Cold-start report for the backend.
+
+    cd be && python -m benchmarks.startup --runs 3 --top 15
+
+Breaks down `python -X importtime -c "import main"` by top-level package, then starts
+`uvicorn main:app` a few times and measures how long it takes until the server answers and
+what /health/ready reports (startup time and the background warm-up imports).
+
+Finally it compares first-request latencies after a cold start, in steady state and after a
+restart from the cache snapshot the previous process saved on shutdown.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+from benchmarks.fake_google import FakeGoogle, Mailbox
+from benchmarks.run import BE_DIR, RESULTS_DIR, _scenarios, backend, drive
+
+RESTART_SCENARIOS = ("email", "calendar", "assistant_chat")
+
+
+def import_times(env: dict | None = None) -> dict:
+    """ Microseconds spent importing each top-level package while importing main """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BE_DIR,
+                            env={**os.environ, **(env or {})}, capture_output=True, text=True, check=True)
+    packages = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        packages[name.strip().split(".")[0]] += int(self_us)
+    return dict(sorted(packages.items(), key=lambda item: -item[1]))
+
+
+def time_to_ready() -> dict:
+    """ Starts the backend once; returns seconds until it answered and its readiness report """
+    started = time.perf_counter()
+    # No Google calls happen at startup, so the endpoint does not need to exist
+    with backend("http://127.0.0.1:9", 0) as url:
+        up = time.perf_counter() - started
+        status = requests.get(url + "/health/ready", timeout=10).json()
+        deadline = time.monotonic() + 60
+        while status["warmup"]["enabled"] and not status["warmup"]["done"] and time.monotonic() < deadline:
+            time.sleep(0.2)
+            status = requests.get(url + "/health/ready", timeout=10).json()
+    return {"up_seconds": round(up, 3), "health": status}
+
+
+def warm_restart(messages: int) -> dict:
+    """ Milliseconds of the first request per scenario: cold, again (steady state), after a restart """
+    mailbox = Mailbox(messages)
+    scenarios = {name: _scenarios(mailbox)[name] for name in RESTART_SCENARIOS}
+
+    def first_requests(url: str) -> dict:
+        return {name: drive(url, *scenario, 1, 1)["mean_ms"] for name, scenario in scenarios.items()}
+
+    with tempfile.TemporaryDirectory() as scratch, FakeGoogle(mailbox) as google:
+        env = {"CACHE_SNAPSHOT_FILE": os.path.join(scratch, "cache_snapshot.bin")}
+        # Stopping the server (SIGTERM) saves the snapshot the second one starts from
+        with backend(google.url, 0, extra_env=env) as url:
+            cold = first_requests(url)
+            steady = first_requests(url)
+        with backend(google.url, 0, extra_env=env) as url:
+            restored = requests.get(url + "/health/ready", timeout=10).json()["restoredCacheEntries"]
+            restarted = first_requests(url)
+    return {"cold_ms": cold, "steady_ms": steady, "restarted_ms": restarted, "restored_entries": restored}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="server starts to time")
+    parser.add_argument("--top", type=int, default=15, help="packages to print")
+    parser.add_argument("--messages", type=int, default=200, help="synthetic mailbox size for the restart test")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/startup-<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    packages = import_times({"LLM_PROVIDER": "fake"})
+    total = sum(packages.values())
+    print(f"import main: {total / 1000:.0f}ms")
+    for name, us in list(packages.items())[:args.top]:
+        print(f"  {name:<32} {us / 1000:>8.1f}ms {us / total:>6.1%}")
+
+    starts = []
+    for _ in range(args.runs):
+        start = time_to_ready()
+        starts.append(start)
+        warmup = start["health"]["warmup"]
+        print(f"server up after {start['up_seconds'] * 1000:.0f}ms "
+              f"(ready after {start['health']['readyAfterSeconds'] * 1000:.0f}ms in-process), "
+              f"warm-up {sum(warmup['importMs'].values()):.0f}ms, {len(warmup['errors'])} import errors")
+
+    restart = warm_restart(args.messages)
+    print(f"restart from snapshot ({restart['restored_entries']} entries restored), first request:")
+    for name in RESTART_SCENARIOS:
+        print(f"  {name:<16} cold {restart['cold_ms'][name]:>8.1f}ms  steady {restart['steady_ms'][name]:>8.1f}ms"
+              f"  restarted {restart['restarted_ms'][name]:>8.1f}ms")
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "import_total_us": total,
+        "import_us_by_package": packages,
+        "starts": starts,
+        "warm_restart": restart,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, "startup-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
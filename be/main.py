@@ -1,21 +1,31 @@
+import asyncio
+import signal
 from dotenv import load_dotenv
 from fastapi import FastAPI
 import logging
 import os
 from contextlib import asynccontextmanager
-import sys
 
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.middleware.compression import CompressionMiddleware
 from src.repo.auth import load_user_tokens
+from src.repo.snapshots import load_snapshot, save_snapshot
+from src.services.mail_events import stop_watchers
+from src.services.outbox import workers as outbox_workers
+from src.services.prefetch import PREFETCH_INTERVAL, PrefetchScheduler
 from src.utils.logging import setup_logger
+from src.utils.startup import WARMUP, startup
 from src.controllers import email
 from src.controllers import auth
 from src.controllers import calendar
 from src.controllers import assistant
+from src.controllers import metrics
+from src.controllers import health
 from src.utils.logging import LoggingRoute
+from src.utils.responses import FastJSONResponse
 
 load_dotenv()
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
@@ -24,26 +34,64 @@ logger: logging.Logger = logging.getLogger('uvicorn.error')
 print = logger.info
 
 
+# The server's own handlers, which start its graceful shutdown
+_server_handlers = {}
+
+
 def receive_signal(signalNumber, frame):
-    print('Received:', signalNumber)
-    sys.exit()
+    # Only flags are set here: logging (or anything else taking a lock) from a signal handler
+    # can re-enter a call it interrupted. Readiness checks fail and event streams end right
+    # away; the server then stops accepting connections, waits for the running requests and
+    # runs the lifespan shutdown
+    startup.mark_stopping()
+    handler = _server_handlers.get(signalNumber)
+    if callable(handler):
+        handler(signalNumber, frame)
+    else:
+        signal.signal(signalNumber, signal.SIG_DFL)
+        signal.raise_signal(signalNumber)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Load the ML model
-    import signal
-    signal.signal(signal.SIGINT, receive_signal)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        _server_handlers[signum] = signal.getsignal(signum)
+        signal.signal(signum, receive_signal)
     load_user_tokens()
+    # Caches saved by the previous process on shutdown (memory state backend only)
+    startup.restored_entries = load_snapshot()
+    prefetcher = PrefetchScheduler()
+    if PREFETCH_INTERVAL > 0:
+        prefetcher.start()
+    outbox_workers.start()
+    # Heavy libraries are imported on first use; load them in the background so the
+    # server is ready right away and the first requests do not wait for them either
+    warmup = asyncio.create_task(asyncio.to_thread(startup.warm_up)) if WARMUP else None
+    startup.mark_ready()
     logger.info("Pre-startup preparation completed. Starting FastAPI server...")
     # startup tasks
     yield
+    # The server has drained the running requests by now
+    logger.info("Shutting down")
+    startup.mark_stopping()
+    if warmup is not None:
+        await warmup
     # Clean up the ML models and release the resources
+    await prefetcher.stop()
+    # Lets the sends in progress finish rather than leaving them to a lease takeover
+    await outbox_workers.stop()
+    await stop_watchers()
+    # Nothing writes to the caches any more; the next process starts from them
+    await asyncio.to_thread(save_snapshot)
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 app.router.route_class = LoggingRoute
 
-app.add_middleware(SessionMiddleware, secret_key="your_secret_key")
+app.add_middleware(CompressionMiddleware,
+                   minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+# All workers must sign session cookies with the same key
+app.add_middleware(SessionMiddleware, secret_key=os.getenv("SESSION_SECRET_KEY", "your_secret_key"))
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:8501"],
@@ -62,3 +110,5 @@ app.include_router(auth.router)
 app.include_router(email.router)
 app.include_router(calendar.router)
 app.include_router(assistant.router)
+app.include_router(metrics.router)
+app.include_router(health.router)
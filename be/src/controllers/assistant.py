@@ -1,11 +1,13 @@
 import asyncio
+from dataclasses import asdict, replace
 from io import StringIO
 import logging
 import time
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from starlette.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from tools.prompt_budget import PROMPT_BUDGET_TOKENS, FieldBudget, fit_emails
 from tools.tools import call_tool
 from src.utils.logging import LoggingRoute
 from src.middleware.auth import require_auth
@@ -29,13 +31,48 @@ async def generate_data():
 class ChatRequest(BaseModel):
     messages: str
     system: str | None = None
+    # Continues an earlier conversation; the id comes back in the X-Session-Id header
+    sessionId: str | None = None
 
 
+# Sync handler: the tools block on Google and LLM calls (and may wait on an identical
+# in-flight call), so it runs in the threadpool instead of the event loop
 @router.post("/chat")
-async def chat(request: ChatRequest, token: str = Depends(require_auth)):
-    response = call_tool(token, request.messages, request.system)
+def chat(request: ChatRequest, token: str = Depends(require_auth)):
+    response, session_id = call_tool(token, request.messages, request.system, request.sessionId)
     logger.info(f"Response: {response}")
     return StreamingResponse(
         StringIO(response),
         media_type="text/plain",
+        headers={"X-Session-Id": session_id},
     )
+
+
+class FitEmailsRequest(BaseModel):
+    emails: list[dict]
+    bodyKey: str = "raw"
+    senderKey: str = "from"
+    # One per email, higher is more important; by default the last emails are cut first
+    scores: list[float] | None = None
+    budget: int = Field(default=PROMPT_BUDGET_TOKENS, ge=1)
+    # Overrides of the FieldBudget defaults
+    subject: int | None = Field(default=None, ge=0)
+    sender: int | None = Field(default=None, ge=0)
+    bodyHead: int | None = Field(default=None, ge=0)
+    bodyTail: int | None = Field(default=None, ge=0)
+    bodyMin: int | None = Field(default=None, ge=0)
+
+
+@router.post("/fit-emails")
+def fit_emails_route(request: FitEmailsRequest, token: str = Depends(require_auth)):
+    """
+    Fits emails into a prompt's token budget the way the assistant's own prompts are, for
+    clients that prompt an LLM themselves: {"emails", "tokens", "truncated", "dropped"}
+    """
+    if request.scores is not None and len(request.scores) != len(request.emails):
+        raise HTTPException(status_code=400, detail="scores must have one entry per email")
+    overrides = {"subject": request.subject, "sender": request.sender, "body_head": request.bodyHead,
+                 "body_tail": request.bodyTail, "body_min": request.bodyMin}
+    fields = replace(FieldBudget(), **{k: v for k, v in overrides.items() if v is not None})
+    return asdict(fit_emails(request.emails, request.budget, fields, request.bodyKey, request.senderKey,
+                             request.scores))
@@ -1,13 +1,12 @@
 import logging
 import os
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import RedirectResponse
-from google_auth_oauthlib.flow import Flow
 from pydantic import BaseModel
 from uuid import uuid4
 
-from src.repo.auth import save_user_tokens, set_user_tokens
+from src.repo.auth import save_user_tokens, set_user_tokens, touch_user
 from src.utils.logging import LoggingRoute
 
 logger: logging.Logger = logging.getLogger('uvicorn.error')
@@ -26,6 +25,13 @@ SCOPES = ["https://www.googleapis.com/auth/gmail.readonly",
           "https://www.googleapis.com/auth/calendar.events"]
 
 
+def _flow(redirect_uri: str, state: str | None = None):
+    # Imported on first use: google_auth_oauthlib is slow to load and only needed to sign in
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_secrets_file(CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri=redirect_uri,
+                                         state=state)
+
+
 @router.get("/login")
 def login(request: Request):
     """ Initiates the OAuth flow """
@@ -33,16 +39,13 @@ def login(request: Request):
     CURRENT_HOSTNAME = os.getenv("CURRENT_HOSTNAME", "http://127.0.0.1:8101")
     # This is a backend endpoint
     REDIRECT_URI = f"{CURRENT_HOSTNAME}/auth/callback"
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE,
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI,
-    )
+    flow = _flow(REDIRECT_URI)
     authorization_url, state = flow.authorization_url(
         access_type='offline',
         prompt="consent"
     )
-    request.session["state"] = state  # temp solution to store state in memory
+    # The session cookie is signed with SESSION_SECRET_KEY, so any worker can check it in the callback
+    request.session["state"] = state
     return RedirectResponse(authorization_url)
 
 
@@ -53,13 +56,11 @@ async def callback(request: Request):
     CURRENT_HOSTNAME = os.getenv("CURRENT_HOSTNAME", "http://127.0.0.1:8101")
     # This is a backend endpoint
     REDIRECT_URI = f"{CURRENT_HOSTNAME}/auth/callback"
-    state = request.session.get("state")
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE,
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI,
-        state=state
-    )
+    # The state must be the one issued to this browser, or someone else's sign-in could be completed here
+    state = request.query_params.get("state")
+    if not state or state != request.session.pop("state", None):
+        raise HTTPException(status_code=400, detail="Invalid OAuth state")
+    flow = _flow(REDIRECT_URI, state)
 
     # Use the full URL (which contains the code and state) for fetching the token
     flow.fetch_token(authorization_response=str(request.url))
@@ -80,6 +81,7 @@ async def callback(request: Request):
     })
  # Store the credentials in the session.
     save_user_tokens()  # Save the tokens to a file or database
+    touch_user(str(new_uuid))  # lets the prefetcher warm the inbox before the first page load
     # At this point, you have the tokens. You might store them, set a session cookie, etc.
     # Then redirect the user back to your frontend application.
     response = RedirectResponse(STREAMLIST_HOSTNAME)  # Redirect to frontend
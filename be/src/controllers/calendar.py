@@ -1,9 +1,14 @@
-from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from datetime import datetime, time, timedelta, timezone
+from typing import Annotated
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from pydantic import BaseModel, Field
 
+from src.utils.etag import etag_matches
 from src.utils.logging import LoggingRoute
-from src.services.calendar import get_events, add_event as add_event_service
+from src.utils.responses import FastJSONResponse
+from src.services.calendar import get_events_with_etag, add_event as add_event_service
+from src.services.slots import MAX_WINDOW_DAYS, WorkingHours, suggest_slots as suggest_slots_service
 from src.middleware.auth import require_auth
 
 router = APIRouter(
@@ -14,8 +19,14 @@ router = APIRouter(
 
 
 @router.get("/")
-def get(start: str | None = None, end: str | None = None, token: str = Depends(require_auth)):
-    return get_events(token, start, end, "primary")
+def get(start: str | None = None, end: str | None = None,
+        if_none_match: Annotated[str | None, Header()] = None,
+        token: str = Depends(require_auth)):
+    etag, events = get_events_with_etag(token, start, end, "primary")
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(events, headers=headers)
 
 
 class AddEventReq(BaseModel):
@@ -48,3 +59,53 @@ def add_event(request: AddEventReq, token: str = Depends(require_auth)):
     if not request.summary:
         raise HTTPException(status_code=400, detail="summary is required")
     return add_event_service(token, request.summary, request.location, request.description, request.start, request.end)
+
+
+class SuggestSlotsReq(BaseModel):
+    start: str
+    end: str
+    durationMinutes: int = Field(default=60, ge=5, le=24 * 60)
+    count: int = Field(default=5, ge=1, le=20)
+    # The time the event was asked for; the closest free slots come first
+    preferred: str | None = None
+    calendars: list[str] = Field(default_factory=lambda: ["primary"], min_length=1, max_length=500)
+    timeZone: str = "Asia/Singapore"
+    workStart: str = "09:00"
+    workEnd: str = "18:00"
+    # Monday = 0
+    workDays: list[int] = Field(default_factory=lambda: [0, 1, 2, 3, 4])
+    stepMinutes: int = Field(default=15, ge=5, le=240)
+
+
+def _parse_time(value: str, tz: ZoneInfo, name: str) -> datetime:
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} is not a valid datetime")
+    # Times without an offset are in the requested time zone
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=tz)
+
+
+@router.post("/suggest-slots")
+def suggest_slots(request: SuggestSlotsReq, token: str = Depends(require_auth)):
+    """ The best free slots of the requested length within working hours, across the given calendars """
+    try:
+        tz = ZoneInfo(request.timeZone)
+        hours = WorkingHours(time.fromisoformat(request.workStart), time.fromisoformat(request.workEnd),
+                             tuple(request.workDays), request.timeZone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="timeZone or working hours are not valid")
+    if hours.end <= hours.start:
+        raise HTTPException(status_code=400, detail="workEnd must be after workStart")
+    # Slots in the past are of no use; whole minutes keep repeated requests on the same cache entry
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    start = max(_parse_time(request.start, tz, "start"), now)
+    end = _parse_time(request.end, tz, "end")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start (and in the future)")
+    if end - start > timedelta(days=MAX_WINDOW_DAYS):
+        raise HTTPException(status_code=400, detail=f"The window may span at most {MAX_WINDOW_DAYS} days")
+    preferred = _parse_time(request.preferred, tz, "preferred") if request.preferred else None
+    slots = suggest_slots_service(token, start, end, request.durationMinutes, request.count, request.calendars,
+                                  hours, preferred, request.stepMinutes)
+    return {"slots": slots}
@@ -1,11 +1,27 @@
-from typing import Annotated
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel
+import asyncio
+from typing import Annotated, Literal
+from urllib.parse import quote
+
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
 from fastapi import Depends
 
-from src.services.email import get_email, send_email, mark_as_read as mark_as_read_service
+from src.repo.auth import get_user_tokens
+from src.repo.outbox import get_outbox
+from src.services.attachments import iter_file, open_attachment, parse_range
+from src.services.drafts import get_drafts
+from src.services.email import get_email, get_mailbox_etag, get_message, mark_as_read as mark_as_read_service
+from src.services.mail_events import event_stream
+from src.services.outbox import workers as outbox_workers
+from src.services.priority import prioritize
+from src.services.semantic_search import semantic_search
+from src.utils.etag import etag_matches
+from src.utils.responses import FastJSONResponse
 from src.middleware.auth import require_auth
 from src.utils.logging import LoggingRoute
+from tools.smart_replies import MAX_VARIATIONS, generate_replies
 
 router = APIRouter(
     prefix="/email",
@@ -14,12 +30,157 @@ router = APIRouter(
 )
 
 
-@router.get("/")
-async def get(count: int | None = 10,
-              includeRead: bool | None = False,
-              q: Annotated[list[str] | None, Query()] = None,
-              token: str = Depends(require_auth)):
-    return {"message": get_email(token, count, includeRead, q)}
+class AttachmentOut(BaseModel):
+    partId: str = ""
+    attachmentId: str
+    filename: str
+    mimeType: str
+    size: int
+
+
+class EmailOut(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    from_: str = Field(alias="from")
+    subject: str
+    snippet: str | None = None
+    raw: str | None = None
+    threadId: str | None = None
+    id: str
+    labelIds: list[str] = []
+    date: str
+    attachments: list[AttachmentOut] = []
+    priority: Literal["High", "Low"] | None = None
+    priorityScore: float | None = None
+
+
+class EmailListResponse(BaseModel):
+    message: list[EmailOut]
+
+
+# Documented, not enforced: the service already produces EmailListResponse-shaped data and
+# orjson encodes it directly, without re-validating every email
+@router.get("/", response_class=FastJSONResponse, responses={200: {"model": EmailListResponse}})
+def get(count: int | None = 10,
+        includeRead: bool | None = False,
+        q: Annotated[list[str] | None, Query()] = None,
+        if_none_match: Annotated[str | None, Header()] = None,
+        token: str = Depends(require_auth)):
+    # Validating costs one getProfile call; the full fan-out only runs when the mailbox changed
+    try:
+        history_id, etag = get_mailbox_etag(token, count, includeRead, q)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+    # Clients that follow /email/events start from it (Last-Event-ID), so no change made
+    # between this listing and their subscription is missed
+    headers = {"ETag": etag, "X-History-Id": history_id, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    emails = get_email(token, count, includeRead, q, etag=etag)
+    if isinstance(emails, JSONResponse):
+        return emails
+    emails = prioritize(token, emails)
+    return FastJSONResponse({"message": emails}, headers=headers)
+
+
+@router.get("/search", response_class=FastJSONResponse)
+def search(q: str, k: Annotated[int, Query(ge=1, le=50)] = 10, token: str = Depends(require_auth)):
+    """ Emails whose meaning is closest to the query, from the local index (no Gmail or LLM call) """
+    return FastJSONResponse({"results": semantic_search(token, q, k)})
+
+
+@router.get("/events")
+async def events(request: Request, token: str = Depends(require_auth),
+                 last_event_id: Annotated[str | None, Header()] = None):
+    """
+    Server-sent events for new messages and label changes. All tabs of a user share one
+    history poller; reconnecting clients get what they missed since Last-Event-ID.
+    """
+    if get_user_tokens(token) is None:
+        raise HTTPException(status_code=401, detail="User token not found.")
+    return StreamingResponse(
+        event_stream(request, token, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class RepliesRequest(BaseModel):
+    tone: Literal["Professional", "Friendly", "Concise"] = "Professional"
+    instructions: str = ""
+    signOff: str = "Jerome"
+    count: int = Field(default=1, ge=1, le=MAX_VARIATIONS)
+
+
+@router.post("/{id}/replies")
+async def replies(id: str, request: RepliesRequest, token: str = Depends(require_auth)):
+    """
+    Generates reply variations for a message concurrently and streams them as NDJSON, one
+    {"index", "text", "cached"} (or {"index", "error"}) line per variation as soon as it is ready.
+    """
+    from googleapiclient.errors import HttpError
+
+    try:
+        email = await asyncio.to_thread(get_message, token, id)
+    except HttpError as e:
+        status = 404 if e.resp.status == 404 else 502
+        raise HTTPException(status_code=status, detail=f"Could not load message {id}: {e.reason}")
+
+    async def lines():
+        async for variation in generate_replies(token, email, request.tone, request.instructions,
+                                                request.signOff, request.count):
+            yield orjson.dumps(variation) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.get("/{id}/drafts", response_class=FastJSONResponse)
+def drafts(id: str, token: str = Depends(require_auth)):
+    """ Reply drafts prepared in the background for a high-priority message, if any """
+    return FastJSONResponse({"drafts": get_drafts(token, id)})
+
+
+@router.get("/{id}/attachments/{part_id}")
+def attachment(id: str, part_id: str,
+               range: Annotated[str | None, Header()] = None,
+               if_range: Annotated[str | None, Header()] = None,
+               token: str = Depends(require_auth)):
+    """
+    Streams an attachment, identified by its partId, from the disk cache (fetched from Gmail on first use).
+    Supports single byte ranges, e.g. for resuming downloads or PDF viewers.
+    """
+    from googleapiclient.errors import HttpError
+
+    try:
+        meta, f = open_attachment(token, id, part_id)
+    except HttpError as e:
+        status = 404 if e.resp.status in (400, 404) else 502
+        raise HTTPException(status_code=status, detail=f"Could not load attachment: {e.reason}")
+    size = meta["size"]
+    etag = f'"{meta["sha256"]}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Cache-Control": "private, max-age=86400",
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(meta['filename'])}",
+    }
+    start, end, status = 0, size - 1, 200
+    # If-Range: only honour the range when the client still has this version
+    if range and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range, size)
+        except ValueError:
+            f.close()
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file(f, start, end), status_code=status,
+                             media_type=meta["mimeType"], headers=headers)
 
 
 class SendEmailRequest(BaseModel):
@@ -30,8 +191,15 @@ class SendEmailRequest(BaseModel):
     id: str | None = None
 
 
+# Sync handlers: the Google client and the quota limiter block, so they run in the threadpool
 @router.post("/send")
-async def send(request: SendEmailRequest, token: str = Depends(require_auth)):
+def send(request: SendEmailRequest, token: str = Depends(require_auth),
+         idempotency_key: Annotated[str | None, Header()] = None):
+    """
+    Queues an email and answers 202 with a status id to poll. Retrying with the same
+    Idempotency-Key header returns the original job instead of sending the email twice;
+    a job that failed is queued again.
+    """
     if not request.to:
         raise HTTPException(status_code=400, detail="to is required")
     if not request.subject:
@@ -42,7 +210,26 @@ async def send(request: SendEmailRequest, token: str = Depends(require_auth)):
         raise HTTPException(
             status_code=400, detail="threadId and id are required together")
 
-    return send_email(token, request.to, request.subject, request.body, request.id, request.threadId)
+    # Queued in the outbox; the workers send it in the background
+    job, created = get_outbox().enqueue(token, request.model_dump(), idempotency_key)
+    if created:
+        outbox_workers.notify()
+    return FastJSONResponse(_send_status(job), status_code=202,
+                            headers={"Location": f"/email/send/{job['id']}"})
+
+
+def _send_status(job: dict) -> dict:
+    return {"id": job["id"], "status": job["status"], "attempts": job["attempts"],
+            "error": job["error"], "result": job["result"]}
+
+
+@router.get("/send/{job_id}")
+def send_status(job_id: str, token: str = Depends(require_auth)):
+    """ Status of a queued email: queued, sending, sent (with the Gmail id) or failed """
+    job = get_outbox().get(job_id)
+    if job is None or job["user"] != token:
+        raise HTTPException(status_code=404, detail="Send job not found.")
+    return FastJSONResponse(_send_status(job))
 
 
 class MarkAsReadRequest(BaseModel):
@@ -50,7 +237,7 @@ class MarkAsReadRequest(BaseModel):
 
 
 @router.post("/mark-as-read")
-async def mark_as_read(request: MarkAsReadRequest, token: str = Depends(require_auth)):
+def mark_as_read(request: MarkAsReadRequest, token: str = Depends(require_auth)):
     if not request.ids:
         raise HTTPException(status_code=400, detail="ids is required")
     success = mark_as_read_service(token, request.ids)
@@ -0,0 +1,23 @@
+from fastapi import APIRouter
+
+from src.utils.responses import FastJSONResponse
+from src.utils.startup import startup
+
+# Probes are frequent and uninteresting, so this router does not use LoggingRoute
+router = APIRouter(
+    prefix="/health",
+    tags=["health"],
+)
+
+
+@router.get("/live")
+def live():
+    """ The process is up and serving requests """
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+def ready():
+    """ 200 once startup has completed (background warm-up does not gate it), 503 before and while stopping """
+    status = startup.status()
+    return FastJSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, Depends
+
+from src.middleware.auth import require_admin
+from src.utils.logging import LoggingRoute
+from src.utils.quota import limiter
+from src.utils.singleflight import flights
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+    route_class=LoggingRoute,
+    # Operator-only: Authorization: Bearer <ADMIN_TOKEN>
+    dependencies=[Depends(require_admin)],
+)
+
+
+@router.get("/quota")
+def quota():
+    """ Google API usage of this process: calls, quota units, retries and time spent throttled """
+    return limiter.metrics()
+
+
+@router.get("/coalescing")
+def coalescing():
+    """ How many backend calls ran and how many callers shared an identical in-flight call """
+    return flights.stats()
@@ -1,8 +1,29 @@
-from fastapi import Depends, Request, HTTPException
+import hmac
+import os
+from typing import Annotated
+
+from fastapi import Depends, Header, Request, HTTPException
+
+from src.repo.auth import touch_user
 
 
 def require_auth(request: Request):
     token = request.cookies["key"]
     if not token:
         raise HTTPException(status_code=401, detail="Unauthorized")
+    touch_user(token)
     return token
+
+
+def require_admin(authorization: Annotated[str | None, Header()] = None):
+    """
+    Operator endpoints (/metrics) expect "Authorization: Bearer <ADMIN_TOKEN>" and are
+    disabled while ADMIN_TOKEN is unset: their figures cover every user, so a user's
+    session cookie is not enough
+    """
+    admin_token = os.getenv("ADMIN_TOKEN", "")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="ADMIN_TOKEN is not set")
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(credentials.encode(), admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Unauthorized")
@@ -1,8 +1,10 @@
 import json
 import logging
 import os
+import time
 
 import src.repo.auth as auth
+from src.repo.state import get_state
 
 logger: logging.Logger = logging.getLogger('uvicorn.error')
 
@@ -12,6 +14,7 @@ GRANDPARENT_DIR = os.path.dirname(PARENT_DIR)
 
 class DBObject:
     user_tokens = {}
+    last_active = {}
     def __init__(self):
         pass
 
@@ -19,23 +22,65 @@ db = DBObject()
 
 def get_user_tokens(key):
     """ Returns the user tokens """
-    return db.user_tokens.get(key, None)
+    value = db.user_tokens.get(key, None)
+    state = get_state()
+    if value is None and state.shared:
+        # The user may have logged in through another worker
+        value = state.get_json(f"token:{key}")
+        if value is not None:
+            db.user_tokens[key] = value
+    return value
 
 def set_user_tokens(key, value):
-    """ Sets the user tokens """
+    """ Sets the user tokens, writing them through to the state backend whichever it is """
     db.user_tokens[key] = value
+    get_state().set_json(f"token:{key}", value)
 
-def save_user_tokens(filename="user_tokens.json"):
-    with open(os.path.join(GRANDPARENT_DIR, filename), "w") as f:
-        json.dump(db.user_tokens, f)
+def touch_user(key):
+    """ Records that the user just made an authenticated request """
+    db.last_active[key] = time.time()
+
+def get_active_users(within: float) -> list[str]:
+    """ Returns the users who made a request in the last `within` seconds """
+    cutoff = time.time() - within
+    return [key for key, seen in list(db.last_active.items())
+            if seen >= cutoff and get_user_tokens(key) is not None]
+
+def _tokens_path(filename: str | None) -> str:
+    # USER_TOKENS_FILE lets the benchmarks point the backend at a throwaway file
+    filename = filename or os.getenv("USER_TOKENS_FILE", "user_tokens.json")
+    return os.path.join(GRANDPARENT_DIR, filename)
+
+def save_user_tokens(filename=None):
+    """
+    Writes the tokens to the file with every backend, so a shared one that loses its data
+    (a flushed Redis, a deleted SQLite file) can be seeded again on the next start. Workers
+    only know the users they have seen, so the file is merged into rather than replaced.
+    """
+    path = _tokens_path(filename)
+    try:
+        with open(path, "r") as f:
+            tokens = json.load(f)
+    except (FileNotFoundError, ValueError):
+        tokens = {}
+    tokens.update(db.user_tokens)
+    # Written aside and renamed, so a reader never sees a half-written file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(tokens, f)
+    os.replace(tmp, path)
     logger.info("User tokens saved successfully.")
 
 
-def load_user_tokens(filename="user_tokens.json"):
+def load_user_tokens(filename=None):
     try:
-        with open(os.path.join(GRANDPARENT_DIR, filename), "r") as f:
+        with open(_tokens_path(filename), "r") as f:
             db.user_tokens = json.load(f)
         logger.info("User tokens loaded successfully.")
+        # Seed the backend, e.g. a shared one from a file written in single-worker mode
+        state = get_state()
+        for key, value in db.user_tokens.items():
+            state.add(f"token:{key}", json.dumps(value).encode())
     except FileNotFoundError:
         db.user_tokens = {}
         logger.warning(
@@ -0,0 +1,138 @@
+"""
+Durable queue of outgoing emails in a local SQLite file (OUTBOX_DB). Several worker
+processes on one host can share it: jobs are claimed atomically with a lease, and a job
+whose worker died is picked up again once the lease expires.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import orjson
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+_COLUMNS = "id, user, idempotency_key, payload, status, attempts, next_attempt_at, result, error, created_at, updated_at"
+
+
+class Outbox:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id TEXT PRIMARY KEY, user TEXT NOT NULL, idempotency_key TEXT NOT NULL, payload BLOB NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+            "locked_until REAL, result BLOB, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, "
+            "UNIQUE (user, idempotency_key))")
+        conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _job(row) -> dict | None:
+        if row is None:
+            return None
+        (id, user, key, payload, status, attempts, next_attempt_at, result, error,
+         created_at, updated_at) = row
+        return {
+            "id": id, "user": user, "idempotencyKey": key, "payload": orjson.loads(payload),
+            "status": status, "attempts": attempts, "nextAttemptAt": next_attempt_at,
+            "result": orjson.loads(result) if result else None, "error": error,
+            "createdAt": created_at, "updatedAt": updated_at,
+        }
+
+    def enqueue(self, user: str, payload: dict, idempotency_key: str | None = None) -> tuple[dict, bool]:
+        """
+        Queues an email; returns the job and whether it was (re)queued. A repeated idempotency
+        key of the same user returns the existing job instead of queuing the email twice,
+        unless that job failed: then it is queued again with the new payload.
+        """
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        key = idempotency_key or job_id
+        conn = self._connect()
+        cursor = conn.execute(
+            "INSERT INTO outbox (id, user, idempotency_key, payload, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user, idempotency_key) DO UPDATE SET "
+            "payload = excluded.payload, status = excluded.status, attempts = 0, "
+            "next_attempt_at = excluded.next_attempt_at, locked_until = NULL, error = NULL, "
+            "updated_at = excluded.updated_at WHERE outbox.status = ?",
+            (job_id, user, key, orjson.dumps(payload), QUEUED, now, now, now, FAILED))
+        row = conn.execute(f"SELECT {_COLUMNS} FROM outbox WHERE user = ? AND idempotency_key = ?",
+                           (user, key)).fetchone()
+        return self._job(row), cursor.rowcount == 1
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._connect().execute(f"SELECT {_COLUMNS} FROM outbox WHERE id = ?", (job_id,)).fetchone()
+        return self._job(row)
+
+    def claim(self, lease: float) -> dict | None:
+        """ Takes the next due job (or one whose worker's lease ran out) for `lease` seconds """
+        now = time.time()
+        row = self._connect().execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? "
+            "WHERE id = (SELECT id FROM outbox "
+            "            WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND locked_until < ?) "
+            "            ORDER BY next_attempt_at LIMIT 1) "
+            f"RETURNING {_COLUMNS}",
+            (SENDING, now + lease, now, QUEUED, now, SENDING, now)).fetchone()
+        return self._job(row)
+
+    def complete(self, job_id: str, result: dict):
+        self._finish(job_id, SENT, result=orjson.dumps(result))
+
+    def fail(self, job_id: str, error: str):
+        self._finish(job_id, FAILED, error=error)
+
+    def _finish(self, job_id: str, status: str, result: bytes | None = None, error: str | None = None):
+        self._connect().execute(
+            "UPDATE outbox SET status = ?, result = ?, error = ?, locked_until = NULL, updated_at = ? WHERE id = ?",
+            (status, result, error, time.time(), job_id))
+
+    def retry(self, job_id: str, delay: float, error: str):
+        """ Puts a job back in the queue to be tried again in `delay` seconds """
+        now = time.time()
+        self._connect().execute(
+            "UPDATE outbox SET status = ?, next_attempt_at = ?, error = ?, locked_until = NULL, updated_at = ? "
+            "WHERE id = ?",
+            (QUEUED, now + delay, error, now, job_id))
+
+    def purge(self, older_than: float) -> int:
+        """ Deletes sent and failed jobs last updated more than `older_than` seconds ago """
+        cursor = self._connect().execute(
+            "DELETE FROM outbox WHERE status IN (?, ?) AND updated_at < ?",
+            (SENT, FAILED, time.time() - older_than))
+        return cursor.rowcount
+
+
+_outbox: Outbox | None = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    """ Returns the process-wide outbox stored at OUTBOX_DB """
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = Outbox(os.getenv("OUTBOX_DB", os.path.join(BE_DIR, "outbox.db")))
+    return _outbox
@@ -0,0 +1,101 @@
+"""
+Warm-restart snapshots of the in-process caches.
+
+With the default memory state backend every cache lives in the worker, so a restart or
+deploy used to start every user cold. On shutdown the caches created with
+`SharedCache(..., snapshot=True)` (mailbox listings, sender addresses, calendar windows,
+threads, LLM summaries and replies, ...) and the users' last activity are written to
+CACHE_SNAPSHOT_FILE as zlib-compressed JSON; the next start loads them back with the time
+they had left, minus the downtime.
+
+Restored entries are checked the way cached ones always are: mailbox listings are only
+served while their ETag matches the current historyId, threads while the history since
+their historyId leaves them unchanged. The prefetcher re-warms the restored active users
+right away, which revalidates their listings and refreshes their calendar windows.
+Shared backends (sqlite, redis) keep the caches themselves, so there is nothing to do.
+"""
+import logging
+import os
+import time
+import zlib
+
+import orjson
+
+from src.repo import auth
+from src.repo.state import get_state
+from src.utils.cache import snapshot_caches
+from src.utils.records import json_default
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Relative to the be/ directory, like user_tokens.json; empty disables snapshots
+SNAPSHOT_FILE = os.getenv("CACHE_SNAPSHOT_FILE", "cache_snapshot.bin")
+# Bumped when the shape of a cached value changes (2: calendar listings carry their "updated" time)
+VERSION = 2
+
+
+def _path(filename: str | None) -> str | None:
+    filename = SNAPSHOT_FILE if filename is None else filename
+    return os.path.join(auth.GRANDPARENT_DIR, filename) if filename else None
+
+
+def _as_key(value):
+    # JSON turns the key tuples (and the tuples inside them) into lists
+    return tuple(_as_key(v) for v in value) if isinstance(value, list) else value
+
+
+def save_snapshot(filename: str | None = None) -> int:
+    """ Writes the snapshot caches to disk; returns how many entries were written """
+    path = _path(filename)
+    if path is None or get_state().shared:
+        return 0
+    caches = {namespace: [[key, ttl, value] for key, ttl, value in cache.local.items()]
+              for namespace, cache in snapshot_caches().items()}
+    snapshot = {"version": VERSION, "savedAt": time.time(), "caches": caches,
+                "lastActive": auth.db.last_active}
+    data = zlib.compress(orjson.dumps(snapshot, default=json_default,
+                                      option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS))
+    # Written aside and renamed, so a crash mid-write leaves the previous snapshot intact;
+    # the keys include user tokens, hence the owner-only permissions
+    tmp = path + ".tmp"
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    entries = sum(len(items) for items in caches.values())
+    logger.info(f"Cache snapshot saved: {entries} entries, {len(data) / 1024:.0f}KiB")
+    return entries
+
+
+def load_snapshot(filename: str | None = None) -> int:
+    """ Restores the entries of a snapshot that have not expired since; returns how many """
+    path = _path(filename)
+    if path is None or get_state().shared:
+        return 0
+    try:
+        with open(path, "rb") as f:
+            snapshot = orjson.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return 0
+    except (OSError, zlib.error, orjson.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable cache snapshot {path}: {e}")
+        return 0
+    if snapshot.get("version") != VERSION:
+        return 0
+    downtime = max(time.time() - snapshot["savedAt"], 0)
+    caches = snapshot_caches()
+    restored = 0
+    for namespace, items in snapshot["caches"].items():
+        cache = caches.get(namespace)
+        if cache is None:
+            continue
+        # Least recently used first, so the LRU order carries over
+        for key, ttl, value in items:
+            if ttl > downtime:
+                cache.local.set(_as_key(key), value, ttl - downtime)
+                restored += 1
+    # Users with a valid token count as active again, so the prefetcher revalidates them
+    for token, seen in snapshot.get("lastActive", {}).items():
+        if token in auth.db.user_tokens:
+            auth.db.last_active[token] = max(auth.db.last_active.get(token, 0), seen)
+    logger.info(f"Cache snapshot restored: {restored} entries after {downtime:.0f}s downtime")
+    return restored
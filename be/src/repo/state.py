@@ -0,0 +1,257 @@
+"""
+Key-value state shared between worker processes: user tokens, OAuth states, response
+caches and rate-limiter counters.
+
+STATE_BACKEND_URL selects the implementation:
+    memory://                   (default) per process, for a single worker
+    sqlite:///path/to/state.db  shared by the workers of one host
+    redis://host:6379/0         shared by any number of hosts (Redis or a compatible server)
+"""
+import logging
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from urllib.parse import urlparse
+
+import orjson
+
+from src.utils.records import json_default
+
+try:
+    import redis
+except ImportError:  # only needed for redis:// backends
+    redis = None
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+
+class StateBackend(ABC):
+    """ Byte-valued store with per-key expiry (`ttl` in seconds, None = no expiry) """
+    # Whether other processes see the same data
+    shared = True
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: bytes, ttl: float | None = None) -> bool:
+        """ Sets the key only if it does not exist; returns whether it was set """
+
+    @abstractmethod
+    def pop(self, key: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        """ Atomically adds `amount` to an integer counter; `ttl` applies when the counter is created """
+
+    def get_json(self, key: str):
+        value = self.get(key)
+        return None if value is None else orjson.loads(value)
+
+    def set_json(self, key: str, value, ttl: float | None = None):
+        self.set(key, orjson.dumps(value, default=json_default,
+                                   option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS), ttl)
+
+
+class MemoryBackend(StateBackend):
+    shared = False
+
+    def __init__(self):
+        self._data: dict[str, tuple[float | None, object]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    @staticmethod
+    def _expiry(ttl: float | None) -> float | None:
+        return None if ttl is None else time.monotonic() + ttl
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key)
+            return None if item is None else item[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (self._expiry(ttl), value)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (self._expiry(ttl), value)
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            item = self._live(key)
+            self._data.pop(key, None)
+            return None if item is None else item[1]
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            item = self._live(key)
+            if item is None:
+                item = (self._expiry(ttl), 0)
+            value = int(item[1]) + amount
+            self._data[key] = (item[0], value)
+            return value
+
+
+class SQLiteBackend(StateBackend):
+    """ One table in a WAL-mode SQLite file; safe for several processes on one host """
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv "
+                         "(key TEXT PRIMARY KEY, value BLOB, expires_at REAL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _expiry(ttl: float | None) -> float | None:
+        return None if ttl is None else time.time() + ttl
+
+    def _wrote(self, conn: sqlite3.Connection):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+            (key, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, key, value, ttl=None):
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, value, self._expiry(ttl)))
+        self._wrote(conn)
+
+    def add(self, key, value, ttl=None):
+        conn = self._connect()
+        cursor = conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE kv.expires_at IS NOT NULL AND kv.expires_at < ?",
+            (key, value, self._expiry(ttl), time.time()))
+        self._wrote(conn)
+        return cursor.rowcount == 1
+
+    def pop(self, key):
+        row = self._connect().execute(
+            "DELETE FROM kv WHERE key = ? RETURNING value, expires_at", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        conn = self._connect()
+        row = conn.execute(
+            "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN kv.expires_at < ? THEN excluded.value ELSE kv.value + excluded.value END, "
+            "expires_at = CASE WHEN kv.expires_at < ? THEN excluded.expires_at ELSE kv.expires_at END "
+            "RETURNING value",
+            (key, amount, self._expiry(ttl), now, now)).fetchone()
+        self._wrote(conn)
+        return int(row[0])
+
+
+class RedisBackend(StateBackend):
+    """ Any server speaking the Redis protocol (Redis, Valkey, KeyDB, ...) """
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND_URL is a redis:// URL but the 'redis' package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self._incr = self.client.register_script(self._INCR)
+
+    @staticmethod
+    def _px(ttl: float | None) -> int | None:
+        return None if ttl is None else max(1, int(ttl * 1000))
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, px=self._px(ttl))
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, px=self._px(ttl), nx=True))
+
+    def pop(self, key):
+        pipe = self.client.pipeline()
+        pipe.get(key)
+        pipe.delete(key)
+        return pipe.execute()[0]
+
+    # INCRBY that sets the expiry only when it creates the counter (PEXPIRE NX needs Redis 7)
+    _INCR = """
+    local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+    if ARGV[2] ~= '' and redis.call('PTTL', KEYS[1]) == -1 then
+        redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return value
+    """
+
+    def incr(self, key, amount=1, ttl=None):
+        px = self._px(ttl)
+        return int(self._incr(keys=[key], args=[amount, "" if px is None else px]))
+
+
+def create_backend(url: str) -> StateBackend:
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "memory"):
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
+
+
+_backend: StateBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def get_state() -> StateBackend:
+    """ Returns the process-wide state backend configured by STATE_BACKEND_URL """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                url = os.getenv("STATE_BACKEND_URL", "memory://")
+                _backend = create_backend(url)
+                logger.info(f"Using {type(_backend).__name__} for shared state")
+    return _backend
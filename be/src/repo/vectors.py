@@ -0,0 +1,206 @@
+"""
+Per-account embedding index on disk (SEARCH_INDEX_DIR/<account hash>/):
+    vectors.f32   append-only float32 matrix, one row per email, read through np.memmap
+    meta.jsonl    one line per row: the email's id and the fields shown in search results
+    df.npy        rows with a non-zero value per dimension, for IDF-weighted queries
+    info.json     the embedder that wrote the rows; another embedder starts a fresh index
+
+Appends take an exclusive file lock, so several worker processes can share the files.
+Indexes not used for SEARCH_INDEX_MAX_AGE are deleted by prune_indexes().
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import orjson
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker process, the thread lock is enough
+    fcntl = None
+
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", "search_index")
+# Indexes kept open in this process; the least recently used one is closed first
+SEARCH_INDEX_OPEN = int(os.getenv("SEARCH_INDEX_OPEN", "64"))
+# Seconds after its last use (see touch) an index is deleted, with the mail text it holds
+SEARCH_INDEX_MAX_AGE = int(os.getenv("SEARCH_INDEX_MAX_AGE", str(30 * 24 * 60 * 60)))
+
+
+class VectorIndex:
+
+    def __init__(self, directory: str, embedder_name: str, dim: int):
+        self.directory = directory
+        self.dim = dim
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.jsonl")
+        self.df_path = os.path.join(directory, "df.npy")
+        self._lock = threading.Lock()
+        self.meta: list[dict] = []
+        self.ids: set[str] = set()
+        self.df = np.zeros(dim, dtype=np.float64)
+        self._meta_size = 0
+        self._matrix: np.ndarray | None = None
+
+        info = {"embedder": embedder_name, "dim": dim}
+        info_path = os.path.join(directory, "info.json")
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                if json.load(f) != info:
+                    shutil.rmtree(directory)
+        os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(info_path):
+            with open(info_path, "w") as f:
+                json.dump(info, f)
+        with self._file_lock():
+            self._reload()
+
+    @contextmanager
+    def _file_lock(self):
+        # Another process may have pruned the directory meanwhile; the index then starts over
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(os.path.join(self.directory, "lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # Closing the file releases the flock
+            yield
+
+    def _reload(self):
+        """ Reads what other processes appended; drops rows a crashed append left half written """
+        size = os.path.getsize(self.meta_path) if os.path.exists(self.meta_path) else 0
+        if size == self._meta_size:
+            return
+        lines = []
+        if size:
+            with open(self.meta_path, "rb") as f:
+                lines = f.read().splitlines()
+        meta = []
+        for line in lines:
+            try:
+                meta.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                break
+        row_bytes = self.dim * 4
+        rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        meta = meta[:rows]
+        if rows > len(meta):
+            # Vectors are written before their metadata; forget rows without any
+            os.truncate(self.vectors_path, len(meta) * row_bytes)
+        self.meta = meta
+        self.ids = {m["id"] for m in meta}
+        self.df = np.load(self.df_path) if os.path.exists(self.df_path) else np.zeros(self.dim)
+        self._meta_size = size
+        self._matrix = None
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def touch(self):
+        """ Records that the index is in use, so prune_indexes keeps it """
+        with self._file_lock():
+            os.utime(os.path.join(self.directory, "lock"))
+
+    def matrix(self) -> np.ndarray:
+        """ The (rows x dim) embedding matrix, memory-mapped read-only """
+        if self._matrix is None or self._matrix.shape[0] != len(self.meta):
+            if not self.meta:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(len(self.meta), self.dim))
+        return self._matrix
+
+    def missing(self, ids: list[str]) -> list[str]:
+        """ The ids that are not indexed yet """
+        with self._file_lock():
+            self._reload()
+            return [i for i in ids if i not in self.ids]
+
+    def append(self, items: list[dict], vectors: np.ndarray) -> int:
+        """ Adds rows for the items (each with an "id") not indexed yet; returns how many were added """
+        with self._file_lock():
+            self._reload()
+            keep = []
+            seen = set(self.ids)
+            for row, item in enumerate(items):
+                if item["id"] not in seen:
+                    seen.add(item["id"])
+                    keep.append(row)
+            if not keep:
+                return 0
+            new = np.ascontiguousarray(vectors[keep], dtype=np.float32)
+            with open(self.vectors_path, "ab") as f:
+                f.write(new.tobytes())
+            self.df += np.count_nonzero(new, axis=0)
+            np.save(self.df_path, self.df)
+            with open(self.meta_path, "ab") as f:
+                f.write(b"".join(orjson.dumps(items[row]) + b"\n" for row in keep))
+            self.meta.extend(items[row] for row in keep)
+            self.ids.update(items[row]["id"] for row in keep)
+            self._meta_size = os.path.getsize(self.meta_path)
+            return len(keep)
+
+    def idf(self) -> np.ndarray:
+        """ Smoothed inverse document frequency of every dimension """
+        return np.log((len(self.meta) + 1) / (self.df + 1)) + 1
+
+    def search(self, query: np.ndarray, k: int) -> list[tuple[float, dict]]:
+        """ The k rows with the highest dot product with `query`, best first """
+        with self._file_lock():
+            self._reload()
+            matrix = self.matrix()
+            meta = self.meta
+        if not len(meta) or k <= 0:
+            return []
+        scores = matrix @ query.astype(np.float32)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), meta[i]) for i in top]
+
+
+_indexes: OrderedDict[str, VectorIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _key(account: str) -> str:
+    return hashlib.sha256(account.encode()).hexdigest()[:32]
+
+
+def get_index(account: str, embedder_name: str, dim: int) -> VectorIndex:
+    """ Returns the process-wide index of an account's mail """
+    key = _key(account)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or index.dim != dim:
+            index = VectorIndex(os.path.join(SEARCH_INDEX_DIR, key), embedder_name, dim)
+            _indexes[key] = index
+            while len(_indexes) > SEARCH_INDEX_OPEN:
+                _indexes.popitem(last=False)
+        _indexes.move_to_end(key)
+        return index
+
+
+def prune_indexes(max_age: float = SEARCH_INDEX_MAX_AGE) -> int:
+    """ Deletes the indexes not written to or touched in `max_age` seconds; returns how many """
+    if not os.path.isdir(SEARCH_INDEX_DIR):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for key in os.listdir(SEARCH_INDEX_DIR):
+        directory = os.path.join(SEARCH_INDEX_DIR, key)
+        try:
+            last_write = max((os.path.getmtime(entry.path) for entry in os.scandir(directory)), default=0)
+        except OSError:
+            continue
+        if last_write >= cutoff:
+            continue
+        with _indexes_lock:
+            _indexes.pop(key, None)
+            shutil.rmtree(directory, ignore_errors=True)
+        removed += 1
+    return removed
@@ -0,0 +1,109 @@
+"""
+Conversation sessions of the assistant. A session keeps the latest turns, the tool calls
+made and the emails the tools retrieved, so follow-up questions ("what about the one from
+Alice?") are answered from them instead of searching, fetching and summarizing again.
+Sessions live in the shared state backend and expire ASSISTANT_SESSION_TTL seconds after
+their last turn.
+"""
+import os
+import re
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import numpy as np
+
+from src.utils.cache import SharedCache
+from src.utils.embeddings import get_embedder
+
+SESSION_TTL = float(os.getenv("ASSISTANT_SESSION_TTL", "1800"))
+# Messages (user and assistant) kept as history
+MAX_TURNS = 12
+MAX_EMAILS = 30
+MAX_TOOL_RESULTS = 8
+EMAIL_TEXT_CHARS = 2000
+TOOL_OUTPUT_CHARS = 4000
+
+# (user, session id) -> {"turns", "emails", "toolResults"}
+_sessions = SharedCache("assistant_sessions", maxsize=2048, ttl=SESSION_TTL, snapshot=True)
+
+_ORDINAL = re.compile(r"^\s*(?:email\s*)?#?\[?(\d+)\]?\s*$", re.IGNORECASE)
+
+
+def _iso(date) -> str | None:
+    # Email records carry a datetime; sessions keep the wire form whichever backend stores them
+    return date.isoformat() if isinstance(date, datetime) else date
+
+
+@dataclass
+class Session:
+    id: str
+    # {"role": "user" | "assistant", "content"}, oldest first
+    turns: list[dict] = field(default_factory=list)
+    # Compact copies of the emails tools retrieved, least recently retrieved first
+    emails: list[dict] = field(default_factory=list)
+    # {"tool", "args", "mailbox", "output"}
+    tool_results: list[dict] = field(default_factory=list)
+
+    def add_turn(self, role: str, content: str):
+        self.turns = (self.turns + [{"role": role, "content": content}])[-MAX_TURNS:]
+
+    def remember_emails(self, emails: list[dict]):
+        """ Adds emails a tool retrieved (moving already known ones to the end) """
+        ids = {e["id"] for e in emails}
+        compact = [{
+            "id": e["id"], "threadId": e.get("threadId"), "from": e.get("from"), "subject": e.get("subject"),
+            "date": _iso(e.get("date")), "snippet": e.get("snippet"),
+            "raw": (e.get("raw") or e.get("content") or "")[:EMAIL_TEXT_CHARS],
+        } for e in emails]
+        self.emails = ([e for e in self.emails if e["id"] not in ids] + compact)[-MAX_EMAILS:]
+
+    def tool_result(self, tool: str, args: dict, mailbox: str | None) -> str | None:
+        """
+        The output of an identical earlier tool call in this session, if any, made while the
+        mailbox was at the same historyId: the tools read the mailbox, so a call without
+        arguments (the inbox summary) is only the same call while nothing has arrived since
+        """
+        if mailbox is None:
+            return None
+        return next((r["output"] for r in self.tool_results
+                     if r["tool"] == tool and r["args"] == args and r.get("mailbox") == mailbox), None)
+
+    def remember_tool_result(self, tool: str, args: dict, mailbox: str | None, output: str):
+        self.tool_results = (self.tool_results + [{"tool": tool, "args": args, "mailbox": mailbox,
+                                                   "output": output[:TOOL_OUTPUT_CHARS]}])[-MAX_TOOL_RESULTS:]
+
+    def context(self) -> str:
+        """ The known emails, numbered, one line each, for the model to refer back to """
+        if not self.emails:
+            return ""
+        lines = [f"[{i}] From: {e['from']} | Subject: {e['subject']} | Date: {e['date']} | {e['snippet'] or ''}"
+                 for i, e in enumerate(self.emails, 1)]
+        return "Emails already retrieved in this conversation:\n" + "\n".join(lines)
+
+    def find_emails(self, question: str, k: int = 3) -> list[dict]:
+        """ The known emails that best match a reference such as "the one from Alice" or "2" """
+        if not self.emails:
+            return []
+        ordinal = _ORDINAL.match(question)
+        if ordinal and 1 <= int(ordinal.group(1)) <= len(self.emails):
+            return [self.emails[int(ordinal.group(1)) - 1]]
+        embedder = get_embedder()
+        documents = [f"{e['subject'] or ''}\n{e['from'] or ''}\n{e['raw']}" for e in self.emails]
+        scores = embedder.embed(documents) @ embedder.embed([question])[0]
+        order = np.argsort(-scores, kind="stable")[:k]
+        return [self.emails[i] for i in order]
+
+
+def load_session(user: str, session_id: str | None) -> Session:
+    """ The user's session with that id; a new, empty one when it does not exist or expired """
+    if session_id:
+        data = _sessions.get((user, session_id))
+        if data is not None:
+            return Session(session_id, data["turns"], data["emails"], data["toolResults"])
+    return Session(session_id or uuid.uuid4().hex)
+
+
+def save_session(user: str, session: Session):
+    _sessions.set((user, session.id), {"turns": session.turns, "emails": session.emails,
+                                       "toolResults": session.tool_results})
@@ -0,0 +1,176 @@
+"""
+Attachment downloads. Decoded attachments are kept in a content-addressed cache on disk
+(ATTACHMENT_CACHE_DIR, one file per SHA-256) and always served from there in chunks, so
+repeated and ranged downloads of the same file do not go back to Gmail.
+"""
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+from typing import BinaryIO, Iterator
+
+from fastapi import HTTPException
+
+from src.services.email import find_attachments, get_gmail_service
+from src.utils.cache import SharedCache
+from src.utils.singleflight import flights
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+ATTACHMENT_CACHE_DIR = os.getenv("ATTACHMENT_CACHE_DIR", "attachment_cache")
+# Least recently used files are removed once the cache grows past this size
+ATTACHMENT_CACHE_MAX_BYTES = int(float(os.getenv("ATTACHMENT_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024
+# Base64 characters that decode to one CHUNK_SIZE block (4 characters per 3 bytes)
+_B64_CHUNK = CHUNK_SIZE // 3 * 4
+
+# (token, message id, part id) -> {"sha256", "size", "filename", "mimeType"}. Keyed on the
+# part: Gmail hands out a new attachmentId every time the message is fetched.
+_attachment_index = SharedCache("attachments", maxsize=4096, ttl=7 * 24 * 60 * 60)
+
+
+def _path(digest: str) -> str:
+    return os.path.join(ATTACHMENT_CACHE_DIR, digest[:2], digest)
+
+
+def _store(data: str) -> tuple[str, int]:
+    """ Decodes base64url `data` block by block into the cache; returns its SHA-256 and size """
+    os.makedirs(ATTACHMENT_CACHE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=ATTACHMENT_CACHE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for i in range(0, len(data), _B64_CHUNK):
+                block = data[i:i + _B64_CHUNK]
+                chunk = base64.urlsafe_b64decode(block + "=" * (-len(block) % 4))
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        path = _path(digest.hexdigest())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Atomic, so concurrent downloads of the same file (other workers) are harmless
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return digest.hexdigest(), size
+
+
+def _evict():
+    files = []
+    total = 0
+    for root, _, names in os.walk(ATTACHMENT_CACHE_DIR):
+        for name in names:
+            if name.endswith(".part"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= ATTACHMENT_CACHE_MAX_BYTES:
+        return
+    for _, size, path in sorted(files):
+        try:
+            os.remove(path)
+        except (FileNotFoundError, PermissionError):
+            # Gone already, or (on Windows) open for a download in progress
+            pass
+        total -= size
+        if total <= ATTACHMENT_CACHE_MAX_BYTES * 0.9:
+            break
+
+
+def _download(token: str, message_id: str, part_id: str) -> dict:
+    service = get_gmail_service(token)
+    msg = service.users().messages().get(userId="me", id=message_id, format="full").execute()
+    part = next((a for a in find_attachments(msg.get("payload", {})) if a["partId"] == part_id), None)
+    if part is None:
+        raise HTTPException(status_code=404, detail="Attachment not found.")
+    # The attachmentId of this very response is valid; the API returns the whole attachment as
+    # one base64url string, which is dropped once on disk
+    data = service.users().messages().attachments().get(
+        userId="me", messageId=message_id, id=part["attachmentId"]).execute()["data"]
+    digest, size = _store(data)
+    _evict()
+    logger.info(f"Cached attachment of {size} bytes")
+    return {"sha256": digest, "size": size, "filename": part["filename"], "mimeType": part["mimeType"]}
+
+
+def get_attachment(token: str, message_id: str, part_id: str) -> dict:
+    """
+    Returns {"sha256", "size", "filename", "mimeType", "path"} of the attachment in a message
+    part, downloading it into the disk cache on first use.
+    """
+    key = (token, message_id, part_id)
+    meta = _attachment_index.get(key)
+    if meta is not None and os.path.exists(_path(meta["sha256"])):
+        # Marks the file as recently used for eviction
+        os.utime(_path(meta["sha256"]))
+    else:
+        meta = flights.do((token, "attachment", message_id, part_id),
+                          _download, token, message_id, part_id)
+        _attachment_index.set(key, meta)
+    return dict(meta, path=_path(meta["sha256"]))
+
+
+def open_attachment(token: str, message_id: str, part_id: str) -> tuple[dict, BinaryIO]:
+    """
+    Returns the attachment's metadata (see get_attachment) and its cached file, opened for
+    reading. The open file stays readable even if it is evicted while it is being streamed.
+    """
+    meta = get_attachment(token, message_id, part_id)
+    try:
+        return meta, open(meta["path"], "rb")
+    except FileNotFoundError:
+        # Evicted (e.g. by another worker) after get_attachment found it; download it again
+        logger.info("Cached attachment was evicted meanwhile, downloading it again")
+        meta = get_attachment(token, message_id, part_id)
+        return meta, open(meta["path"], "rb")
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Parses a single-range `Range: bytes=...` header into inclusive (start, end) offsets.
+    Returns None for headers to ignore (other units, several ranges, malformed ones such as
+    bytes=10-5) and raises ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start is None and end is None:
+        return None
+    if start is None:
+        # Suffix range: the last `end` bytes
+        if end <= 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - end), size - 1
+    if end is not None and end < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def iter_file(f: BinaryIO, start: int, end: int) -> Iterator[bytes]:
+    """ Yields bytes start..end (inclusive) of an open file in CHUNK_SIZE pieces, then closes it """
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -1,14 +1,38 @@
-from datetime import datetime, timezone
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from fastapi import HTTPException
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 
 from src.repo.auth import get_user_tokens
+from src.utils.cache import SharedCache
+from src.utils.etag import make_etag
+from src.utils.google import build_options
+from src.utils.singleflight import flights
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# (token, start, end, calendar_id) -> (etag, events, calendar "updated", checked at). Kept short
+# because open-ended listings start "now"; a user's entries are dropped when they add an event.
+_events_cache = SharedCache("events", maxsize=512, ttl=float(os.getenv("CALENDAR_CACHE_TTL", "300")),
+                            snapshot=True)
+# Seconds a cached listing is served before asking Google whether the window changed since
+# (events edited in another client or by other attendees)
+CALENDAR_FRESH_SECONDS = float(os.getenv("CALENDAR_FRESH_SECONDS", "30"))
+# (token, start, end, calendar ids) -> busy [start, end] pairs, from the free/busy API. The API
+# cannot tell what changed, so its answers are only reused briefly
+_busy_cache = SharedCache("freebusy", maxsize=512, ttl=CALENDAR_FRESH_SECONDS, snapshot=True)
+# Limits of one freeBusy query; longer windows and more calendars take several
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_MAX_DAYS = 60
 
 
 def get_calendar_service(token: str):
     """ Returns an authenticated Gmail API service instance """
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
     creds = get_user_tokens(token)
     if creds is None:
         raise HTTPException(
@@ -24,11 +48,63 @@ def get_calendar_service(token: str):
         client_id=user_cred["client_id"],
         client_secret=user_cred["client_secret"],
     )
-    return build("calendar", "v3", credentials=creds)
+    return build("calendar", "v3", credentials=creds, **build_options("calendar", token))
 
 
 def get_events(token: str, start: Optional[str], end: Optional[str], calendar_id) -> list:
     """ Fetches events from the user's calendar """
+    return get_events_with_etag(token, start, end, calendar_id)[1]
+
+
+def get_events_with_etag(token: str, start: Optional[str], end: Optional[str], calendar_id,
+                         refresh: bool = False) -> tuple[str, list]:
+    """
+    Fetches events from the user's calendar together with an ETag of the result.
+    The ETag is built from the calendar's sync state (collection etag and per-event etags),
+    so it only changes when the returned events change.
+    Results are reused for CALENDAR_CACHE_TTL seconds unless `refresh` is set; after
+    CALENDAR_FRESH_SECONDS, only while a one-item query for events updated since finds none.
+    """
+    requested = (start, end, calendar_id)
+    cache_key = (token, *requested)
+    if not refresh:
+        cached = _events_cache.get(cache_key)
+        if cached is not None:
+            etag, events, updated, checked_at = cached
+            if time.time() - checked_at < CALENDAR_FRESH_SECONDS:
+                return etag, events
+            if not flights.do((token, "events_changed", *requested), _changed_since,
+                              token, start, end, calendar_id, updated):
+                _events_cache.set(cache_key, (etag, events, updated, time.time()))
+                return etag, events
+    # Concurrent identical listings share one events.list call
+    return flights.do((token, "events", *requested), _fetch_events, token, start, end, calendar_id)
+
+
+def _changed_since(token: str, start: Optional[str], end: Optional[str], calendar_id, updated: str | None) -> bool:
+    """ Whether an event in the window was added, edited or deleted after `updated` (the calendar's) """
+    if not updated:
+        return True
+    query = {"calendarId": calendar_id, "timeMin": start or datetime.now(tz=timezone.utc).isoformat(),
+             "updatedMin": updated, "showDeleted": True, "singleEvents": True, "maxResults": 10,
+             "fields": "items(updated),nextPageToken"}
+    if end is not None:
+        query["timeMax"] = end
+    try:
+        result = get_calendar_service(token).events().list(**query).execute()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not revalidate cached events, fetching them again: {e}")
+        return True
+    # updatedMin is inclusive, so the event last edited at `updated` itself comes back
+    since = datetime.fromisoformat(updated)
+    return bool(result.get("nextPageToken")) or any(
+        datetime.fromisoformat(item.get("updated", updated)) > since for item in result.get("items", []))
+
+
+def _fetch_events(token: str, start: Optional[str], end: Optional[str], calendar_id) -> tuple[str, list]:
+    requested = (start, end, calendar_id)
     if start is None:
         start = datetime.now(tz=timezone.utc).isoformat()
 
@@ -54,10 +130,58 @@ def get_events(token: str, start: Optional[str], end: Optional[str], calendar_id
                 orderBy="startTime"
             ).execute()
         events = events_result.get("items", [])
-        return events
+        etag = make_etag("calendar", requested, events_result.get("etag"),
+                         [(e.get("id"), e.get("etag") or e.get("updated")) for e in events])
+        _events_cache.set((token, *requested), (etag, events, events_result.get("updated"), time.time()))
+        return etag, events
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def get_busy(token: str, start: datetime, end: datetime, calendar_ids: list[str]) -> list[list[str]]:
+    """
+    Busy [start, end] times (ISO strings, in no particular order) of the calendars between
+    `start` and `end`. The free/busy API reports only times, so months of many calendars cost
+    a few small calls instead of listing every event.
+    """
+    requested = (start.isoformat(), end.isoformat(), tuple(sorted(set(calendar_ids))))
+    cached = _busy_cache.get((token, *requested))
+    if cached is not None:
+        return cached
+    return flights.do((token, "freebusy", *requested), _fetch_busy, token, start, end, requested[2])
+
+
+def _fetch_busy(token: str, start: datetime, end: datetime, calendar_ids: tuple[str, ...]) -> list[list[str]]:
+    service = get_calendar_service(token)
+    busy = []
+    # Calendars Google could not report on; treating them as free would suggest taken slots
+    unavailable = {}
+    try:
+        chunk_start = start
+        while chunk_start < end:
+            chunk_end = min(chunk_start + timedelta(days=FREEBUSY_MAX_DAYS), end)
+            for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+                result = service.freebusy().query(body={
+                    "timeMin": chunk_start.isoformat(),
+                    "timeMax": chunk_end.isoformat(),
+                    "items": [{"id": c} for c in calendar_ids[i:i + FREEBUSY_MAX_CALENDARS]],
+                }).execute()
+                for calendar_id, calendar in result.get("calendars", {}).items():
+                    if calendar.get("errors"):
+                        unavailable[calendar_id] = ", ".join(
+                            error.get("reason", "unknown") for error in calendar["errors"])
+                    busy.extend([b["start"], b["end"]] for b in calendar.get("busy", []))
+            chunk_start = chunk_end
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if unavailable:
+        # Not cached (nor snapshotted): the next request asks again
+        logger.warning(f"Free/busy unavailable: {unavailable}")
+        raise HTTPException(status_code=502, detail="Free/busy unavailable for " + "; ".join(
+            f"{calendar_id} ({reasons})" for calendar_id, reasons in unavailable.items()))
+    _busy_cache.set((token, start.isoformat(), end.isoformat(), calendar_ids), busy)
+    return busy
+
+
 def add_event(token: str, summary: str, location: str | None, description: str | None, start: dict[str, str], end: dict[str, str]) -> dict:
     """ Adds an event to the user's calendar """
     service = get_calendar_service(token)
@@ -78,6 +202,8 @@ def add_event(token: str, summary: str, location: str | None, description: str |
 
     try:
         event_result = service.events().insert(calendarId="primary", body=event).execute()
+        _events_cache.invalidate_user(token)
+        _busy_cache.invalidate_user(token)
         return event_result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
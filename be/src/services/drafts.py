@@ -0,0 +1,120 @@
+"""
+Reply drafts prepared ahead of time for important mail (Gmail's IMPORTANT label, or "High"
+in src.services.priority), so Smart Replies can show one as soon as such an email is opened.
+
+Drafts are written by the prefetcher after it synced the inbox, within an hourly LLM budget
+per user. A draft only answers the newest message of its thread: when the thread receives
+another message (seen in a listing, a mailbox event or a sent reply) the draft is dropped.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from src.repo.state import get_state
+from src.services.priority import prioritize, top_k
+from src.utils.cache import SharedCache
+from tools.smart_replies import generate_draft
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# LLM calls per user per hour for drafts; 0 disables them
+DRAFT_BUDGET_PER_HOUR = int(os.getenv("DRAFT_BUDGET_PER_HOUR", "20"))
+DRAFT_TONE = os.getenv("DRAFT_TONE", "Professional")
+DRAFT_SIGN_OFF = os.getenv("DRAFT_SIGN_OFF", "Jerome")
+# Only the highest-ranked emails of a listing get drafts
+DRAFT_TOP_K = int(os.getenv("DRAFT_TOP_K", "3"))
+DRAFT_TTL = 24 * 60 * 60
+
+# (user, message id) -> {"id", "threadId", "tone", "signOff", "text", "createdAt"}
+_drafts = SharedCache("drafts", maxsize=2048, ttl=DRAFT_TTL, snapshot=True)
+# (user, thread id) -> {"id", "date"} of the newest message seen in the thread
+_thread_heads = SharedCache("thread_heads", maxsize=8192, ttl=DRAFT_TTL, snapshot=True)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def note_thread_message(user: str, thread_id: str | None, message_id: str, date: str | datetime | None = None):
+    """
+    Records that `message_id` arrived in a thread (`date`, a datetime or ISO string, defaults
+    to now). A newer message cancels the draft prepared for the previous one.
+    """
+    if not thread_id:
+        return
+    if isinstance(date, datetime):
+        date = date.isoformat()
+    date = date or _now()
+    head = _thread_heads.get((user, thread_id))
+    if head is not None:
+        if head["id"] == message_id or datetime.fromisoformat(head["date"]) > datetime.fromisoformat(date):
+            return
+        if _drafts.pop((user, head["id"])) is not None:
+            logger.info("Thread received a new message, dropped its draft")
+    _thread_heads.set((user, thread_id), {"id": message_id, "date": date})
+
+
+def _is_head(user: str, email: dict) -> bool:
+    head = _thread_heads.get((user, email.get("threadId")))
+    return head is None or head["id"] == email["id"]
+
+
+def _take_budget(user: str) -> bool:
+    hour = int(time.time() // 3600)
+    return get_state().incr(f"drafts:budget:{user}:{hour}", 1, ttl=3600) <= DRAFT_BUDGET_PER_HOUR
+
+
+def _important(email: dict) -> bool:
+    return "IMPORTANT" in (email.get("labelIds") or []) or email["priority"] == "High"
+
+
+def prepare_drafts(user: str, emails: list[dict]) -> int:
+    """
+    Generates drafts for the DRAFT_TOP_K highest-scored important emails of a freshly synced
+    listing that do not have one yet. Returns how many drafts were written.
+    """
+    if DRAFT_BUDGET_PER_HOUR <= 0:
+        return 0
+    candidates = []
+    seen_threads = set()
+    for email in emails:
+        thread_id = email.get("threadId")
+        if thread_id:
+            # Only the newest message of a thread gets a reply
+            if thread_id in seen_threads:
+                continue
+            seen_threads.add(thread_id)
+            note_thread_message(user, thread_id, email["id"], email.get("date"))
+        if _is_head(user, email):
+            candidates.append(email)
+    written = 0
+    important = [email for email in prioritize(user, candidates) if _important(email)]
+    for email in top_k(important, DRAFT_TOP_K):
+        if _drafts.get((user, email["id"])) is not None:
+            continue
+        try:
+            # Replies already cached (e.g. asked for in Smart Replies) cost no budget
+            text = generate_draft(user, email, DRAFT_TONE, "", DRAFT_SIGN_OFF, lambda: _take_budget(user))
+        except Exception as e:
+            logger.warning(f"Draft generation failed: {e}")
+            break
+        if text is None:
+            logger.info("Hourly draft budget used up, skipping the remaining emails")
+            break
+        # The thread may have moved on while the model was writing
+        if not _is_head(user, email):
+            continue
+        _drafts.set((user, email["id"]), {
+            "id": email["id"], "threadId": email.get("threadId"), "tone": DRAFT_TONE,
+            "signOff": DRAFT_SIGN_OFF, "text": text, "createdAt": _now(),
+        })
+        written += 1
+    return written
+
+
+def get_drafts(user: str, message_id: str) -> list[dict]:
+    """ Returns the drafts prepared for a message (empty when none or when the thread moved on) """
+    draft = _drafts.get((user, message_id))
+    if draft is None or not _is_head(user, draft):
+        return []
+    return [draft]
@@ -1,5 +1,5 @@
+import os
 import traceback
-from bs4 import BeautifulSoup
 import logging
 from email.message import EmailMessage
 import base64
@@ -7,15 +7,30 @@ from datetime import datetime, timezone
 
 from fastapi import HTTPException
 from fastapi.responses import JSONResponse
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 
 from src.repo.auth import get_user_tokens
+from src.utils.cache import SharedCache
+from src.utils.etag import make_etag
+from src.utils.google import build_options
+from src.utils.quota import GMAIL_QUOTA_UNITS
+from src.utils.records import EmailRecord, as_record
+from src.utils.singleflight import flights
 logger: logging.Logger = logging.getLogger('uvicorn.error')
 
+# (token, count, include_read, keywords) -> (etag, emails); entries are only reused while
+# the ETag, which is derived from the mailbox historyId, is unchanged
+_mailbox_cache = SharedCache("mailbox", maxsize=512, ttl=float(os.getenv("MAILBOX_CACHE_TTL", "600")),
+                             snapshot=True)
+# (token,) -> the user's email address, for the From header of sent mail
+_sender_cache = SharedCache("sender", maxsize=4096, ttl=24 * 60 * 60, snapshot=True)
+
 
 def get_gmail_service(token: str):
     """ Returns an authenticated Gmail API service instance """
+    # Imported on first use: the Google client libraries take long to load and slow down startup
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
     creds = get_user_tokens(token)
     if creds is None:
         raise HTTPException(
@@ -31,7 +46,7 @@ def get_gmail_service(token: str):
         client_id=user_cred["client_id"],
         client_secret=user_cred["client_secret"],
     )
-    return build("gmail", "v1", credentials=creds)
+    return build("gmail", "v1", credentials=creds, **build_options("gmail", token))
 
 
 def extract_text_from_html(html: str) -> str:
@@ -41,105 +56,191 @@ def extract_text_from_html(html: str) -> str:
     :param html: A string containing HTML.
     :return: A string of extracted text content.
     """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html, 'html.parser')
     return soup.get_text(separator=' ', strip=True)
 
 
-def get_email(token: str, count: int = 10, include_read: bool = False, keywords: list[str] | None = None):
-    """ Fetches the specified number of emails in the user's inbox """
+def get_history_id(service) -> str:
+    """ Returns the mailbox historyId, which changes whenever anything in the mailbox changes """
+    return str(service.users().getProfile(userId="me").execute().get("historyId", ""))
+
+
+def mailbox_etag(history_id: str, count: int, include_read: bool, keywords: list[str] | None) -> str:
+    return make_etag("email", history_id, count, include_read, sorted(keywords or []))
+
+
+def get_mailbox_etag(token: str, count: int = 10, include_read: bool = False,
+                     keywords: list[str] | None = None) -> tuple[str, str]:
+    """ Returns the current historyId and the ETag of an inbox listing at it (one getProfile call) """
+    service = get_gmail_service(token)
+    history_id = current_history_id(token, service)
+    return history_id, mailbox_etag(history_id, count, include_read, keywords)
+
+
+def current_history_id(token: str, service) -> str:
+    """ The mailbox historyId; concurrent requests of the same user share one getProfile call """
+    return flights.do((token, "history_id"), get_history_id, service)
+
+
+def get_email(token: str, count: int = 10, include_read: bool = False, keywords: list[str] | None = None,
+              etag: str | None = None):
+    """
+    Fetches the specified number of emails in the user's inbox.
+    The result is reused while the mailbox historyId (and therefore the ETag) is unchanged.
+    """
     logger.info(
         f"Fetching emails with count: {count}, include_read: {include_read}, keywords: {keywords}")
-    service = get_gmail_service(token)
     try:
-        # Build the query string
-        query_parts = ["in:inbox"]
-        if not include_read:
-            query_parts.append("is:unread")
-        if keywords:
-            quoted_keywords = [f'"{kw}"' for kw in keywords]
-            query_parts.append(" OR ".join(quoted_keywords))
-
-        query_string = " ".join(query_parts)
-
-        logger.info(f"Query string: {query_string}")
-        results = service.users().messages().list(
-            userId="me",
-            maxResults=count,
-            q=query_string
-        ).execute()
-
-        messages = results.get("messages", [])
-
-        if not messages:
-            return []
-
-        emails = []
-        for message in messages:
-            msg_id = message["id"]
-            msg_data = service.users().messages().get(userId="me", id=msg_id,
-                                                      format="full").execute()
-
-            # Extract email details
-            content = None
-
-            payload = msg_data.get("payload", {})
-            headers = payload.get("headers", [])
-            parts = payload.get("parts", [])
-            for part in parts:
-                body = part.get("body", None)
-                if not body:
-                    continue
-                encryted_data = body.get("data", None)
-                if not encryted_data:
-                    continue
-                html_content = base64.urlsafe_b64decode(encryted_data).decode()
-                content = extract_text_from_html(html_content)
-                break
-
-            email_subject = next(
-                (h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
-            email_from = next(
-                (h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
-            email_snippet = msg_data.get("snippet", None)
-
-            unix_milli = msg_data.get("internalDate", None)
-            # Convert to seconds
-            timestamp_s = int(unix_milli) / 1000
-            dt_utc = datetime.fromtimestamp(timestamp_s, tz=timezone.utc)
-            date_str = dt_utc.isoformat()
-
-            if not content:
-                content = email_snippet
-            
-            if not email_snippet:
-                email_snippet = content[:50] + "..." if len(content) > 50 else content
-
-            emails.append({
-                "from": email_from,
-                "subject": email_subject,
-                "snippet": email_snippet,
-                "raw": content,
-                "threadId": msg_data.get("threadId", None),
-                "id": msg_id,
-                "labelIds": msg_data.get("labelIds", []),
-                "date": date_str,
+        return load_emails(token, count, include_read, keywords, etag)
+    except HTTPException:
+        raise
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+def load_emails(token: str, count: int = 10, include_read: bool = False, keywords: list[str] | None = None,
+                etag: str | None = None) -> list[EmailRecord]:
+    """
+    Same as get_email, but lets Gmail API errors propagate (used by the prefetcher).
+    Identical listings requested concurrently (tabs, the assistant, the prefetcher) are fetched once.
+    """
+    service = get_gmail_service(token)
+    cache_key = (token, count, include_read, tuple(sorted(keywords or [])))
+    if etag is None:
+        etag = mailbox_etag(current_history_id(token, service), count, include_read, keywords)
+    cached = _mailbox_cache.get(cache_key)
+    if cached is not None and cached[0] == etag:
+        logger.info("Mailbox unchanged, serving cached emails")
+        return [as_record(email) for email in cached[1]]
+    emails = flights.do((token, "email", *cache_key[1:], etag),
+                        _fetch_emails, service, count, include_read, keywords)
+    _mailbox_cache.set(cache_key, (etag, emails))
+    return emails
+
+
+def _fetch_emails(service, count: int, include_read: bool, keywords: list[str] | None) -> list[EmailRecord]:
+    """ Lists the matching messages and fetches each one in full """
+    # Build the query string
+    query_parts = ["in:inbox"]
+    if not include_read:
+        query_parts.append("is:unread")
+    if keywords:
+        quoted_keywords = [f'"{kw}"' for kw in keywords]
+        query_parts.append(" OR ".join(quoted_keywords))
+
+    query_string = " ".join(query_parts)
+
+    logger.info(f"Query string: {query_string}")
+    results = service.users().messages().list(
+        userId="me",
+        maxResults=count,
+        q=query_string
+    ).execute()
+
+    messages = results.get("messages", [])
+
+    if not messages:
+        return []
+
+    emails = []
+    for message in messages:
+        msg_data = service.users().messages().get(userId="me", id=message["id"],
+                                                  format="full").execute()
+        emails.append(parse_message(msg_data))
+
+    return emails
+
+
+def find_attachments(payload: dict) -> list[dict]:
+    """ Lists the attachment parts of a message payload, including those nested in multiparts """
+    found = []
+    for part in payload.get("parts", []):
+        body = part.get("body", {})
+        if part.get("filename") and body.get("attachmentId"):
+            found.append({
+                # attachmentId changes with every messages.get; partId identifies the part
+                "partId": part.get("partId", ""),
+                "attachmentId": body["attachmentId"],
+                "filename": part["filename"],
+                "mimeType": part.get("mimeType") or "application/octet-stream",
+                "size": body.get("size", 0),
             })
+        found.extend(find_attachments(part))
+    return found
 
-        return emails
 
-    except Exception as e:
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+def parse_message(msg_data: dict) -> EmailRecord:
+    """ Converts a Gmail message resource (format=full) into the email record the API returns """
+    msg_id = msg_data["id"]
+    # Extract email details
+    content = None
+
+    payload = msg_data.get("payload", {})
+    headers = payload.get("headers", [])
+    parts = payload.get("parts", [])
+    for part in parts:
+        body = part.get("body", None)
+        if not body:
+            continue
+        encryted_data = body.get("data", None)
+        if not encryted_data:
+            continue
+        html_content = base64.urlsafe_b64decode(encryted_data).decode()
+        content = extract_text_from_html(html_content)
+        break
+
+    email_subject = next(
+        (h["value"] for h in headers if h["name"] == "Subject"), "No Subject")
+    email_from = next(
+        (h["value"] for h in headers if h["name"] == "From"), "Unknown Sender")
+    email_snippet = msg_data.get("snippet", None)
+
+    unix_milli = msg_data.get("internalDate", None)
+    # Convert to seconds
+    timestamp_s = int(unix_milli) / 1000
+    dt_utc = datetime.fromtimestamp(timestamp_s, tz=timezone.utc)
+
+    if not content:
+        content = email_snippet
+
+    if not email_snippet:
+        email_snippet = content[:50] + "..." if len(content) > 50 else content
+
+    return EmailRecord(
+        id=msg_id,
+        thread_id=msg_data.get("threadId", None),
+        sender=email_from,
+        subject=email_subject,
+        snippet=email_snippet,
+        raw=content,
+        date=dt_utc,
+        label_ids=tuple(msg_data.get("labelIds", [])),
+        attachments=tuple(find_attachments(payload)),
+    )
+
+
+def get_message(token: str, id: str) -> EmailRecord:
+    """ Fetches a single message of the user in the same shape as get_email's items """
+    service = get_gmail_service(token)
+    msg_data = service.users().messages().get(userId="me", id=id, format="full").execute()
+    return parse_message(msg_data)
 
 
-def create_message(sender, to, subject, message_text, id: str | None = None, thread_id: str | None = None):
+def create_message(sender, to, subject, message_text, id: str | None = None, thread_id: str | None = None,
+                   in_reply_to: str | None = None, references: str | None = None, message_id: str | None = None):
     message = EmailMessage()
     message.set_content(message_text)
     message['To'] = to
     message['From'] = sender
     message['Subject'] = subject
+    if message_id:
+        message['Message-ID'] = message_id
     if id:
-        message['In-Reply-To'] = id
-        message['References'] = id
+        # The RFC 822 Message-ID of the replied-to message when known, so other clients thread it too
+        message['In-Reply-To'] = in_reply_to or id
+        message['References'] = references or in_reply_to or id
 
     end_message = {
         "raw": base64.urlsafe_b64encode(message.as_bytes()).decode(),
@@ -149,24 +250,49 @@ def create_message(sender, to, subject, message_text, id: str | None = None, thr
     return end_message
 
 
-def send_email(token: str, to: str, subject: str, message_text: str, id: str | None = None, thread_id: str | None = None):
+def sender_address(token: str, service=None) -> str:
+    """ The user's email address; getProfile is called once a day rather than for every send """
+    address = _sender_cache.get((token,))
+    if address is None:
+        service = service or get_gmail_service(token)
+        address = service.users().getProfile(userId='me').execute()['emailAddress']
+        _sender_cache.set((token,), address)
+    return address
+
+
+def send_email(token: str, to: str, subject: str, message_text: str, id: str | None = None, thread_id: str | None = None,
+               in_reply_to: str | None = None, references: str | None = None, message_id: str | None = None) -> dict:
+    """ Sends an email and returns its Gmail id and threadId; Gmail API errors propagate (used by the outbox) """
     service = get_gmail_service(token)
-    profile = service.users().getProfile(userId='me').execute()
-    email_address = profile['emailAddress']
-    try:
-        message = create_message(
-            email_address, to, subject, message_text, id, thread_id)
-        response = service.users().messages().send(userId="me", body=message).execute()
-        return {'id': response['id'], 'threadId': response['threadId']}
-    except Exception as e:
-        logger.error(f"An error occurred: {e}")
-        logger.error(f"{traceback.format_exc()}")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+    message = create_message(sender_address(token, service), to, subject, message_text, id, thread_id,
+                             in_reply_to, references, message_id)
+    response = service.users().messages().send(userId="me", body=message).execute()
+    return {'id': response['id'], 'threadId': response['threadId']}
+
+
+def find_sent(token: str, message_id: str) -> dict | None:
+    """ Looks up a sent email by its Message-ID header, e.g. to tell whether a failed send went out """
+    service = get_gmail_service(token)
+    results = service.users().messages().list(
+        userId="me", q=f"in:sent rfc822msgid:{message_id}", maxResults=1).execute()
+    messages = results.get("messages", [])
+    return {'id': messages[0]['id'], 'threadId': messages[0]['threadId']} if messages else None
+
+
+# batchModify accepts up to 1000 ids and costs as much as this many single modify calls
+_BATCH_MODIFY_BREAK_EVEN = (GMAIL_QUOTA_UNITS["gmail.users.messages.batchModify"]
+                            // GMAIL_QUOTA_UNITS["gmail.users.messages.modify"])
 
 
 def mark_as_read(token: str, ids: list[str]) -> bool:
     service = get_gmail_service(token)
     try:
+        if len(ids) >= _BATCH_MODIFY_BREAK_EVEN:
+            for i in range(0, len(ids), 1000):
+                service.users().messages().batchModify(
+                    userId='me', body={'ids': ids[i:i + 1000], 'removeLabelIds': ['UNREAD']}).execute()
+            logger.debug(f'Marked {len(ids)} messages as read.')
+            return True
         for id in ids:
             service.users().messages().modify(
                 userId='me', id=id, body={'removeLabelIds': ['UNREAD']}).execute()
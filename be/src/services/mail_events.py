@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator
+
+import orjson
+from fastapi import Request
+
+from src.services.drafts import note_thread_message
+from src.services.email import get_gmail_service, get_history_id
+from src.utils.startup import startup
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Seconds between history.list calls per user, however many tabs are open
+POLL_INTERVAL = float(os.getenv("MAIL_EVENTS_POLL_INTERVAL", "10"))
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+# Events buffered per subscriber before it is told to resync instead
+QUEUE_SIZE = 256
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+
+
+def compact_events(record: dict) -> list[dict]:
+    """ Flattens one Gmail history record into small per-message events """
+    history_id = record["id"]
+    events = []
+    for key, event_type in (("messagesAdded", "messageAdded"), ("messagesDeleted", "messageDeleted")):
+        for item in record.get(key, []):
+            msg = item["message"]
+            events.append({"type": event_type, "historyId": history_id, "id": msg["id"],
+                           "threadId": msg.get("threadId"), "labelIds": msg.get("labelIds", [])})
+    for key, event_type in (("labelsAdded", "labelsAdded"), ("labelsRemoved", "labelsRemoved")):
+        for item in record.get(key, []):
+            msg = item["message"]
+            events.append({"type": event_type, "historyId": history_id, "id": msg["id"],
+                           "threadId": msg.get("threadId"), "labelIds": msg.get("labelIds", []),
+                           "changed": item.get("labelIds", [])})
+    return events
+
+
+def list_history(service, start_history_id: str) -> tuple[list[dict], str]:
+    """
+    Returns the compact events recorded after `start_history_id` and the latest historyId.
+    Raises HttpError 404 when `start_history_id` is too old for Gmail to answer.
+    """
+    events = []
+    page_token = None
+    while True:
+        response = service.users().history().list(
+            userId="me", startHistoryId=start_history_id, historyTypes=HISTORY_TYPES,
+            pageToken=page_token).execute()
+        for record in response.get("history", []):
+            events.extend(compact_events(record))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return events, str(response.get("historyId", start_history_id))
+
+
+def format_sse(event: dict) -> str:
+    lines = []
+    if event.get("historyId"):
+        lines.append(f"id: {event['historyId']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {orjson.dumps(event).decode()}")
+    return "\n".join(lines) + "\n\n"
+
+
+class MailboxWatcher:
+    """
+    Polls one user's Gmail history and fans the events out to every subscribed stream.
+    The poller starts with the first subscriber and stops one interval after the last one leaves.
+    """
+
+    def __init__(self, token: str, interval: float = POLL_INTERVAL):
+        self.token = token
+        self.interval = interval
+        self.history_id: str | None = None
+        self.subscribers: set[asyncio.Queue] = set()
+        self.task: asyncio.Task | None = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: dict):
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The client fell behind; drop its backlog and let it refetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "historyId": self.history_id})
+
+    async def _run(self):
+        try:
+            service = await asyncio.to_thread(get_gmail_service, self.token)
+            if self.history_id is None:
+                self.history_id = await asyncio.to_thread(get_history_id, service)
+            while self.subscribers:
+                await asyncio.sleep(self.interval)
+                if not self.subscribers:
+                    break
+                await self._poll(service)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Mailbox watcher failed: {e}")
+            self.publish({"type": "error", "detail": str(e)})
+        finally:
+            if _watchers.get(self.token) is self:
+                del _watchers[self.token]
+
+    async def _poll(self, service):
+        from googleapiclient.errors import HttpError
+
+        try:
+            events, history_id = await asyncio.to_thread(list_history, service, self.history_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                logger.warning(f"history.list failed, retrying next interval: {e}")
+                return
+            # The history window expired; clients have to refetch their lists
+            self.history_id = await asyncio.to_thread(get_history_id, service)
+            self.publish({"type": "resync", "historyId": self.history_id})
+            return
+        self.history_id = history_id
+        for event in events:
+            if event["type"] == "messageAdded":
+                note_thread_message(self.token, event.get("threadId"), event["id"])
+            self.publish(event)
+
+
+_watchers: dict[str, MailboxWatcher] = {}
+
+
+def get_watcher(token: str) -> MailboxWatcher:
+    """ Returns the user's shared watcher, creating it if no tab is subscribed yet """
+    watcher = _watchers.get(token)
+    if watcher is None:
+        watcher = _watchers[token] = MailboxWatcher(token)
+    return watcher
+
+
+async def stop_watchers():
+    """ Cancels all pollers, e.g. on shutdown """
+    tasks = [w.task for w in _watchers.values() if w.task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _watchers.clear()
+
+
+async def _catch_up(token: str, last_event_id: str) -> list[dict]:
+    """ Replays what a reconnecting client missed since `last_event_id` """
+    try:
+        service = await asyncio.to_thread(get_gmail_service, token)
+        events, _ = await asyncio.to_thread(list_history, service, last_event_id)
+        return events
+    except Exception as e:
+        logger.info(f"Cannot replay history from {last_event_id}: {e}")
+        return [{"type": "resync"}]
+
+
+async def event_stream(request: Request, token: str, last_event_id: str | None = None) -> AsyncIterator[str]:
+    """ Yields server-sent events for the user's mailbox until the client disconnects """
+    watcher = get_watcher(token)
+    queue = watcher.subscribe()
+    last_sent = 0
+    try:
+        yield f"retry: {int(POLL_INTERVAL * 1000)}\n\n"
+        if last_event_id:
+            for event in await _catch_up(token, last_event_id):
+                last_sent = max(last_sent, int(event.get("historyId") or 0))
+                yield format_sse(event)
+        yield format_sse({"type": "ready", "historyId": watcher.history_id})
+        # Ends on shutdown; the client reconnects (to another worker) with Last-Event-ID
+        while not startup.stopping and not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            history_id = int(event.get("historyId") or 0)
+            if history_id and history_id <= last_sent:
+                # Already delivered by the catch-up replay
+                continue
+            yield format_sse(event)
+            if event["type"] == "error":
+                break
+    finally:
+        watcher.unsubscribe(queue)
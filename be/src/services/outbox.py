@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from src.repo.outbox import get_outbox
+from src.services.drafts import note_thread_message
+from src.services.email import find_sent, send_email
+from src.services.priority import add_correspondents
+from src.services.threads import reply_headers
+from src.utils.quota import RETRYABLE_STATUSES, is_rate_limit_error
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Sends running at once in this process
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+# Attempts before a job is marked as failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+# Seconds a worker may hold a job before another one may take it over
+LEASE = 120
+BACKOFF_BASE = 2
+BACKOFF_CAP = 15 * 60
+POLL_INTERVAL = 1
+# Seconds shutdown waits for the sends in progress
+STOP_TIMEOUT = 30
+# Finished jobs are kept this long so their status can still be polled
+RETENTION = 7 * 24 * 60 * 60
+
+
+def outbox_message_id(job_id: str) -> str:
+    """ The Message-ID header of a job's email, which lets a retry check whether it already went out """
+    return f"<{job_id}@outbox.mailmate>"
+
+
+class TransientSendError(Exception):
+    """ A send that failed in a way worth retrying """
+
+
+def deliver(job: dict) -> dict:
+    """ Sends one outbox job; raises TransientSendError for failures that should be retried """
+    from googleapiclient.errors import HttpError
+
+    token = job["user"]
+    payload = job["payload"]
+    message_id = outbox_message_id(job["id"])
+    try:
+        if job["attempts"] > 1:
+            # Any earlier attempt may have reached Gmail, even one that failed or whose worker died
+            # after sending (a rate-limited attempt may have been taken over from a live worker)
+            sent = find_sent(token, message_id)
+            if sent is not None:
+                return sent
+        in_reply_to = references = None
+        if payload.get("threadId"):
+            try:
+                in_reply_to, references = reply_headers(token, payload["threadId"], payload["id"])
+            except HttpError as e:
+                logger.warning(f"Could not look up the replied-to message, threading by id only: {e}")
+        return send_email(token, payload["to"], payload["subject"], payload["body"], payload.get("id"),
+                          payload.get("threadId"), in_reply_to, references, message_id)
+    except HttpError as e:
+        if is_rate_limit_error(e):
+            raise TransientSendError(f"rate limited: {e.reason}") from e
+        if e.resp.status in RETRYABLE_STATUSES:
+            raise TransientSendError(f"{e.resp.status} {e.reason}") from e
+        raise
+    except OSError as e:
+        # Connection errors and timeouts
+        raise TransientSendError(str(e)) from e
+
+
+class OutboxWorkers:
+    """
+    Sends the emails queued in the outbox with OUTBOX_WORKERS concurrent workers. Transient
+    failures are retried with exponential backoff and jitter up to OUTBOX_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, workers: int = OUTBOX_WORKERS, max_attempts: int = OUTBOX_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.tasks: list[asyncio.Task] = []
+        self.wakeup = asyncio.Event()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.last_purge = 0.0
+        self.stopping = False
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = False
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = STOP_TIMEOUT):
+        """ Stops claiming jobs and waits up to `timeout` seconds for the sends in progress """
+        self.stopping = True
+        self.wakeup.set()
+        if self.tasks:
+            _, pending = await asyncio.wait(self.tasks, timeout=timeout)
+            if pending:
+                logger.warning(f"Outbox: {len(pending)} sends still running at shutdown, "
+                               f"their leases expire and they are retried")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def notify(self):
+        """ Wakes an idle worker right away instead of at its next poll (callable from any thread) """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def _run(self):
+        outbox = get_outbox()
+        while not self.stopping:
+            try:
+                job = await asyncio.to_thread(outbox.claim, LEASE)
+            except Exception as e:
+                logger.error(f"Outbox claim failed: {e}")
+                job = None
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                await self._purge(outbox)
+                continue
+            try:
+                await asyncio.to_thread(self._process, outbox, job)
+            except Exception as e:
+                # The lease expires and another worker retries the job
+                logger.error(f"Outbox job failed unexpectedly: {e}")
+
+    async def _purge(self, outbox):
+        if time.monotonic() - self.last_purge < 60 * 60:
+            return
+        self.last_purge = time.monotonic()
+        removed = await asyncio.to_thread(outbox.purge, RETENTION)
+        if removed:
+            logger.info(f"Purged {removed} finished outbox jobs")
+
+    def _process(self, outbox, job: dict):
+        try:
+            result = deliver(job)
+        except TransientSendError as e:
+            if job["attempts"] >= self.max_attempts:
+                logger.error(f"Giving up on outbox job after {job['attempts']} attempts: {e}")
+                outbox.fail(job["id"], str(e))
+                return
+            delay = random.uniform(0.5, 1) * min(BACKOFF_CAP, BACKOFF_BASE * 2 ** job["attempts"])
+            logger.warning(f"Send failed ({e}), retrying in {delay:.0f}s")
+            outbox.retry(job["id"], delay, str(e))
+            return
+        except Exception as e:
+            logger.error(f"Send failed permanently: {e}")
+            outbox.fail(job["id"], str(e))
+            return
+        outbox.complete(job["id"], result)
+        # Mail from people the user writes to ranks higher
+        add_correspondents(job["user"], [job["payload"]["to"]])
+        # Our reply is now the newest message of the thread; drop any draft for it
+        note_thread_message(job["user"], result.get("threadId"), result["id"])
+
+
+workers = OutboxWorkers()
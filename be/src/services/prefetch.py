@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import random
+import time
+
+from fastapi import HTTPException
+
+from src.repo.auth import get_active_users
+from src.repo.state import get_state
+from src.services.calendar import get_events_with_etag
+from src.services.drafts import prepare_drafts
+from src.services.priority import refresh_correspondents
+from src.services.semantic_search import sync_index
+from src.services.email import load_emails
+from src.utils.quota import is_rate_limit_error, limiter
+from tools.inbox_summary import get_inbox_summary
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Seconds between warm-ups of the same user (+/- PREFETCH_JITTER of it, so users spread out)
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "240"))
+PREFETCH_JITTER = float(os.getenv("PREFETCH_JITTER", "0.25"))
+# Users who made no request for this long are no longer warmed
+PREFETCH_ACTIVE_WINDOW = float(os.getenv("PREFETCH_ACTIVE_WINDOW", "1800"))
+# Warm-ups running at once, across all users
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "4"))
+# Whether to pre-generate the inbox summary (one LLM call, only when the inbox changed)
+PREFETCH_SUMMARY = os.getenv("PREFETCH_SUMMARY", "1") == "1"
+# Warm-ups wait while less than this share of the user's (or the project's) Google quota is
+# left, so they never compete with the user's own requests
+PREFETCH_MIN_HEADROOM = float(os.getenv("PREFETCH_MIN_HEADROOM", "0.5"))
+# Seconds until a warm-up that waited for quota is tried again
+QUOTA_BUSY_DELAY = 15
+# Pause after Google reports a rate limit for a user, doubled on every repeat
+RATE_LIMIT_COOLDOWN = 60
+MAX_COOLDOWN = 60 * 60
+TICK = 5
+
+
+def is_rate_limited(exc: Exception) -> bool:
+    """ Whether a Google API error means the user or project ran out of quota """
+    from googleapiclient.errors import HttpError
+
+    if isinstance(exc, HttpError):
+        return is_rate_limit_error(exc)
+    if isinstance(exc, HTTPException):
+        detail = str(exc.detail).lower()
+        return exc.status_code == 429 or "ratelimitexceeded" in detail or "429" in detail
+    return False
+
+
+def quota_busy(token: str) -> bool:
+    """ Whether the user's Gmail or Calendar quota is too busy for background calls right now """
+    return any(limiter.headroom(api, token) < PREFETCH_MIN_HEADROOM for api in ("gmail", "calendar"))
+
+
+def warm_user(token: str):
+    """ Fills the caches the user's first page loads read from """
+    # The same listing the inbox pages and the summary tool request; one getProfile call when unchanged
+    emails = load_emails(token, 10, False, None)
+    # New mail becomes searchable by meaning (plus a daily backfill of older mail)
+    sync_index(token, emails)
+    # Whom the user writes to, for the priority scores (read at most once a day)
+    refresh_correspondents(token)
+    get_events_with_etag(token, None, None, "primary", refresh=True)
+    if PREFETCH_SUMMARY:
+        get_inbox_summary(token)
+    # Reply drafts for the high-priority emails, within the user's hourly budget
+    prepare_drafts(token, emails)
+
+
+class PrefetchScheduler:
+    """
+    Periodically warms the mailbox, calendar and summary caches of recently active users.
+    Each user is warmed right after becoming active and then every PREFETCH_INTERVAL seconds
+    (with jitter). A warm-up waits while the user's quota is in use by their own requests, and
+    users who hit a Google rate limit are skipped for an increasing cooldown.
+    """
+
+    def __init__(self, interval: float = PREFETCH_INTERVAL, jitter: float = PREFETCH_JITTER,
+                 active_window: float = PREFETCH_ACTIVE_WINDOW, concurrency: int = PREFETCH_CONCURRENCY):
+        self.interval = interval
+        self.jitter = jitter
+        self.active_window = active_window
+        self.concurrency = concurrency
+        self.next_due: dict[str, float] = {}
+        self.cooldowns: dict[str, float] = {}
+        self.inflight: set[str] = set()
+        self.task: asyncio.Task | None = None
+        self.workers: set[asyncio.Task] = set()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [t for t in (self.task, *self.workers) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        while True:
+            now = time.monotonic()
+            active = set(get_active_users(self.active_window))
+            for token in list(self.next_due):
+                if token not in active:
+                    del self.next_due[token]
+                    self.cooldowns.pop(token, None)
+            for token in active:
+                if token in self.inflight or self.next_due.get(token, 0) > now:
+                    continue
+                self.inflight.add(token)
+                task = asyncio.create_task(self._warm(token, semaphore))
+                self.workers.add(task)
+                task.add_done_callback(self.workers.discard)
+            await asyncio.sleep(TICK)
+
+    async def _warm(self, token: str, semaphore: asyncio.Semaphore):
+        delay = self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+        try:
+            state = get_state()
+            if quota_busy(token):
+                delay = QUOTA_BUSY_DELAY
+                logger.info(f"Prefetch deferred for {delay}s, the user's Google quota is in use")
+            # With several workers only one of them warms a given user; the caches are shared
+            elif not state.shared or state.add(f"prefetch:{token}", b"1", ttl=self.interval * (1 - self.jitter)):
+                async with semaphore:
+                    started = time.monotonic()
+                    await asyncio.to_thread(warm_user, token)
+                    logger.info(f"Prefetched caches in {time.monotonic() - started:.2f}s")
+                self.cooldowns.pop(token, None)
+        except Exception as e:
+            if is_rate_limited(e):
+                delay = min(self.cooldowns.get(token, RATE_LIMIT_COOLDOWN / 2) * 2, MAX_COOLDOWN)
+                self.cooldowns[token] = delay
+                logger.warning(f"Prefetch rate limited, pausing user for {delay:.0f}s")
+            else:
+                delay = self.interval
+                logger.warning(f"Prefetch failed: {e}")
+        finally:
+            self.inflight.discard(token)
+        self.next_due[token] = time.monotonic() + delay
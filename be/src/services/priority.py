@@ -0,0 +1,138 @@
+"""
+Local priority model: scores a whole batch of emails at once with NumPy, without an LLM call.
+
+Features (one column each): the user has written to the sender before, Gmail's IMPORTANT
+and STARRED labels, urgent keywords in the subject, recency, thread length within the
+batch, how many of the batch's emails come from the same sender, and signs of bulk mail.
+"""
+import os
+import re
+import time
+from datetime import datetime
+from email.utils import getaddresses, parseaddr
+
+import numpy as np
+
+from src.services.email import get_gmail_service
+from src.utils.cache import SharedCache
+from src.utils.records import EmailRecord
+
+# Scores at or above this are "High" priority
+PRIORITY_THRESHOLD = float(os.getenv("PRIORITY_THRESHOLD", "0.6"))
+RECENCY_HALF_LIFE = 24 * 60 * 60
+# Sent messages read to learn whom the user writes to, refreshed once a day
+SENT_SAMPLE = int(os.getenv("PRIORITY_SENT_SAMPLE", "25"))
+CORRESPONDENTS_REFRESH = 24 * 60 * 60
+
+URGENT_WORDS = re.compile(
+    r"\b(urgent|asap|action required|deadline|due|overdue|invoice|payment|security|password|verify|"
+    r"interview|offer|contract|meeting|today|tomorrow|reminder)\b", re.IGNORECASE)
+BULK_SENDERS = re.compile(r"(no-?reply|newsletter|notifications?|mailer|updates|news)@", re.IGNORECASE)
+BULK_LABELS = {"CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL", "CATEGORY_UPDATES", "CATEGORY_FORUMS"}
+
+FEATURES = ("replied", "important", "starred", "keywords", "recency", "thread_length",
+            "sender_frequency", "bulk")
+WEIGHTS = np.array([2.0, 1.5, 1.0, 1.0, 1.0, 0.5, -0.75, -1.5])
+BIAS = -1.5
+
+# (token,) -> {"addresses": [...], "refreshedAt"}: people the user has sent mail to
+_correspondents = SharedCache("correspondents", maxsize=4096, ttl=30 * 24 * 60 * 60, snapshot=True)
+
+
+def get_correspondents(token: str) -> set[str]:
+    entry = _correspondents.get((token,))
+    return set(entry["addresses"]) if entry else set()
+
+
+def add_correspondents(token: str, header_values: list[str], refreshed_at: float | None = None):
+    """ Remembers the addresses in To/Cc header values as people the user writes to """
+    entry = _correspondents.get((token,)) or {"addresses": [], "refreshedAt": 0}
+    addresses = set(entry["addresses"])
+    addresses.update(addr.lower() for _, addr in getaddresses(header_values) if addr)
+    _correspondents.set((token,), {"addresses": sorted(addresses),
+                                   "refreshedAt": entry["refreshedAt"] if refreshed_at is None else refreshed_at})
+
+
+def refresh_correspondents(token: str, sample: int = SENT_SAMPLE):
+    """ Reads the recipients of the user's latest sent mail; does nothing if done in the last day """
+    entry = _correspondents.get((token,))
+    if entry is not None and time.time() - entry["refreshedAt"] < CORRESPONDENTS_REFRESH:
+        return
+    service = get_gmail_service(token)
+    results = service.users().messages().list(userId="me", q="in:sent", maxResults=sample).execute()
+    recipients = []
+    for message in results.get("messages", []):
+        msg = service.users().messages().get(userId="me", id=message["id"], format="metadata",
+                                             metadataHeaders=["To", "Cc"]).execute()
+        recipients.extend(h["value"] for h in msg.get("payload", {}).get("headers", [])
+                          if h["name"] in ("To", "Cc"))
+    add_correspondents(token, recipients, refreshed_at=time.time())
+
+
+def _group_sizes(keys: list[str]) -> np.ndarray:
+    """ For every element, how many elements share its key """
+    _, inverse, counts = np.unique(np.array(keys, dtype=str), return_inverse=True, return_counts=True)
+    return counts[inverse.reshape(-1)]
+
+
+def _timestamp(value) -> float:
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+def feature_matrix(emails: list[dict], correspondents: set[str], now: float | None = None) -> np.ndarray:
+    """ Returns an (emails x FEATURES) matrix scaled to roughly 0..1 per column """
+    n = len(emails)
+    now = time.time() if now is None else now
+    senders = [parseaddr(e.get("from") or "")[1].lower() for e in emails]
+    labels = [set(e.get("labelIds") or []) for e in emails]
+
+    x = np.zeros((n, len(FEATURES)))
+    x[:, 0] = [s in correspondents for s in senders]
+    x[:, 1] = ["IMPORTANT" in l for l in labels]
+    x[:, 2] = ["STARRED" in l for l in labels]
+    x[:, 3] = [URGENT_WORDS.search(e.get("subject") or "") is not None for e in emails]
+    age = np.maximum(now - np.array([_timestamp(e.get("date")) for e in emails]), 0)
+    x[:, 4] = np.exp2(-age / RECENCY_HALF_LIFE)
+    threads = _group_sizes([e.get("threadId") or e.get("id", "") for e in emails])
+    x[:, 5] = np.minimum(threads - 1, 4) / 4
+    same_sender = _group_sizes(senders)
+    x[:, 6] = np.log1p(same_sender - 1) / np.log1p(max(n - 1, 1))
+    x[:, 7] = [bool(l & BULK_LABELS) or BULK_SENDERS.search(s) is not None for l, s in zip(labels, senders)]
+    return x
+
+
+def priority_scores(emails: list[dict], correspondents: set[str], now: float | None = None) -> np.ndarray:
+    """ Scores between 0 and 1, higher is more important """
+    if not emails:
+        return np.zeros(0)
+    logits = feature_matrix(emails, correspondents, now) @ WEIGHTS + BIAS
+    return 1 / (1 + np.exp(-logits))
+
+
+def _with_priority(email, score: float):
+    priority = "High" if score >= PRIORITY_THRESHOLD else "Low"
+    score = round(float(score), 3)
+    if isinstance(email, EmailRecord):
+        return email.with_priority(priority, score)
+    return dict(email, priorityScore=score, priority=priority)
+
+
+def prioritize(token: str, emails: list) -> list:
+    """
+    Returns copies of the emails (same order, records or dicts) with "priorityScore" and
+    "priority" ("High"/"Low")
+    """
+    scores = priority_scores(emails, get_correspondents(token))
+    return [_with_priority(e, score) for e, score in zip(emails, scores)]
+
+
+def top_k(emails: list[dict], k: int) -> list[dict]:
+    """ The k emails with the highest priorityScore, best first (ties keep their order) """
+    scores = np.array([e["priorityScore"] for e in emails])
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [emails[i] for i in order]
@@ -0,0 +1,106 @@
+"""
+Offline semantic retrieval over the user's mail. Emails are embedded locally (see
+src.utils.embeddings) as they are synced and appended to the user's on-disk index
+(src.repo.vectors); queries are answered with one vectorized dot product against it.
+"""
+import logging
+import os
+
+import numpy as np
+
+from src.repo.state import get_state
+from src.repo.vectors import get_index, prune_indexes
+from src.services.email import load_emails, sender_address
+from src.utils.embeddings import get_embedder
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Characters of the body that are embedded and kept for the search tool's prompt
+INDEX_TEXT_CHARS = int(os.getenv("SEARCH_INDEX_TEXT_CHARS", "2000"))
+# Read and unread inbox messages indexed once a day, so older mail is searchable too
+SEARCH_BACKFILL = int(os.getenv("SEARCH_BACKFILL", "100"))
+BACKFILL_INTERVAL = 24 * 60 * 60
+# Hits scoring below this are not considered related to the query
+MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0.05"))
+
+
+def _index(token: str):
+    embedder = get_embedder()
+    # Keyed by the account rather than the login token: every sign-in gets a new token
+    return get_index(sender_address(token), embedder.name, embedder.dim)
+
+
+def _document(email: dict) -> str:
+    body = (email.get("raw") or email.get("snippet") or "")[:INDEX_TEXT_CHARS]
+    return f"{email.get('subject') or ''}\n{email.get('from') or ''}\n{body}"
+
+
+def index_emails(token: str, emails: list[dict]) -> int:
+    """ Embeds and appends the emails that are not in the user's index yet; returns how many """
+    index = _index(token)
+    missing = set(index.missing([e["id"] for e in emails]))
+    new = [e for e in emails if e["id"] in missing]
+    if not new:
+        return 0
+    vectors = get_embedder().embed([_document(e) for e in new])
+    items = [{
+        "id": e["id"], "threadId": e.get("threadId"), "from": e.get("from"), "subject": e.get("subject"),
+        "date": e.get("date"), "snippet": e.get("snippet"),
+        "raw": (e.get("raw") or "")[:INDEX_TEXT_CHARS],
+    } for e in new]
+    return index.append(items, vectors)
+
+
+def sync_index(token: str, emails: list[dict]):
+    """
+    Indexes a freshly synced listing, and once a day the latest SEARCH_BACKFILL inbox
+    messages (read or not) and deletes the indexes of accounts gone for SEARCH_INDEX_MAX_AGE.
+    Used by the prefetcher.
+    """
+    added = index_emails(token, emails)
+    if get_state().add(f"search:backfill:{sender_address(token)}", b"1", ttl=BACKFILL_INTERVAL):
+        _index(token).touch()
+        if SEARCH_BACKFILL > 0:
+            added += index_emails(token, load_emails(token, SEARCH_BACKFILL, True, None))
+    if get_state().add("search:prune", b"1", ttl=BACKFILL_INTERVAL):
+        removed = prune_indexes()
+        if removed:
+            logger.info(f"Deleted {removed} unused search indexes")
+    if added:
+        logger.info(f"Indexed {added} emails for semantic search")
+
+
+def _query_vector(index, query: str) -> np.ndarray:
+    embedder = get_embedder()
+    vector = embedder.embed([query])[0]
+    if embedder.uses_idf and len(index):
+        # Rare terms decide the match, words found in every email barely count
+        vector = vector * index.idf()
+        vector /= max(np.linalg.norm(vector), 1e-12)
+    return vector
+
+
+def semantic_search(token: str, query: str, k: int = 10) -> list[dict]:
+    """ The k indexed emails closest to the query, best first, each with a "score" """
+    index = _index(token)
+    hits = index.search(_query_vector(index, query), k)
+    return [dict(meta, score=round(score, 4)) for score, meta in hits if score >= MIN_SCORE]
+
+
+def rank_candidates(token: str, query: str, emails: list[dict], k: int) -> list[dict]:
+    """
+    Merges emails found another way (e.g. a keyword search) with the index's best matches
+    and keeps the k most similar to the query, best first. The given emails are indexed too.
+    """
+    index_emails(token, emails)
+    index = _index(token)
+    query_vector = _query_vector(index, query)
+    candidates = {e["id"]: e for e in emails}
+    for score, meta in index.search(query_vector, k):
+        if score >= MIN_SCORE:
+            candidates.setdefault(meta["id"], meta)
+    candidates = list(candidates.values())
+    if not candidates:
+        return []
+    scores = get_embedder().embed([_document(e) for e in candidates]) @ query_vector
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [candidates[i] for i in order]
@@ -0,0 +1,110 @@
+"""
+Free-slot suggestions for new events, e.g. one found in an email that collides with the
+calendar.
+
+The window becomes a minute-resolution busy bitmap of the user's calendars (from the
+free/busy API) and a working-hours mask in the user's time zone. A running sum over the free
+minutes then tells for every candidate start at once whether the following `duration`
+minutes are all free, so a window of several months over many calendars is a few hundred
+thousand booleans and one vectorized pass.
+"""
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from src.services.calendar import get_busy
+
+MAX_WINDOW_DAYS = int(os.getenv("SLOT_MAX_WINDOW_DAYS", "366"))
+
+
+@dataclass(frozen=True)
+class WorkingHours:
+    start: time = time(9)
+    end: time = time(18)
+    # Monday = 0
+    days: tuple[int, ...] = (0, 1, 2, 3, 4)
+    time_zone: str = "Asia/Singapore"
+
+
+def busy_bitmap(busy: list[list[str]], start: datetime, minutes: int) -> np.ndarray:
+    """ One bool per minute from `start`: whether any busy [start, end] time covers it """
+    if not busy:
+        return np.zeros(minutes, dtype=bool)
+    bounds = np.array([[datetime.fromisoformat(s).timestamp(), datetime.fromisoformat(e).timestamp()]
+                       for s, e in busy])
+    offsets = (bounds - start.timestamp()) / 60
+    # A partly busy minute counts as busy
+    first = np.clip(np.floor(offsets[:, 0]), 0, minutes).astype(np.int64)
+    last = np.clip(np.ceil(offsets[:, 1]), 0, minutes).astype(np.int64)
+    depth = np.bincount(first, minlength=minutes + 1) - np.bincount(last, minlength=minutes + 1)
+    return np.cumsum(depth[:minutes]) > 0
+
+
+def _working_days(start: datetime, end: datetime, hours: WorkingHours) -> list[tuple[datetime, datetime]]:
+    tz = ZoneInfo(hours.time_zone)
+    day: date = start.astimezone(tz).date()
+    last: date = end.astimezone(tz).date()
+    days = []
+    while day <= last:
+        if day.weekday() in hours.days:
+            days.append((datetime.combine(day, hours.start, tz), datetime.combine(day, hours.end, tz)))
+        day += timedelta(days=1)
+    return days
+
+
+def find_slots(busy: list[list[str]], start: datetime, end: datetime, duration: int, count: int = 5,
+               hours: WorkingHours = WorkingHours(), preferred: datetime | None = None,
+               step: int = 15) -> list[dict]:
+    """
+    The `count` best free slots of `duration` minutes between `start` and `end` (aware
+    datetimes) within working hours, not overlapping each other. Slots start every `step`
+    minutes from the start of the working day; the best are those closest to `preferred`
+    (earliest first without one).
+    """
+    start = start.astimezone(timezone.utc).replace(second=0, microsecond=0)
+    minutes = int((end - start).total_seconds() // 60)
+    if minutes < duration:
+        return []
+    # Working time as a mask, and the aligned candidate starts of each working day
+    edges = np.zeros(minutes + 1, dtype=np.int64)
+    candidates = []
+    for day_start, day_end in _working_days(start, end, hours):
+        first = int((day_start - start).total_seconds() // 60)
+        last = int((day_end - start).total_seconds() // 60)
+        if last <= 0 or first >= minutes:
+            continue
+        edges[max(first, 0)] += 1
+        edges[min(last, minutes)] -= 1
+        day_starts = np.arange(first, min(last, minutes) - duration + 1, step)
+        candidates.append(day_starts[day_starts >= 0])
+    if not candidates:
+        return []
+    candidates = np.concatenate(candidates)
+    free = (np.cumsum(edges[:minutes]) > 0) & ~busy_bitmap(busy, start, minutes)
+    # free_before[i] = free minutes before minute i; a slot fits where all its minutes are free
+    free_before = np.concatenate(([0], np.cumsum(free)))
+    candidates = candidates[free_before[candidates + duration] - free_before[candidates] == duration]
+
+    target = 0 if preferred is None else (preferred - start).total_seconds() / 60
+    order = np.argsort(np.abs(candidates - target), kind="stable")
+    chosen: list[int] = []
+    for candidate in candidates[order]:
+        if all(abs(candidate - other) >= duration for other in chosen):
+            chosen.append(int(candidate))
+            if len(chosen) == count:
+                break
+    tz = ZoneInfo(hours.time_zone)
+    return [{"start": (start + timedelta(minutes=m)).astimezone(tz).isoformat(),
+             "end": (start + timedelta(minutes=m + duration)).astimezone(tz).isoformat()}
+            for m in chosen]
+
+
+def suggest_slots(token: str, start: datetime, end: datetime, duration: int, count: int = 5,
+                  calendar_ids: list[str] | None = None, hours: WorkingHours = WorkingHours(),
+                  preferred: datetime | None = None, step: int = 15) -> list[dict]:
+    """ find_slots over the busy times of the user's calendars (the primary one by default) """
+    busy = get_busy(token, start, end, calendar_ids or ["primary"])
+    return find_slots(busy, start, end, duration, count, hours, preferred, step)
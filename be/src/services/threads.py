@@ -0,0 +1,165 @@
+"""
+Conversation view of Gmail threads for the reply and summary prompts: one users.threads.get
+per thread, with the quoted history removed from every message so each text appears once.
+"""
+import base64
+import logging
+import os
+import re
+
+from src.services.email import current_history_id, get_gmail_service, parse_message
+from src.utils.cache import SharedCache
+from src.utils.singleflight import flights
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# (token, thread id) -> {"historyId", "thread"}; an entry stays valid while the mailbox history
+# since its historyId shows no message added to or deleted from the thread
+_thread_cache = SharedCache("threads", maxsize=1024, ttl=float(os.getenv("THREAD_CACHE_TTL", "3600")),
+                            snapshot=True)
+
+# Separator Outlook puts above the quoted message
+_ORIGINAL_MESSAGE = re.compile(r"^-{2,}\s*Original Message\s*-{2,}", re.IGNORECASE)
+
+
+def _is_quote_header(lines: list[str], i: int) -> bool:
+    line = lines[i].strip()
+    following = lines[i + 1].strip() if i + 1 < len(lines) else ""
+    if _ORIGINAL_MESSAGE.match(line):
+        return True
+    # "On Mon, 1 Apr 2025 at 09:00, Alice <alice@example.com> wrote:", sometimes wrapped
+    if line.startswith("On ") and (line.endswith("wrote:") or following.endswith("wrote:")):
+        return True
+    # Outlook's "From: ... / Sent: ..." block
+    return line.startswith("From:") and following.startswith(("Sent:", "Date:"))
+
+
+def strip_quoted(text: str) -> str:
+    """ Removes the quoted earlier messages from a reply's text, keeping what the sender wrote """
+    lines = text.splitlines()
+    kept = []
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith(">"):
+            continue
+        if _is_quote_header(lines, i):
+            break
+        kept.append(line)
+    # A message that is nothing but a quote is better kept whole than dropped
+    return "\n".join(kept).strip() or text.strip()
+
+
+def _find_part(payload: dict, mime_type: str) -> dict | None:
+    if payload.get("mimeType") == mime_type and payload.get("body", {}).get("data"):
+        return payload
+    for part in payload.get("parts", []):
+        found = _find_part(part, mime_type)
+        if found is not None:
+            return found
+    return None
+
+
+def _decode(part: dict) -> str:
+    return base64.urlsafe_b64decode(part["body"]["data"]).decode(errors="replace")
+
+
+def message_text(payload: dict) -> str:
+    """ The message body as text: the text/plain part, else the HTML without its quote blocks """
+    part = _find_part(payload, "text/plain")
+    if part is not None:
+        return _decode(part)
+    part = _find_part(payload, "text/html")
+    if part is None:
+        return ""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(_decode(part), 'html.parser')
+    for quote in soup.select("blockquote, div.gmail_quote"):
+        quote.decompose()
+    return soup.get_text(separator="\n", strip=True)
+
+
+def _fetch_thread(service, thread_id: str) -> dict:
+    data = service.users().threads().get(userId="me", id=thread_id, format="full").execute()
+    messages = []
+    seen = set()
+    # Gmail returns the messages oldest first
+    for msg_data in data.get("messages", []):
+        # Thread messages carry extra fields and are cached as JSON, so they stay dicts
+        email = parse_message(msg_data).to_wire()
+        text = strip_quoted(message_text(msg_data.get("payload", {}))) or email["raw"] or ""
+        if (email["from"], text) in seen:
+            continue
+        seen.add((email["from"], text))
+        headers = {h["name"].lower(): h["value"] for h in msg_data.get("payload", {}).get("headers", [])}
+        email["raw"] = text
+        email["messageId"] = headers.get("message-id")
+        email["references"] = headers.get("references")
+        messages.append(email)
+    return {"id": thread_id, "messages": messages}
+
+
+def _changed_threads(service, since: str) -> set[str] | None:
+    """ Threads that gained or lost a message after historyId `since`; None if that is too old to tell """
+    from googleapiclient.errors import HttpError
+
+    changed = set()
+    page_token = None
+    while True:
+        try:
+            response = service.users().history().list(
+                userId="me", startHistoryId=since, historyTypes=["messageAdded", "messageDeleted"],
+                pageToken=page_token).execute()
+        except HttpError as e:
+            if e.resp.status == 404:
+                return None
+            raise
+        for record in response.get("history", []):
+            for key in ("messagesAdded", "messagesDeleted"):
+                for item in record.get(key, []):
+                    changed.add(item["message"].get("threadId"))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return changed
+
+
+def get_threads(token: str, thread_ids: list[str]) -> dict[str, dict]:
+    """
+    Returns {thread id: {"id", "messages"}} with each thread's messages oldest first, in the
+    shape of get_email's items plus "messageId" and "references"; "raw" has the quoted history
+    removed. Cached threads are revalidated with one history.list call for the whole batch.
+    """
+    service = get_gmail_service(token)
+    history_id = current_history_id(token, service)
+    entries = {thread_id: _thread_cache.get((token, thread_id)) for thread_id in thread_ids}
+    stale = [int(e["historyId"]) for e in entries.values() if e is not None and e["historyId"] != history_id]
+    changed = _changed_threads(service, str(min(stale))) if stale else set()
+
+    threads = {}
+    for thread_id, entry in entries.items():
+        if entry is not None and (entry["historyId"] == history_id or (changed is not None and thread_id not in changed)):
+            if entry["historyId"] != history_id:
+                _thread_cache.set((token, thread_id), dict(entry, historyId=history_id))
+            threads[thread_id] = entry["thread"]
+            continue
+        logger.info("Fetching thread")
+        thread = flights.do((token, "thread", thread_id, history_id), _fetch_thread, service, thread_id)
+        _thread_cache.set((token, thread_id), {"historyId": history_id, "thread": thread})
+        threads[thread_id] = thread
+    return threads
+
+
+def get_thread(token: str, thread_id: str) -> dict:
+    return get_threads(token, [thread_id])[thread_id]
+
+
+def format_conversation(messages: list[dict]) -> str:
+    """ Renders thread messages as one transcript for a prompt """
+    return "\n\n".join(f"From: {m['from']} ({m['date']})\n{m['raw']}" for m in messages)
+
+
+def reply_headers(token: str, thread_id: str, message_id: str) -> tuple[str | None, str | None]:
+    """ In-Reply-To and References values for replying to a message of a thread """
+    for msg in get_thread(token, thread_id)["messages"]:
+        if msg["id"] == message_id and msg.get("messageId"):
+            references = " ".join(filter(None, [msg.get("references"), msg["messageId"]]))
+            return msg["messageId"], references
+    return None, None
@@ -0,0 +1,130 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+import orjson
+
+from src.repo.state import get_state
+
+# namespace -> cache, for the warm-restart snapshots
+_snapshot_caches: dict[str, "SharedCache"] = {}
+
+
+class TTLCache:
+    """ Thread-safe LRU cache whose entries expire `ttl` seconds after they were set """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def pop_where(self, predicate) -> int:
+        """ Removes every entry whose key satisfies `predicate`; returns how many were removed """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> list[tuple[Hashable, float, Any]]:
+        """ (key, seconds left, value) of the live entries, least recently used first """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, expires_at - now, value) for key, (expires_at, value) in self._data.items()
+                    if expires_at > now]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SharedCache:
+    """
+    TTL cache kept in the shared state backend (STATE_BACKEND_URL) so that all workers see
+    the same entries; falls back to an in-process TTLCache with the default memory backend.
+    Keys are tuples whose first element is the user token; values must be JSON-serializable
+    (tuples come back as lists).
+    With `snapshot`, the in-process entries are written to disk on shutdown and restored on
+    the next start (see src.repo.snapshots); shared backends keep them anyway.
+    """
+
+    def __init__(self, namespace: str, maxsize: int = 256, ttl: float = 300, snapshot: bool = False):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = TTLCache(maxsize, ttl)
+        if snapshot:
+            _snapshot_caches[namespace] = self
+
+    def _generation(self, state, user: str) -> int:
+        return int(state.get(self._user_key(user)) or 0)
+
+    def _user_key(self, user: str) -> str:
+        return f"cache:{self.namespace}:gen:{hashlib.sha1(user.encode()).hexdigest()}"
+
+    def _key(self, state, key: tuple) -> str:
+        digest = hashlib.sha1(orjson.dumps([self._generation(state, key[0]), *key])).hexdigest()
+        return f"cache:{self.namespace}:{digest}"
+
+    def get(self, key: tuple, default: Any = None) -> Any:
+        state = get_state()
+        if not state.shared:
+            return self.local.get(key, default)
+        value = state.get_json(self._key(state, key))
+        return default if value is None else value
+
+    def set(self, key: tuple, value: Any, ttl: float | None = None):
+        state = get_state()
+        if not state.shared:
+            return self.local.set(key, value, ttl)
+        state.set_json(self._key(state, key), value, self.ttl if ttl is None else ttl)
+
+    def pop(self, key: tuple, default: Any = None) -> Any:
+        state = get_state()
+        if not state.shared:
+            return self.local.pop(key, default)
+        value = state.pop(self._key(state, key))
+        return default if value is None else orjson.loads(value)
+
+    def invalidate_user(self, user: str):
+        """ Drops every entry of one user """
+        state = get_state()
+        if not state.shared:
+            self.local.pop_where(lambda key: key[0] == user)
+            return
+        # Entries are keyed by the user's generation; old ones simply expire
+        state.incr(self._user_key(user), 1)
+
+
+def snapshot_caches() -> dict[str, SharedCache]:
+    """ The caches created with `snapshot=True`, by namespace """
+    return dict(_snapshot_caches)
@@ -0,0 +1,106 @@
+import atexit
+import json
+import os
+import queue
+import threading
+from uuid import uuid4
+
+# Fields (and path parameters and query parameters) whose values are kept as they are: counts,
+# flags, enums and settings that carry no mail content, personal data or ids. The strings in
+# every other field are replaced by placeholders of the same length, so replayed traffic keeps
+# the original payload sizes; numbers and booleans are kept everywhere.
+SAFE_FIELDS = {"count", "includeRead", "tone", "durationMinutes", "stepMinutes", "timeZone",
+               "workStart", "workEnd", "workDays", "bodyKey", "senderKey", "budget"}
+
+
+def _redact(value):
+    return "x" * len(value) if isinstance(value, str) else value
+
+
+def sanitize(data):
+    """ Redacts all but the SAFE_FIELDS in a decoded JSON body or query dict """
+    if isinstance(data, dict):
+        return {k: v if k in SAFE_FIELDS else sanitize(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [sanitize(v) for v in data]
+    return _redact(data)
+
+
+def redact_path(path: str, path_params: dict) -> str:
+    """ Replaces the path parameters (message ids, ...) in a request path """
+    segments = path.split("/")
+    values = {str(v) for k, v in path_params.items() if k not in SAFE_FIELDS}
+    return "/".join(_redact(segment) if segment in values else segment for segment in segments)
+
+
+class TrafficCapture:
+    """
+    Appends one sanitized JSON record per request to a JSONL file. Requests only queue
+    their record; a background thread sanitizes and writes them, so the event loop never
+    waits for the disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.writer = threading.Thread(target=self._write, daemon=True, name="traffic-capture")
+        self.writer.start()
+        atexit.register(self.close)
+
+    def record(self, method: str, path: str, query: dict[str, list[str]], body: bytes,
+               status: int, started: float, duration: float, path_params: dict | None = None):
+        self.queue.put((method, path, query, body, status, started, duration, path_params or {}))
+
+    def close(self, timeout: float = 5):
+        """ Writes the queued records and stops the writer """
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(timeout)
+
+    @staticmethod
+    def _entry(method: str, path: str, query: dict[str, list[str]], body: bytes, status: int,
+               started: float, duration: float, path_params: dict) -> dict:
+        try:
+            decoded = json.loads(body) if body else None
+        except ValueError:
+            decoded = None
+        return {
+            "request_id": str(uuid4()),
+            "ts": round(started, 6),
+            "method": method,
+            "path": redact_path(path, path_params),
+            "query": sanitize(query),
+            "body": sanitize(decoded) if decoded is not None else None,
+            "body_bytes": len(body),
+            "status": status,
+            "duration_ms": round(duration * 1000, 3),
+        }
+
+    def _write(self):
+        while True:
+            # Everything queued meanwhile goes out in one write
+            items = [self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get())
+            lines = "".join(json.dumps(self._entry(*item)) + "\n" for item in items if item is not None)
+            if lines:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            if None in items:
+                return
+
+
+_capture: TrafficCapture | None = None
+_capture_checked = False
+
+
+def get_capture() -> TrafficCapture | None:
+    """ Returns the capture sink when TRAFFIC_CAPTURE_FILE is set, otherwise None """
+    global _capture, _capture_checked
+    if not _capture_checked:
+        path = os.getenv("TRAFFIC_CAPTURE_FILE")
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            _capture = TrafficCapture(path)
+        _capture_checked = True
+    return _capture
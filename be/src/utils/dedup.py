@@ -0,0 +1,98 @@
+"""
+Near-duplicate detection with MinHash and locality-sensitive hashing, used to show the inbox
+summary's LLM one representative of each group of near-identical emails (notifications,
+newsletters), followed by the subject, date and id of the others.
+"""
+import re
+import zlib
+
+import numpy as np
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+# Estimated Jaccard similarity of word shingles above which two texts are near-duplicates
+THRESHOLD = 0.6
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(1)
+# Hash functions h(x) = (a * x + b) mod p; with 32-bit x the products fit in uint64
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)[:, None]
+
+_URL = re.compile(r"https?://\S+")
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(text: str) -> np.ndarray:
+    # Tracking links differ between copies of a notification. Numbers are kept: they are what
+    # tells apart two orders, invoices or tickets with otherwise identical text
+    text = _URL.sub("url", text.lower())
+    words = _WORD.findall(text)
+    if len(words) < SHINGLE_WORDS:
+        grams = [" ".join(words)]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode()) for g in grams), dtype=np.uint64, count=len(grams)))
+
+
+def minhash_signatures(texts: list[str]) -> np.ndarray:
+    """ An (texts x NUM_PERM) matrix of MinHash signatures """
+    signatures = np.empty((len(texts), NUM_PERM), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        signatures[row] = ((_A * _shingles(text) + _B) % _PRIME).min(axis=1)
+    return signatures
+
+
+def near_duplicate_groups(texts: list[str], threshold: float = THRESHOLD) -> list[list[int]]:
+    """
+    Groups the indices of near-identical texts. Groups are ordered by their first index and
+    list their members in input order, so the first member of a group can represent it.
+    """
+    n = len(texts)
+    if n < 2:
+        return [[i] for i in range(n)]
+    signatures = minhash_signatures(texts)
+    parent = list(range(n))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Texts sharing all rows of any band are candidates; the full signatures confirm them
+    for band in range(BANDS):
+        buckets: dict[bytes, int] = {}
+        for i in range(n):
+            key = signatures[i, band * ROWS:(band + 1) * ROWS].tobytes()
+            j = buckets.setdefault(key, i)
+            if j != i and find(i) != find(j) and np.mean(signatures[i] == signatures[j]) >= threshold:
+                parent[find(i)] = find(j)
+
+    groups: dict[int, list[int]] = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.values(), key=lambda group: group[0])
+
+
+def collapse_near_duplicates(items: list[dict], texts: list[str]) -> list[dict]:
+    """
+    Keeps the first item of each group of near-duplicate texts, as a copy with
+    "duplicates" (how many similar items it stands for) and "duplicateEmails" (the id,
+    subject, date and sender of each of them, so none is lost to the reader).
+    """
+    collapsed = []
+    for group in near_duplicate_groups(texts):
+        representative = items[group[0]]
+        others = [{"id": o.get("id"), "subject": o.get("subject"), "date": o.get("date"),
+                   "sender": o.get("sender") or o.get("from") or ""} for o in (items[i] for i in group[1:])]
+        collapsed.append(dict(representative, duplicates=len(others), duplicateEmails=others))
+    return collapsed
+
+
+def duplicates_note(item: dict) -> str:
+    """ Lists the near-duplicates an item stands for, e.g. "2 similar emails: a (date, from b, id c); ..." """
+    return f"{item['duplicates']} similar emails: " + "; ".join(
+        f"{o['subject']} ({o['date']}, from {o['sender']}, id {o['id']})" for o in item["duplicateEmails"])
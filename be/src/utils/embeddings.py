@@ -0,0 +1,93 @@
+"""
+Local text embedders for the semantic search index. EMBEDDER selects one:
+    hashing                              (default) feature hashing, no model download
+    sentence-transformers:<model name>   e.g. sentence-transformers:all-MiniLM-L6-v2
+"""
+import os
+import re
+import zlib
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have i in is it its me my of on or our so that the this "
+    "to was we were will with you your re fw fwd hi hello thanks regards".split())
+
+
+class Embedder(ABC):
+    """ Maps texts to L2-normalized float32 vectors of `dim` dimensions """
+    name = "base"
+    dim = 0
+    # Whether queries should be weighted by the index's inverse document frequencies
+    uses_idf = False
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        ...
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Signed feature hashing of word unigrams and bigrams with sublinear term frequencies.
+    Combined with IDF weights on the query side this is a TF-IDF retrieval model that needs
+    no vocabulary or model files and can index mail incrementally.
+    """
+    uses_idf = True
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list[str]:
+        words = [w for w in _WORD.findall(text.lower()) if w not in _STOPWORDS]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.array([zlib.crc32(f.encode()) for f in self._features(text)], dtype=np.uint32)
+            if not len(hashes):
+                continue
+            signs = np.where(hashes & 0x80000000, 1.0, -1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """ A sentence-transformers model run locally (downloaded once by the library) """
+
+    def __init__(self, model: str):
+        # Imported here: it loads torch, which would slow down every startup
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("EMBEDDER uses sentence-transformers but the package is not installed")
+        self.model = SentenceTransformer(model)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model.replace('/', '_')}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        return _normalize(np.asarray(self.model.encode(texts, batch_size=32), dtype=np.float32))
+
+
+_embedder: Embedder | None = None
+
+
+def get_embedder() -> Embedder:
+    """ Returns the process-wide embedder configured by EMBEDDER """
+    global _embedder
+    if _embedder is None:
+        spec = os.getenv("EMBEDDER", "hashing")
+        if spec.startswith("sentence-transformers:"):
+            _embedder = SentenceTransformerEmbedder(spec.split(":", 1)[1])
+        else:
+            _embedder = HashingEmbedder(int(os.getenv("EMBEDDING_DIM", "1024")))
+    return _embedder
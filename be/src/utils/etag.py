@@ -0,0 +1,26 @@
+import hashlib
+import json
+
+
+def make_etag(*parts) -> str:
+    """ Builds a strong ETag from any JSON-serializable validator parts """
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """ Evaluates an If-None-Match header against the current ETag (weak comparison, RFC 9110) """
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [_strip_encoding(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def _strip_encoding(tag: str) -> str:
+    # CompressionMiddleware suffixes ETags of compressed representations with the encoding
+    for suffix in ('-br"', '-gzip"'):
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
@@ -0,0 +1,20 @@
+import os
+
+from src.utils.quota import quota_request_builder
+
+
+def client_options(api: str) -> dict | None:
+    """ Returns client options pointing the Google client at GOOGLE_API_ENDPOINT, if set """
+    endpoint = os.getenv("GOOGLE_API_ENDPOINT")
+    if not endpoint:
+        return None
+    endpoint = endpoint.rstrip("/")
+    if api == "calendar":
+        # Calendar paths are relative to its "calendar/v3/" service path
+        return {"api_endpoint": f"{endpoint}/calendar/v3/"}
+    return {"api_endpoint": f"{endpoint}/"}
+
+
+def build_options(api: str, user: str) -> dict:
+    """ Keyword arguments for googleapiclient's build(): endpoint override and the shared quota limiter """
+    return {"client_options": client_options(api), "requestBuilder": quota_request_builder(api, user)}
@@ -4,14 +4,18 @@ import os
 import time
 import sys
 
-from fastapi import Response, Request
+from fastapi import HTTPException, Response, Request
 from starlette.background import BackgroundTask
 from starlette.responses import StreamingResponse
 from fastapi.routing import APIRoute
 from typing import Callable
 
+from src.utils.capture import get_capture
+
 logger: logging.Logger = logging.getLogger('uvicorn.error')
 
+MAX_LOGGED_BODY = 1024
+
 _current_datetime = time.strftime("%Y%m%d")
 _parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _grandparent_dir = os.path.dirname(_parent_dir)
@@ -72,6 +76,19 @@ def setup_logger():
     logger.info("Logging initialized")
 
 
+def _loggable_body(body: bytes) -> bytes | str:
+    # Inbox responses carry full message bodies; only log the start of large payloads
+    if len(body) <= MAX_LOGGED_BODY:
+        return body
+    return f"{body[:MAX_LOGGED_BODY]!r}... ({len(body)} bytes)"
+
+
+def _capture_request(capture, request: Request, body: bytes, status: int, started: float):
+    query = {k: request.query_params.getlist(k) for k in request.query_params.keys()}
+    capture.record(request.method, request.url.path, query, body,
+                   status, started, time.time() - started, request.path_params)
+
+
 class LoggingRoute(APIRoute):
     def get_route_handler(self) -> Callable:
         original_route_handler = super().get_route_handler()
@@ -81,16 +98,25 @@ class LoggingRoute(APIRoute):
             req_body = await request.body()
             logger.info(f"{req_body} {request.url.path} {request.method}")
 
-            response = await original_route_handler(request)
+            capture = get_capture()
+            started = time.time()
+            try:
+                response = await original_route_handler(request)
+            except HTTPException as e:
+                if capture is not None:
+                    _capture_request(capture, request, req_body, e.status_code, started)
+                raise
+            if capture is not None:
+                _capture_request(capture, request, req_body, response.status_code, started)
             if isinstance(response, StreamingResponse):
                 logger.debug(
                     "StreamingResponse: Body not available for logging")
             elif response.background:
                 response.background.add_task(
-                    BackgroundTask(logger.debug, response.body))
+                    BackgroundTask(logger.debug, _loggable_body(response.body)))
             else:
                 response.background = BackgroundTask(
-                    logger.debug, response.body)
+                    logger.debug, _loggable_body(response.body))
             return response
 
         return custom_route_handler
@@ -0,0 +1,272 @@
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import TYPE_CHECKING
+
+from src.repo.state import get_state
+
+if TYPE_CHECKING:
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import HttpRequest
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Gmail quota units per method (https://developers.google.com/gmail/api/reference/quota).
+# Methods not listed cost DEFAULT_UNITS; every Calendar call counts as one request.
+GMAIL_QUOTA_UNITS = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.labels.list": 1,
+    "gmail.users.history.list": 2,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.modify": 5,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.messages.batchModify": 50,
+    "gmail.users.messages.send": 100,
+    "gmail.users.threads.list": 10,
+    "gmail.users.threads.get": 10,
+    "gmail.users.drafts.create": 10,
+    "gmail.users.drafts.send": 100,
+}
+DEFAULT_UNITS = 5
+
+# Units (Gmail) or requests (Calendar) per second; defaults are Google's published limits
+LIMITS = {
+    "gmail": (float(os.getenv("GMAIL_USER_UNITS_PER_SEC", "250")),
+              float(os.getenv("GMAIL_PROJECT_UNITS_PER_SEC", "20000"))),
+    "calendar": (float(os.getenv("CALENDAR_USER_REQUESTS_PER_SEC", "10")),
+                 float(os.getenv("CALENDAR_PROJECT_REQUESTS_PER_SEC", "160"))),
+}
+MAX_RETRIES = int(os.getenv("GOOGLE_MAX_RETRIES", "5"))
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 32
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# POSTs that are safe to repeat after a server error (a repeated send would send twice)
+# Reads (freebusy.query) and label changes can be retried safely
+IDEMPOTENT_POSTS = {"gmail.users.messages.modify", "gmail.users.messages.batchModify", "calendar.freebusy.query"}
+
+
+class TokenBucket:
+    """ Token bucket that lets callers reserve tokens ahead of time and tells them how long to wait """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """ Takes `amount` tokens, going into debt if needed; returns the seconds to wait before proceeding """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # A single call larger than the bucket must still be able to pass
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def drain(self):
+        """ Empties the bucket, e.g. after Google reported that the quota is exhausted """
+        with self._lock:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = time.monotonic()
+
+    def headroom(self) -> float:
+        """ The share of the bucket available right now, between 0 (callers are waiting) and 1 """
+        with self._lock:
+            tokens = min(self.capacity, self.tokens + (time.monotonic() - self.updated) * self.rate)
+            return max(tokens, 0.0) / self.capacity
+
+
+class SharedWindowBucket:
+    """
+    Rate limit shared by all workers through the state backend: one counter per one-second
+    window. A call that does not fit the current window reserves a slot in a later one.
+    """
+    MAX_WINDOWS_AHEAD = 60
+
+    def __init__(self, key: str, rate: float):
+        self.key = key
+        self.rate = max(1, int(rate))
+
+    def reserve(self, amount: float) -> float:
+        state = get_state()
+        amount = min(int(amount), self.rate)
+        now = time.time()
+        for offset in range(self.MAX_WINDOWS_AHEAD):
+            window = int(now) + offset
+            key = f"{self.key}:{window}"
+            if state.incr(key, amount, ttl=offset + 2) <= self.rate:
+                return max(0.0, window - now)
+            state.incr(key, -amount)
+        return float(self.MAX_WINDOWS_AHEAD)
+
+    def drain(self):
+        get_state().incr(f"{self.key}:{int(time.time())}", self.rate, ttl=2)
+
+    def headroom(self) -> float:
+        """ The share of the current window not reserved yet, between 0 and 1 """
+        used = get_state().incr(f"{self.key}:{int(time.time())}", 0, ttl=2)
+        return max(self.rate - used, 0) / self.rate
+
+
+class QuotaLimiter:
+    """
+    Client-side limiter shared by all Google API calls in the process.
+    Every call reserves its cost from a per-user and a per-project bucket of its API, waits
+    until both allow it, and is retried with exponential backoff and full jitter when Google
+    answers with a rate limit or a transient server error.
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, float]] = LIMITS, max_retries: int = MAX_RETRIES,
+                 max_users: int = 10_000):
+        self.limits = limits
+        self.max_retries = max_retries
+        self.max_users = max_users
+        self.projects: dict[str, TokenBucket | SharedWindowBucket] = {}
+        self.users: OrderedDict[tuple[str, str], TokenBucket | SharedWindowBucket] = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(lambda: defaultdict(float))
+
+    def cost(self, api: str, method_id: str | None) -> int:
+        if api != "gmail":
+            return 1
+        return GMAIL_QUOTA_UNITS.get(method_id, DEFAULT_UNITS)
+
+    @staticmethod
+    def _bucket(key: str, rate: float) -> TokenBucket | SharedWindowBucket:
+        # With several workers the buckets live in the shared state backend
+        return SharedWindowBucket(key, rate) if get_state().shared else TokenBucket(rate)
+
+    def _project_bucket(self, api: str) -> TokenBucket | SharedWindowBucket:
+        with self._lock:
+            bucket = self.projects.get(api)
+            if bucket is None:
+                bucket = self.projects[api] = self._bucket(f"quota:{api}", self.limits[api][1])
+            return bucket
+
+    def _user_bucket(self, api: str, user: str) -> TokenBucket | SharedWindowBucket:
+        with self._lock:
+            bucket = self.users.get((api, user))
+            if bucket is None:
+                bucket = self.users[(api, user)] = self._bucket(f"quota:{api}:{user}", self.limits[api][0])
+                while len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end((api, user))
+            return bucket
+
+    def _record(self, api: str, **values: float):
+        with self._lock:
+            for name, value in values.items():
+                self._metrics[api][name] += value
+
+    def acquire(self, api: str, user: str, units: int) -> float:
+        """ Blocks until `units` are available to the user and the project; returns the time waited """
+        user_bucket = self._user_bucket(api, user)
+        wait = max(user_bucket.reserve(units), self._project_bucket(api).reserve(units))
+        if wait > 0:
+            time.sleep(wait)
+        self._record(api, calls=1, units=units, throttled_seconds=wait, throttled_calls=1 if wait > 0 else 0)
+        return wait
+
+    def headroom(self, api: str, user: str) -> float:
+        """ The share of the user's and the project's quota available right now (the lower one), 0 to 1 """
+        return min(self._user_bucket(api, user).headroom(), self._project_bucket(api).headroom())
+
+    def execute(self, api: str, user: str, method_id: str | None, call, idempotent: bool = True):
+        """
+        Runs `call` (one API request) within the quota. Rate-limit rejections are always retried;
+        server errors only when the call is `idempotent`.
+        """
+        from googleapiclient.errors import HttpError
+
+        units = self.cost(api, method_id)
+        attempt = 0
+        while True:
+            self.acquire(api, user, units)
+            try:
+                return call()
+            except HttpError as e:
+                rate_limited = is_rate_limit_error(e)
+                retryable = rate_limited or (idempotent and e.resp.status in RETRYABLE_STATUSES)
+                if not retryable or attempt >= self.max_retries:
+                    if rate_limited:
+                        self._record(api, rate_limited=1)
+                    raise
+                if rate_limited:
+                    # Let other requests of this user wait too instead of piling onto the limit
+                    self._user_bucket(api, user).drain()
+                    self._record(api, rate_limited=1)
+                delay = _retry_after(e) or random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                logger.warning(f"{method_id} failed with {e.resp.status}, retrying in {delay:.2f}s")
+                self._record(api, retries=1, backoff_seconds=delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def metrics(self) -> dict[str, dict[str, float]]:
+        """ Per-API counters: calls, units, retries, rate_limited, throttled and backoff seconds """
+        with self._lock:
+            return {api: {name: round(value, 3) for name, value in values.items()}
+                    for api, values in self._metrics.items()}
+
+
+def _error_reasons(e: "HttpError") -> set[str]:
+    try:
+        error = json.loads(e.content.decode()).get("error", {})
+    except (ValueError, AttributeError):
+        return set()
+    return {item.get("reason") for item in error.get("errors", []) if isinstance(item, dict)}
+
+
+def is_rate_limit_error(e: "HttpError") -> bool:
+    """ Whether Google rejected the call for exceeding a rate limit (429, or 403 with a rate-limit reason) """
+    status = e.resp.status
+    return status == 429 or (status == 403 and bool(_error_reasons(e) & RATE_LIMIT_REASONS))
+
+
+def _retry_after(e: "HttpError") -> float | None:
+    value = e.resp.get("retry-after") if hasattr(e.resp, "get") else None
+    try:
+        return min(float(value), BACKOFF_CAP) if value else None
+    except ValueError:
+        return None
+
+
+limiter = QuotaLimiter()
+
+
+@functools.cache
+def _quota_request_class() -> type["HttpRequest"]:
+    # Defined on first use, so that importing this module does not load the Google API client
+    from googleapiclient.http import HttpRequest
+
+    class QuotaHttpRequest(HttpRequest):
+        """ HttpRequest whose execute() goes through the shared QuotaLimiter """
+        api = "gmail"
+        user = ""
+
+        def execute(self, http=None, num_retries=0):
+            idempotent = self.method != "POST" or self.methodId in IDEMPOTENT_POSTS
+            return limiter.execute(self.api, self.user, self.methodId,
+                                   lambda: HttpRequest.execute(self, http=http, num_retries=0),
+                                   idempotent=idempotent)
+
+    return QuotaHttpRequest
+
+
+def quota_request_builder(api: str, user: str):
+    """ Returns a googleapiclient `requestBuilder` that attributes the service's calls to `user` """
+    def build_request(*args, **kwargs) -> "HttpRequest":
+        request = _quota_request_class()(*args, **kwargs)
+        request.api = api
+        request.user = user
+        return request
+    return build_request
@@ -0,0 +1,111 @@
+"""
+EmailRecord, the one representation of an email from the Gmail service layer to the tools.
+
+Records are slotted: a listing of 10k messages takes less memory than per-message dicts,
+copies cost no more than a dict copy, and the date is parsed once when the message is read.
+They are never modified once built (`with_priority` returns a copy), so cached listings are
+shared between requests as they are. Code written against the wire dicts keeps
+working: a record is also a read-only mapping with the wire keys ("from", "threadId", ...),
+whose values are the Python ones (the date is a datetime). `to_wire()` gives the JSON form.
+"""
+import dataclasses
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterator
+
+# Wire key -> attribute, in the order the API has always returned them
+_WIRE_FIELDS = {
+    "from": "sender",
+    "subject": "subject",
+    "snippet": "snippet",
+    "raw": "raw",
+    "threadId": "thread_id",
+    "id": "id",
+    "labelIds": "label_ids",
+    "date": "date",
+    "attachments": "attachments",
+    "priority": "priority",
+    "priorityScore": "priority_score",
+}
+# Only present once the priority model has scored the email
+_OPTIONAL = ("priority", "priorityScore")
+
+
+# Not frozen: frozen dataclasses are several times slower to build, which shows on listings
+@dataclass(slots=True)
+class EmailRecord(Mapping):
+    id: str
+    thread_id: str | None
+    sender: str
+    subject: str
+    snippet: str | None
+    raw: str | None
+    date: datetime
+    label_ids: tuple[str, ...] = ()
+    attachments: tuple[dict, ...] = ()
+    priority: str | None = None
+    priority_score: float | None = None
+
+    def __getitem__(self, key: str) -> Any:
+        attr = _WIRE_FIELDS.get(key)
+        if attr is None or (key in _OPTIONAL and getattr(self, attr) is None):
+            raise KeyError(key)
+        return getattr(self, attr)
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, attr in _WIRE_FIELDS.items()
+                if key not in _OPTIONAL or getattr(self, attr) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def with_priority(self, priority: str, score: float) -> "EmailRecord":
+        return EmailRecord(self.id, self.thread_id, self.sender, self.subject, self.snippet, self.raw,
+                           self.date, self.label_ids, self.attachments, priority, score)
+
+    def _wire(self) -> dict:
+        # orjson writes the datetime (in ISO format) and the tuples itself
+        wire = {
+            "from": self.sender, "subject": self.subject, "snippet": self.snippet, "raw": self.raw,
+            "threadId": self.thread_id, "id": self.id, "labelIds": self.label_ids,
+            "date": self.date, "attachments": self.attachments,
+        }
+        if self.priority is not None:
+            wire["priority"] = self.priority
+        if self.priority_score is not None:
+            wire["priorityScore"] = self.priority_score
+        return wire
+
+    def to_wire(self) -> dict:
+        """ The JSON object the API returns for this email """
+        wire = self._wire()
+        wire["date"] = self.date.isoformat()
+        wire["labelIds"] = list(self.label_ids)
+        wire["attachments"] = list(self.attachments)
+        return wire
+
+    @classmethod
+    def from_wire(cls, data: Mapping) -> "EmailRecord":
+        date = data["date"]
+        return cls(
+            id=data["id"], thread_id=data.get("threadId"), sender=data["from"], subject=data["subject"],
+            snippet=data.get("snippet"), raw=data.get("raw"),
+            date=date if isinstance(date, datetime) else datetime.fromisoformat(date),
+            label_ids=tuple(data.get("labelIds") or ()), attachments=tuple(data.get("attachments") or ()),
+            priority=data.get("priority"), priority_score=data.get("priorityScore"),
+        )
+
+
+def as_record(email: Mapping) -> EmailRecord:
+    """ The email as a record (values read back from the shared state backend are wire dicts) """
+    return email if isinstance(email, EmailRecord) else EmailRecord.from_wire(email)
+
+
+def json_default(obj: Any) -> Any:
+    """ orjson `default` for OPT_PASSTHROUGH_DATACLASS: records in their wire form, other dataclasses as dicts """
+    if isinstance(obj, EmailRecord):
+        return obj._wire()
+    if dataclasses.is_dataclass(obj):
+        return dataclasses.asdict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
@@ -0,0 +1,19 @@
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from src.utils.records import json_default
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson instead of the standard library encoder.
+    Accepts plain data (dicts, lists, datetimes, dataclasses, email records) as well as pydantic models.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.model_dump(mode="python", by_alias=True)
+        return orjson.dumps(content, default=json_default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS)
@@ -0,0 +1,81 @@
+"""
+Startup and shutdown state of this process, for the health endpoints and the graceful
+shutdown in main.lifespan.
+
+Heavy libraries (the Google API client, LangChain and Gemini, BeautifulSoup, the OAuth flow)
+are imported on first use so the server accepts requests quickly. With WARMUP=1 (the
+default) they are imported in a background thread right after startup instead, so that the
+first request of each feature does not pay for the import either. NumPy is imported eagerly:
+the priority model scores every inbox listing with it, so the first request would wait for it.
+"""
+import importlib
+import logging
+import os
+import time
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+WARMUP = os.getenv("WARMUP", "1") == "1"
+HEAVY_MODULES = (
+    "googleapiclient.discovery",
+    "google.oauth2.credentials",
+    "bs4",
+    "langchain_google_genai",
+    "langchain.prompts",
+    "langchain.tools",
+    "langchain_core.messages",
+    "google_auth_oauthlib.flow",
+)
+
+_loaded_at = time.monotonic()
+
+
+class Startup:
+
+    def __init__(self):
+        self.ready = False
+        self.ready_after: float | None = None
+        self.warmup_done = False
+        self.warmup_ms: dict[str, float] = {}
+        self.warmup_errors: dict[str, str] = {}
+        self.stopping = False
+        self.restored_entries = 0
+
+    def mark_ready(self):
+        self.ready = True
+        self.ready_after = time.monotonic() - _loaded_at
+
+    def mark_stopping(self):
+        """
+        Fails readiness checks so load balancers stop routing new requests here, and ends
+        long-lived streams so their clients reconnect elsewhere. Only sets flags, so it is
+        safe to call from a signal handler
+        """
+        self.ready = False
+        self.stopping = True
+
+    def warm_up(self, modules: tuple[str, ...] = HEAVY_MODULES):
+        """ Imports the modules features load on first use (blocking; run it in a thread) """
+        for name in modules:
+            started = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                self.warmup_errors[name] = str(e)
+                continue
+            self.warmup_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+        self.warmup_done = True
+        logger.info(f"Warm-up imported {len(self.warmup_ms)} modules in {sum(self.warmup_ms.values()):.0f}ms")
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "stopping": self.stopping,
+            "restoredCacheEntries": self.restored_entries,
+            "readyAfterSeconds": None if self.ready_after is None else round(self.ready_after, 3),
+            "warmup": {"enabled": WARMUP, "done": self.warmup_done, "importMs": self.warmup_ms,
+                       "errors": self.warmup_errors},
+        }
+
+
+startup = Startup()
@@ -0,0 +1,81 @@
+import base64
+import os
+import uuid
+
+import pytest
+
+from src.services import attachments
+from src.services.attachments import iter_file, open_attachment, parse_range
+
+DATA = bytes(range(256)) * 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("bytes=999-999", (999, 999)),
+    (" Bytes = 5-9", (5, 9)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-9", "bytes=0-9,20-29", "bytes=-", "bytes=a-b", "bytes=10-5", "bytes=5",
+])
+def test_parse_range_ignores_unusable_headers(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000), ("bytes=1000-2000", 1000), ("bytes=-0", 1000), ("bytes=0-", 0), ("bytes=-10", 0),
+])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """ The attachment cache in a temporary directory, downloading DATA; returns the download count """
+    monkeypatch.setattr(attachments, "ATTACHMENT_CACHE_DIR", str(tmp_path))
+    downloads = []
+
+    def download(token, message_id, part_id):
+        downloads.append(part_id)
+        digest, size = attachments._store(base64.urlsafe_b64encode(DATA).decode().rstrip("="))
+        return {"sha256": digest, "size": size, "filename": "a.bin", "mimeType": "application/octet-stream"}
+
+    monkeypatch.setattr(attachments, "_download", download)
+    return downloads
+
+
+def test_cached_file_is_served_in_ranges(cache):
+    token = uuid.uuid4().hex
+    meta, f = open_attachment(token, "m1", "1")
+    assert meta["size"] == len(DATA)
+    assert b"".join(iter_file(f, 10, 70009)) == DATA[10:70010]
+    assert f.closed
+    _, f = open_attachment(token, "m1", "1")
+    f.close()
+    assert len(cache) == 1
+
+
+def test_file_evicted_before_it_is_opened_is_downloaded_again(cache, monkeypatch):
+    token = uuid.uuid4().hex
+    get_attachment = attachments.get_attachment
+
+    def evicted_meanwhile(*args):
+        meta = get_attachment(*args)
+        if len(cache) == 1 and os.path.exists(meta["path"]):
+            os.remove(meta["path"])
+        return meta
+
+    monkeypatch.setattr(attachments, "get_attachment", evicted_meanwhile)
+    meta, f = open_attachment(token, "m1", "1")
+    with f:
+        assert f.read() == DATA
+    assert len(cache) == 2
@@ -0,0 +1,31 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from starlette.middleware.sessions import SessionMiddleware
+
+from src.controllers import auth
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+    app.include_router(auth.router)
+
+    @app.get("/test/state")
+    def set_state(request: Request, state: str):
+        # Stands in for /auth/login, which needs the Google client secrets
+        request.session["state"] = state
+
+    app.add_middleware(SessionMiddleware, secret_key="test")
+    return TestClient(app, follow_redirects=False)
+
+
+def test_callback_without_a_login_is_rejected(client):
+    assert client.get("/auth/callback", params={"state": "abc", "code": "c"}).status_code == 400
+
+
+def test_callback_with_another_browsers_state_is_rejected(client):
+    client.get("/test/state", params={"state": "mine"})
+    assert client.get("/auth/callback", params={"state": "theirs", "code": "c"}).status_code == 400
+    # The state is single use
+    assert client.get("/auth/callback", params={"state": "mine", "code": "c"}).status_code == 400
@@ -0,0 +1,72 @@
+import json
+import types
+import typing
+
+import pytest
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from src.controllers import assistant, auth, calendar, email, health, metrics
+from src.utils.capture import SAFE_FIELDS, redact_path, sanitize
+
+SECRET = "secret"
+ROUTES = [route for module in (assistant, auth, calendar, email, health, metrics)
+          for route in module.router.routes if isinstance(route, APIRoute)]
+
+
+def _sample(annotation):
+    """ A value of the annotated type in which every string is SECRET """
+    origin = typing.get_origin(annotation)
+    args = [a for a in typing.get_args(annotation) if a is not type(None)]
+    if origin in (typing.Union, types.UnionType):
+        return _sample(args[0])
+    if origin is typing.Literal:
+        return SECRET
+    if origin is list:
+        return [_sample(args[0] if args else str)]
+    if origin is dict or annotation is dict:
+        return {"field": _sample(args[1] if args else str)}
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return {name: _sample(field.annotation) for name, field in annotation.model_fields.items()}
+    if annotation is str:
+        return SECRET
+    return 1
+
+
+def _body_fields() -> list[tuple[str, str, object]]:
+    fields = []
+    for route in ROUTES:
+        for param in route.dependant.body_params:
+            model = param.field_info.annotation
+            for name, field in model.model_fields.items():
+                fields.append((model.__name__, name, field.annotation))
+    return fields
+
+
+def _query_fields() -> list[tuple[str, str, object]]:
+    return [(route.path, param.name, param.field_info.annotation)
+            for route in ROUTES for param in route.dependant.query_params]
+
+
+@pytest.mark.parametrize("owner, name, annotation", _body_fields() + _query_fields())
+def test_only_safe_fields_keep_their_strings(owner, name, annotation):
+    redacted = json.dumps(sanitize({name: _sample(annotation)}))
+    if name in SAFE_FIELDS:
+        return
+    assert SECRET not in redacted, f"{owner}.{name} is captured in clear"
+
+
+def test_safe_fields_exist():
+    names = {name for _, name, _ in _body_fields() + _query_fields()}
+    assert SAFE_FIELDS <= names, f"stale SAFE_FIELDS: {SAFE_FIELDS - names}"
+
+
+def test_nested_strings_are_redacted_with_their_length():
+    data = {"emails": [{"raw": "hello", "from": "bob@example.com", "size": 5}], "count": 2, "tone": "Friendly"}
+    assert sanitize(data) == {"emails": [{"raw": "xxxxx", "from": "x" * 15, "size": 5}],
+                              "count": 2, "tone": "Friendly"}
+
+
+def test_path_parameters_are_redacted():
+    path = redact_path("/email/18c2f/attachments/1.2", {"id": "18c2f", "part_id": "1.2"})
+    assert path == "/email/xxxxx/attachments/xxx"
@@ -0,0 +1,51 @@
+from src.utils.dedup import NUM_PERM, collapse_near_duplicates, duplicates_note, minhash_signatures, near_duplicate_groups
+
+NOTIFICATION = ("Your package is on its way. Track your shipment at {url} and expect delivery "
+                "within three business days. Thank you for shopping with us.")
+
+
+def test_signatures_are_deterministic():
+    signatures = minhash_signatures(["hello there world", "hello there world", "something else entirely"])
+    assert signatures.shape == (3, NUM_PERM)
+    assert (signatures[0] == signatures[1]).all()
+    assert not (signatures[0] == signatures[2]).all()
+
+
+def test_copies_differing_in_links_are_grouped():
+    texts = [NOTIFICATION.format(url="https://t.example/a?id=1"), "Lunch on Friday? Let me know.",
+             NOTIFICATION.format(url="https://t.example/b?id=2"), NOTIFICATION.format(url="http://x.example/c")]
+    assert near_duplicate_groups(texts) == [[0, 2, 3], [1]]
+
+
+def test_numbers_tell_texts_apart():
+    texts = ["Invoice 1001 for March is attached", "Invoice 2002 for March is attached"]
+    assert near_duplicate_groups(texts) == [[0], [1]]
+
+
+def test_threshold():
+    a = "one two three four five six seven eight nine ten"
+    b = "one two three four five six seven eight nine eleven"
+    assert near_duplicate_groups([a, b]) == [[0, 1]]
+    assert near_duplicate_groups([a, b], threshold=1.0) == [[0], [1]]
+
+
+def test_few_and_empty_texts():
+    assert near_duplicate_groups([]) == []
+    assert near_duplicate_groups(["only"]) == [[0]]
+    # Texts too short for a shingle are compared whole
+    assert near_duplicate_groups(["", "hi", "", "hi", "bye"]) == [[0, 2], [1, 3], [4]]
+
+
+def test_collapse_keeps_the_first_of_each_group():
+    items = [{"id": "a", "subject": "Shipped", "date": "d1", "from": "shop"},
+             {"id": "b", "subject": "Lunch", "date": "d2", "sender": "bob"},
+             {"id": "c", "subject": "Shipped", "date": "d3", "from": "shop"}]
+    texts = [NOTIFICATION.format(url="https://t.example/1"), "Lunch on Friday?",
+             NOTIFICATION.format(url="https://t.example/2")]
+    collapsed = collapse_near_duplicates(items, texts)
+    assert [c["id"] for c in collapsed] == ["a", "b"]
+    assert collapsed[0]["duplicates"] == 1
+    assert collapsed[0]["duplicateEmails"] == [{"id": "c", "subject": "Shipped", "date": "d3", "sender": "shop"}]
+    assert collapsed[1]["duplicates"] == 0
+    assert "duplicates" not in items[0]
+    assert duplicates_note(collapsed[0]) == "1 similar emails: Shipped (d3, from shop, id c)"
@@ -0,0 +1,62 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from src.services import drafts
+from src.services.drafts import get_drafts, note_thread_message, prepare_drafts
+
+NOW = datetime.now(timezone.utc).isoformat()
+
+
+def _email(id: str, labels=(), subject="Hello", sender="news@example.com", thread=None) -> dict:
+    return {"id": id, "threadId": thread or f"t{id}", "from": sender, "subject": subject,
+            "labelIds": list(labels), "date": NOW, "raw": "Hi", "snippet": "Hi"}
+
+
+@pytest.fixture
+def written(monkeypatch) -> list[str]:
+    written = []
+
+    def generate_draft(user, email, tone, instructions, sign_off, take_budget=None):
+        written.append(email["id"])
+        return f"Reply to {email['id']}"
+
+    monkeypatch.setattr(drafts, "generate_draft", generate_draft)
+    return written
+
+
+@pytest.fixture
+def user() -> str:
+    return uuid.uuid4().hex
+
+
+def test_drafts_follow_the_important_label(user, written):
+    emails = [_email("1", ["INBOX"]), _email("2", ["INBOX", "IMPORTANT"]), _email("3", ["CATEGORY_PROMOTIONS"])]
+    assert prepare_drafts(user, emails) == 1
+    assert written == ["2"]
+    assert get_drafts(user, "2")[0]["text"] == "Reply to 2"
+    assert get_drafts(user, "1") == []
+    # Already drafted
+    assert prepare_drafts(user, emails) == 0
+
+
+def test_high_priority_without_the_label_gets_a_draft(user, written, monkeypatch):
+    monkeypatch.setattr(drafts, "prioritize", lambda user, emails: [
+        dict(e, priority="High" if e["id"] == "1" else "Low", priorityScore=0.9 if e["id"] == "1" else 0.1)
+        for e in emails])
+    assert prepare_drafts(user, [_email("1"), _email("2")]) == 1
+    assert written == ["1"]
+
+
+def test_at_most_top_k(user, written, monkeypatch):
+    monkeypatch.setattr(drafts, "DRAFT_TOP_K", 2)
+    emails = [_email(str(i), ["IMPORTANT"]) for i in range(5)]
+    assert prepare_drafts(user, emails) == 2
+
+
+def test_a_new_message_in_the_thread_drops_the_draft(user, written):
+    prepare_drafts(user, [_email("1", ["IMPORTANT"], thread="t")])
+    assert get_drafts(user, "1")
+    note_thread_message(user, "t", "2")
+    assert get_drafts(user, "1") == []
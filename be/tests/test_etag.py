@@ -0,0 +1,62 @@
+import pytest
+from fastapi import FastAPI, Header, Response
+from fastapi.testclient import TestClient
+
+from src.middleware.compression import CompressionMiddleware
+from src.utils.etag import etag_matches, make_etag
+
+ETAG = make_etag("history", 42)
+
+
+def test_make_etag():
+    assert ETAG.startswith('"') and ETAG.endswith('"')
+    assert make_etag("history", 42) == ETAG
+    assert make_etag("history", 43) != ETAG
+    # Key order does not matter
+    assert make_etag({"a": 1, "b": 2}) == make_etag({"b": 2, "a": 1})
+
+
+@pytest.mark.parametrize("header", [
+    ETAG, f"W/{ETAG}", f'"other", {ETAG}', "*", f" {ETAG} ",
+    ETAG[:-1] + '-gzip"', ETAG[:-1] + '-br"', f'W/{ETAG[:-1]}-br"',
+])
+def test_matches(header):
+    assert etag_matches(header, ETAG)
+
+
+@pytest.mark.parametrize("header", [None, "", '"other"', ETAG[:-1] + '-deflate"', ETAG[:-2] + '"'])
+def test_does_not_match(header):
+    assert not etag_matches(header, ETAG)
+
+
+def test_weak_etag_matches_strong_header():
+    assert etag_matches(ETAG, f"W/{ETAG}")
+
+
+@pytest.fixture
+def client() -> TestClient:
+    app = FastAPI()
+
+    @app.get("/data")
+    def data(if_none_match: str | None = Header(default=None)):
+        if etag_matches(if_none_match, ETAG):
+            return Response(status_code=304, headers={"ETag": ETAG})
+        return Response(b'{"x": "' + b"a" * 5000 + b'"}', media_type="application/json", headers={"ETag": ETAG})
+
+    app.add_middleware(CompressionMiddleware)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_compressed_etag_revalidates(client, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    response = client.get("/data", headers={"Accept-Encoding": encoding})
+    assert response.headers["Content-Encoding"] == encoding
+    assert response.headers["ETag"] == ETAG[:-1] + f'-{encoding}"'
+    again = client.get("/data", headers={"Accept-Encoding": encoding, "If-None-Match": response.headers["ETag"]})
+    assert again.status_code == 304
+    # Uncompressed, the ETag is the app's own
+    plain = client.get("/data", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] == ETAG
@@ -0,0 +1,131 @@
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from src.repo.outbox import FAILED, QUEUED, SENDING, SENT, Outbox
+from src.services import outbox as outbox_service
+from src.services.outbox import OutboxWorkers
+
+PAYLOAD = {"to": "bob@example.com", "subject": "Hi", "body": "Hello", "id": None, "threadId": None}
+
+
+class FakeGmail:
+    """ Sent mail by Message-ID; `rate_limited` sends are rejected with a 429 before they reach the mailbox """
+
+    def __init__(self):
+        self.sent: dict[str, dict] = {}
+        self.sends = 0
+        self.rate_limited = 0
+
+    def send_email(self, token, to, subject, body, id=None, thread_id=None, in_reply_to=None,
+                   references=None, message_id=None):
+        self.sends += 1
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise HttpError(httplib2.Response({"status": 429}), b"", uri="send")
+        result = {"id": f"m{len(self.sent)}", "threadId": f"t{len(self.sent)}"}
+        self.sent[message_id] = result
+        return result
+
+    def find_sent(self, token, message_id):
+        return self.sent.get(message_id)
+
+
+@pytest.fixture
+def outbox(tmp_path) -> Outbox:
+    return Outbox(str(tmp_path / "outbox.db"))
+
+
+@pytest.fixture
+def gmail(monkeypatch) -> FakeGmail:
+    gmail = FakeGmail()
+    monkeypatch.setattr(outbox_service, "send_email", gmail.send_email)
+    monkeypatch.setattr(outbox_service, "find_sent", gmail.find_sent)
+    monkeypatch.setattr(outbox_service, "add_correspondents", lambda user, addresses: None)
+    monkeypatch.setattr(outbox_service, "note_thread_message", lambda user, thread_id, message_id: None)
+    return gmail
+
+
+def test_repeated_idempotency_key_returns_the_same_job(outbox):
+    job, queued = outbox.enqueue("user", PAYLOAD, "key")
+    assert queued
+    again, queued = outbox.enqueue("user", {**PAYLOAD, "body": "Changed"}, "key")
+    assert not queued
+    assert again["id"] == job["id"]
+    assert again["payload"] == PAYLOAD
+    # Keys are per user
+    other, queued = outbox.enqueue("other", PAYLOAD, "key")
+    assert queued and other["id"] != job["id"]
+
+
+def test_repeated_idempotency_key_requeues_a_failed_job(outbox):
+    job, _ = outbox.enqueue("user", PAYLOAD, "key")
+    claimed = outbox.claim(60)
+    outbox.fail(claimed["id"], "bad address")
+    again, queued = outbox.enqueue("user", {**PAYLOAD, "to": "carol@example.com"}, "key")
+    assert queued
+    assert again["id"] == job["id"]
+    assert again["status"] == QUEUED
+    assert again["attempts"] == 0
+    assert again["error"] is None
+    assert again["payload"]["to"] == "carol@example.com"
+
+
+def test_claim_takes_over_an_expired_lease(outbox):
+    outbox.enqueue("user", PAYLOAD)
+    job = outbox.claim(60)
+    assert job["status"] == SENDING and job["attempts"] == 1
+    assert outbox.claim(60) is None
+    outbox._connect().execute("UPDATE outbox SET locked_until = 0")
+    job = outbox.claim(60)
+    assert job["attempts"] == 2
+
+
+def test_takeover_after_a_rate_limited_attempt_does_not_send_twice(outbox, gmail):
+    workers = OutboxWorkers()
+    job, _ = outbox.enqueue("user", PAYLOAD)
+    gmail.rate_limited = 1
+    workers._process(outbox, outbox.claim(60))
+    job = outbox.get(job["id"])
+    assert job["status"] == QUEUED and job["error"].startswith("rate limited")
+    # The second attempt sends, but its worker dies before recording it
+    outbox._connect().execute("UPDATE outbox SET next_attempt_at = 0")
+    outbox_service.deliver(outbox.claim(60))
+    # Another worker takes the job over once the lease runs out
+    outbox._connect().execute("UPDATE outbox SET locked_until = 0")
+    workers._process(outbox, outbox.claim(60))
+    assert gmail.sends == 2
+    assert len(gmail.sent) == 1
+    job = outbox.get(job["id"])
+    assert job["status"] == SENT
+    assert job["result"] == next(iter(gmail.sent.values()))
+
+
+def test_retry_after_complete_fails_does_not_send_twice(outbox, gmail):
+    workers = OutboxWorkers()
+    job, _ = outbox.enqueue("user", PAYLOAD)
+
+    def broken_complete(job_id, result):
+        raise OSError("disk I/O error")
+
+    outbox.complete = broken_complete
+    with pytest.raises(OSError):
+        workers._process(outbox, outbox.claim(60))
+    del outbox.complete
+    outbox._connect().execute("UPDATE outbox SET locked_until = 0")
+    workers._process(outbox, outbox.claim(60))
+    assert gmail.sends == 1
+    assert outbox.get(job["id"])["status"] == SENT
+
+
+def test_gives_up_after_max_attempts(outbox, gmail):
+    workers = OutboxWorkers(max_attempts=2)
+    job, _ = outbox.enqueue("user", PAYLOAD)
+    gmail.rate_limited = 2
+    workers._process(outbox, outbox.claim(60))
+    outbox._connect().execute("UPDATE outbox SET next_attempt_at = 0")
+    workers._process(outbox, outbox.claim(60))
+    job = outbox.get(job["id"])
+    assert job["status"] == FAILED
+    assert job["error"].startswith("rate limited")
+    assert not gmail.sent
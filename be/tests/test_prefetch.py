@@ -0,0 +1,44 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+from src.services import prefetch
+from src.services.prefetch import QUOTA_BUSY_DELAY, PrefetchScheduler
+from src.utils.quota import QuotaLimiter
+
+
+@pytest.fixture
+def warmed(monkeypatch) -> list[str]:
+    warmed = []
+    monkeypatch.setattr(prefetch, "warm_user", warmed.append)
+    monkeypatch.setattr(prefetch, "limiter", QuotaLimiter(limits={"gmail": (100, 10_000), "calendar": (10, 1000)}))
+    return warmed
+
+
+def _warm(scheduler: PrefetchScheduler, token: str):
+    asyncio.run(scheduler._warm(token, asyncio.Semaphore(1)))
+
+
+def test_idle_user_is_warmed(warmed):
+    scheduler = PrefetchScheduler(interval=100, jitter=0)
+    token = uuid.uuid4().hex
+    _warm(scheduler, token)
+    assert warmed == [token]
+    assert scheduler.next_due[token] == pytest.approx(time.monotonic() + 100, abs=1)
+
+
+@pytest.mark.parametrize("api, units", [("gmail", 80), ("calendar", 6)])
+def test_warm_up_waits_while_the_user_uses_the_quota(warmed, api, units):
+    scheduler = PrefetchScheduler(interval=100, jitter=0)
+    token = uuid.uuid4().hex
+    prefetch.limiter.acquire(api, token, units)
+    _warm(scheduler, token)
+    assert warmed == []
+    assert scheduler.next_due[token] == pytest.approx(time.monotonic() + QUOTA_BUSY_DELAY, abs=1)
+    assert token not in scheduler.inflight
+    # Other users are not held back
+    other = uuid.uuid4().hex
+    _warm(scheduler, other)
+    assert warmed == [other]
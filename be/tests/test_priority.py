@@ -0,0 +1,98 @@
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from src.services import priority
+from src.services.priority import (FEATURES, PRIORITY_THRESHOLD, add_correspondents, feature_matrix,
+                                   get_correspondents, priority_scores, prioritize, top_k)
+from src.utils.records import as_record
+
+NOW = datetime(2026, 3, 2, 12, tzinfo=timezone.utc).timestamp()
+
+
+def _email(id, sender="alice@example.com", subject="Hello", labels=(), date="2026-03-02T12:00:00+00:00",
+           thread=None):
+    return {"id": id, "threadId": thread or id, "from": sender, "subject": subject,
+            "labelIds": list(labels), "date": date, "raw": "", "snippet": ""}
+
+
+@pytest.fixture
+def token() -> str:
+    return uuid.uuid4().hex
+
+
+def _column(x: np.ndarray, name: str) -> list:
+    return x[:, FEATURES.index(name)].tolist()
+
+
+def test_features():
+    emails = [
+        _email("1", "Bob <BOB@example.com>", "Urgent: contract", ["IMPORTANT", "STARRED"]),
+        _email("2", "news@shop.example", labels=["CATEGORY_PROMOTIONS"], date="2026-03-01T12:00:00+00:00"),
+        _email("3", "news@shop.example", thread="2", date="not a date"),
+    ]
+    x = feature_matrix(emails, {"bob@example.com"}, now=NOW)
+    assert x.shape == (3, len(FEATURES))
+    assert _column(x, "replied") == [1, 0, 0]
+    assert _column(x, "important") == [1, 0, 0]
+    assert _column(x, "starred") == [1, 0, 0]
+    assert _column(x, "keywords") == [1, 0, 0]
+    # One half-life old; an unreadable date counts as new
+    assert _column(x, "recency")[:2] == [1, 0.5]
+    assert _column(x, "thread_length") == [0, 0.25, 0.25]
+    assert _column(x, "sender_frequency")[0] == 0 and _column(x, "sender_frequency")[1] > 0
+    assert _column(x, "bulk") == [0, 1, 1]
+    assert ((x >= 0) & (x <= 1)).all()
+
+
+def test_no_emails():
+    assert priority_scores([], set()).shape == (0,)
+    assert top_k([], 3) == []
+
+
+def test_threshold(token, monkeypatch):
+    emails = [_email("1", "boss@example.com", "Deadline today", ["IMPORTANT"]),
+              _email("2", "noreply@example.com", "Weekly digest", ["CATEGORY_UPDATES"])]
+    scores = priority_scores(emails, set(), now=NOW)
+    assert scores[0] >= PRIORITY_THRESHOLD > scores[1]
+    result = prioritize(token, emails)
+    assert [e["priority"] for e in result] == ["High", "Low"]
+    assert result[0]["priorityScore"] == round(float(priority_scores(emails, set())[0]), 3)
+    # Copies: the input is not changed
+    assert "priority" not in emails[0]
+    # The threshold itself is High
+    monkeypatch.setattr(priority, "PRIORITY_THRESHOLD", result[1]["priorityScore"])
+    assert [e["priority"] for e in prioritize(token, emails)] == ["High", "High"]
+
+
+def test_records_keep_their_type(token):
+    result = prioritize(token, [as_record(_email("1"))])
+    assert result[0].priority in ("High", "Low")
+    assert result[0]["priorityScore"] == result[0].priority_score
+
+
+def test_correspondents_rank_higher(token):
+    emails = [_email("1", "carol@example.com"), _email("2", "dave@example.com")]
+    before = [e["priorityScore"] for e in prioritize(token, emails)]
+    assert before[0] == before[1]
+    add_correspondents(token, ["Carol <Carol@Example.com>, eve@example.com", ""])
+    assert get_correspondents(token) == {"carol@example.com", "eve@example.com"}
+    after = [e["priorityScore"] for e in prioritize(token, emails)]
+    assert after[0] > after[1] == before[1]
+
+
+def test_add_correspondents_keeps_refresh_time(token):
+    add_correspondents(token, ["a@example.com"], refreshed_at=123.0)
+    add_correspondents(token, ["b@example.com"])
+    assert priority._correspondents.get((token,)) == {"addresses": ["a@example.com", "b@example.com"],
+                                                      "refreshedAt": 123.0}
+
+
+def test_top_k_is_stable():
+    emails = [{"id": str(i), "priorityScore": score} for i, score in enumerate([0.2, 0.9, 0.5, 0.9, 0.1])]
+    assert [e["id"] for e in top_k(emails, 3)] == ["1", "3", "2"]
+    assert len(top_k(emails, 10)) == 5
+    assert top_k(emails, 0) == []
+
@@ -0,0 +1,80 @@
+from tools.prompt_budget import EMAIL_OVERHEAD_TOKENS, FieldBudget, estimate_tokens, fit_emails, truncate
+
+
+def _words(n: int, word: str = "word") -> str:
+    return " ".join(f"{word}{i}" for i in range(n))
+
+
+def _email(id: str, body_words: int) -> dict:
+    return {"id": id, "subject": "Subject", "from": "Bob", "raw": _words(body_words)}
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Hello, world!") == 4
+    assert estimate_tokens("  a\tb\n") == 2
+
+
+def test_truncate():
+    text = _words(10)
+    assert truncate(text, 10) == text
+    assert truncate(text, 3) == "word0 word1 word2 […]"
+    assert truncate(text, 2, 2) == "word0 word1 […] word8 word9"
+    assert truncate(text, 0, 1) == "[…] word9"
+    assert truncate("", 5) == ""
+    assert truncate("   ", 0) == "   "
+
+
+def test_fields_are_truncated():
+    email = {"id": "1", "subject": _words(50), "from": _words(30), "raw": _words(1000), "other": "kept"}
+    result = fit_emails([email], budget=10_000)
+    fitted = result.emails[0]
+    assert fitted["subject"] == truncate(email["subject"], FieldBudget.subject)
+    assert fitted["from"] == truncate(email["from"], FieldBudget.sender)
+    assert fitted["raw"] == truncate(email["raw"], FieldBudget.body_head, FieldBudget.body_tail)
+    assert fitted["other"] == "kept"
+    assert email["raw"] == _words(1000)
+    assert result.truncated == 1 and result.dropped == 0
+
+
+def test_within_budget_nothing_changes():
+    emails = [_email("1", 10), _email("2", 10)]
+    result = fit_emails(emails, budget=1000)
+    assert result.emails == emails
+    assert result.tokens == 2 * (1 + 1 + 10 + EMAIL_OVERHEAD_TOKENS)
+    assert (result.truncated, result.dropped) == (0, 0)
+
+
+def test_over_budget_shortens_the_last_emails_first():
+    emails = [_email("1", 200), _email("2", 200), _email("3", 200)]
+    fields = FieldBudget(body_min=20)
+    full = 1 + 1 + 200 + EMAIL_OVERHEAD_TOKENS
+    short = 1 + 1 + estimate_tokens(truncate(_words(200), 20)) + EMAIL_OVERHEAD_TOKENS
+    result = fit_emails(emails, budget=2 * full + short, fields=fields)
+    assert [len(e["raw"]) for e in result.emails[:2]] == [len(_words(200))] * 2
+    assert result.emails[2]["raw"] == truncate(_words(200), 20)
+    assert result.tokens == 2 * full + short
+    assert (result.truncated, result.dropped) == (1, 0)
+
+
+def test_then_drops_the_least_important():
+    emails = [_email("1", 200), _email("2", 200), _email("3", 200)]
+    fields = FieldBudget(body_min=20)
+    result = fit_emails(emails, budget=100, fields=fields, scores=[0.1, 0.9, 0.5])
+    assert [e["id"] for e in result.emails] == ["2", "3"]
+    assert result.tokens <= 100
+    assert (result.truncated, result.dropped) == (2, 1)
+
+
+def test_keeps_at_least_one_email():
+    result = fit_emails([_email("1", 500), _email("2", 500)], budget=1)
+    assert [e["id"] for e in result.emails] == ["1"]
+    assert result.dropped == 1
+    assert result.tokens > 1
+
+
+def test_empty():
+    assert fit_emails([]).emails == []
+    result = fit_emails([{"id": "1"}])
+    assert result.emails == [{"id": "1", "subject": "", "from": "", "raw": ""}]
+    assert result.tokens == EMAIL_OVERHEAD_TOKENS
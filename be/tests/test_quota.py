@@ -0,0 +1,136 @@
+import pytest
+
+from src.repo.state import MemoryBackend
+from src.utils import quota
+from src.utils.quota import QuotaLimiter, SharedWindowBucket, TokenBucket
+
+
+class FakeClock:
+    """ Stands in for the time module in src.utils.quota """
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+        self.slept = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.slept += seconds
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(quota, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def state(monkeypatch) -> MemoryBackend:
+    backend = MemoryBackend()
+    monkeypatch.setattr(quota, "get_state", lambda: backend)
+    return backend
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=10)
+    assert bucket.reserve(10) == 0
+    # Into debt: the caller waits until the tokens have been refilled
+    assert bucket.reserve(5) == pytest.approx(0.5)
+    assert bucket.reserve(5) == pytest.approx(1.0)
+    clock.now += 1
+    assert bucket.reserve(0) == pytest.approx(0)
+    clock.now += 100
+    # Refills up to its capacity only
+    assert bucket.reserve(10) == 0
+    assert bucket.reserve(1) == pytest.approx(0.1)
+
+
+def test_token_bucket_larger_call_than_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=20)
+    assert bucket.reserve(100) == 0
+    assert bucket.reserve(1) == pytest.approx(0.1)
+
+
+def test_token_bucket_drain(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.drain()
+    assert bucket.reserve(5) == pytest.approx(0.5)
+    bucket.drain()
+    # Debt is kept
+    assert bucket.reserve(5) == pytest.approx(1.0)
+
+
+def test_shared_window_bucket(clock, state):
+    bucket = SharedWindowBucket("quota:test", rate=10)
+    other_worker = SharedWindowBucket("quota:test", rate=10)
+    clock.now = 1000.25
+    assert bucket.reserve(6) == 0
+    # The next call does not fit this window and takes a slot in the next one
+    assert other_worker.reserve(6) == pytest.approx(0.75)
+    assert bucket.reserve(4) == 0
+    # A later call may still fit an earlier window
+    assert bucket.reserve(5) == pytest.approx(1.75)
+    assert bucket.reserve(4) == pytest.approx(0.75)
+    # A call larger than the rate takes a whole window
+    assert bucket.reserve(50) == pytest.approx(2.75)
+
+
+def test_shared_window_bucket_drain(clock, state):
+    bucket = SharedWindowBucket("quota:test", rate=10)
+    bucket.drain()
+    assert bucket.reserve(1) == pytest.approx(1)
+
+
+def test_shared_window_bucket_gives_up_after_max_windows(clock, state):
+    bucket = SharedWindowBucket("quota:test", rate=1)
+    for _ in range(SharedWindowBucket.MAX_WINDOWS_AHEAD):
+        bucket.reserve(1)
+    assert bucket.reserve(1) == SharedWindowBucket.MAX_WINDOWS_AHEAD
+
+
+def test_limiter_waits_for_the_user_and_project_buckets(clock, state):
+    limiter = QuotaLimiter(limits={"gmail": (100, 150)})
+    assert limiter.acquire("gmail", "alice", 100) == 0
+    assert limiter.acquire("gmail", "bob", 100) == pytest.approx(50 / 150)
+    assert limiter.acquire("gmail", "alice", 50) > 0
+    assert clock.slept > 0
+    assert limiter.metrics()["gmail"]["calls"] == 3
+    assert limiter.metrics()["gmail"]["throttled_calls"] == 2
+
+
+def test_limiter_evicts_the_least_recent_user(clock, state):
+    limiter = QuotaLimiter(limits={"gmail": (100, 10_000)}, max_users=2)
+    for user in ("a", "b", "a", "c"):
+        limiter.acquire("gmail", user, 1)
+    assert list(limiter.users) == [("gmail", "a"), ("gmail", "c")]
+
+
+def test_headroom(clock, state):
+    bucket = TokenBucket(rate=10)
+    assert bucket.headroom() == 1
+    bucket.reserve(8)
+    assert bucket.headroom() == pytest.approx(0.2)
+    bucket.reserve(8)
+    assert bucket.headroom() == 0
+    clock.now += 10
+    assert bucket.headroom() == 1
+
+    shared = SharedWindowBucket("quota:test", rate=10)
+    assert shared.headroom() == 1
+    shared.reserve(4)
+    assert shared.headroom() == pytest.approx(0.6)
+    shared.drain()
+    assert shared.headroom() == 0
+
+    limiter = QuotaLimiter(limits={"gmail": (100, 1000)})
+    limiter.acquire("gmail", "alice", 30)
+    limiter.acquire("gmail", "bob", 800)
+    # The lower of the user's and the project's share
+    assert limiter.headroom("gmail", "alice") == pytest.approx(0.17)
+    assert limiter.headroom("gmail", "carol") == pytest.approx(0.17)
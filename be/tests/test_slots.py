@@ -0,0 +1,71 @@
+from datetime import datetime, time, timedelta, timezone
+
+import numpy as np
+
+from src.services.slots import WorkingHours, busy_bitmap, find_slots
+
+UTC = WorkingHours(start=time(9), end=time(12), days=(0, 1, 2, 3, 4), time_zone="UTC")
+# A Monday
+MONDAY = datetime(2026, 3, 2, tzinfo=timezone.utc)
+
+
+def _at(hour: int, minute: int = 0, day: int = 0) -> datetime:
+    return MONDAY + timedelta(days=day, hours=hour, minutes=minute)
+
+
+def _busy(*ranges: tuple[datetime, datetime]) -> list[list[str]]:
+    return [[s.isoformat(), e.isoformat()] for s, e in ranges]
+
+
+def _starts(slots: list[dict]) -> list[str]:
+    return [datetime.fromisoformat(s["start"]).strftime("%a %H:%M") for s in slots]
+
+
+def test_busy_bitmap():
+    bitmap = busy_bitmap(_busy((_at(0, 10), _at(0, 20)), (_at(0, 15), _at(0, 30))), _at(0), 60)
+    assert bitmap.shape == (60,)
+    assert np.flatnonzero(bitmap).tolist() == list(range(10, 30))
+    assert not busy_bitmap([], _at(0), 5).any()
+
+
+def test_busy_bitmap_clips_at_the_window_edges():
+    busy = _busy((_at(-1), _at(0, 5)), (_at(0, 55), _at(2)), (_at(-3), _at(-2)), (_at(3), _at(4)))
+    bitmap = busy_bitmap(busy, _at(0), 60)
+    assert np.flatnonzero(bitmap).tolist() == [0, 1, 2, 3, 4, 55, 56, 57, 58, 59]
+
+
+def test_partly_busy_minutes_are_busy():
+    busy = _busy((_at(0, 10) + timedelta(seconds=30), _at(0, 11) + timedelta(seconds=1)))
+    assert np.flatnonzero(busy_bitmap(busy, _at(0), 20)).tolist() == [10, 11]
+
+
+def test_earliest_free_slots_within_working_hours():
+    busy = _busy((_at(9), _at(10, 10)))
+    slots = find_slots(busy, _at(0), _at(24), 60, count=3, hours=UTC)
+    # 11:00 would overlap the first slot, and 11:15 would end after working hours
+    assert _starts(slots) == ["Mon 10:15"]
+    assert slots[0]["end"] == _at(11, 15).isoformat()
+
+
+def test_slots_skip_weekends_and_do_not_overlap():
+    # Friday 9:00 to Monday 12:00
+    slots = find_slots([], _at(0, day=4), _at(12, day=7), 90, count=10, hours=UTC, step=30)
+    assert _starts(slots) == ["Fri 09:00", "Fri 10:30", "Mon 09:00", "Mon 10:30"]
+
+
+def test_preferred_time_comes_first():
+    slots = find_slots([], _at(0), _at(24, day=1), 30, count=3, hours=UTC, preferred=_at(11, day=1))
+    assert _starts(slots) == ["Tue 11:00", "Tue 10:30", "Tue 11:30"]
+
+
+def test_working_hours_in_the_users_time_zone():
+    hours = WorkingHours(start=time(9), end=time(10), time_zone="Asia/Singapore")
+    slots = find_slots([], _at(0), _at(24), 60, hours=hours)
+    assert [s["start"] for s in slots] == ["2026-03-02T09:00:00+08:00"]
+
+
+def test_no_room():
+    assert find_slots([], _at(9), _at(9, 30), 60, hours=UTC) == []
+    assert find_slots(_busy((_at(0), _at(24))), _at(0), _at(24), 30, hours=UTC) == []
+    # Saturday and Sunday only
+    assert find_slots([], _at(0, day=5), _at(24, day=6), 30, hours=UTC) == []
@@ -0,0 +1,19 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src.utils.startup import HEAVY_MODULES
+
+BE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_heavy_modules_are_not_imported_by_main():
+    pytest.importorskip("fastapi")
+    code = ("import sys, main; "
+            f"print(' '.join(m for m in {HEAVY_MODULES + ('googleapiclient', 'httplib2', 'google.auth')!r} "
+            "if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], cwd=BE_DIR,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
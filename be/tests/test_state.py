@@ -0,0 +1,113 @@
+import json
+import os
+import time
+import uuid
+
+import pytest
+
+from src.repo import auth, state
+from src.repo.state import MemoryBackend, RedisBackend, SQLiteBackend, StateBackend, create_backend
+
+
+def _redis_backend():
+    # A real server when REDIS_URL is set, otherwise an in-process fake (with Lua, for incr)
+    url = os.getenv("REDIS_URL")
+    if url:
+        pytest.importorskip("redis")
+        backend = RedisBackend(url)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        backend = RedisBackend.__new__(RedisBackend)
+        backend.client = fakeredis.FakeRedis()
+        backend._incr = backend.client.register_script(RedisBackend._INCR)
+    return backend
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path) -> StateBackend:
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return create_backend(f"sqlite:///{tmp_path / 'state.db'}")
+    return _redis_backend()
+
+
+@pytest.fixture
+def key() -> str:
+    # Unique, so runs against a shared Redis do not see each other's keys
+    return f"test:{uuid.uuid4().hex}"
+
+
+def test_abstract_backend_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_round_trip(backend, key):
+    assert backend.get(key) is None
+    backend.set(key, b"value")
+    assert backend.get(key) == b"value"
+    backend.set(key, b"other")
+    assert backend.get(key) == b"other"
+    assert backend.pop(key) == b"other"
+    assert backend.get(key) is None
+    assert backend.pop(key) is None
+
+
+def test_json_round_trip(backend, key):
+    backend.set_json(key, {"token": "abc", "scopes": ["mail", "calendar"], "expiry": 1.5})
+    assert backend.get_json(key) == {"token": "abc", "scopes": ["mail", "calendar"], "expiry": 1.5}
+
+
+def test_add_only_sets_missing_keys(backend, key):
+    assert backend.add(key, b"first")
+    assert not backend.add(key, b"second")
+    assert backend.get(key) == b"first"
+
+
+def test_incr(backend, key):
+    assert backend.incr(key) == 1
+    assert backend.incr(key, 5) == 6
+
+
+def test_ttl_expires(backend, key):
+    backend.set(key, b"value", ttl=0.2)
+    backend.set(key + ":kept", b"value")
+    assert backend.get(key) == b"value"
+    time.sleep(0.3)
+    assert backend.get(key) is None
+    assert backend.get(key + ":kept") == b"value"
+
+
+def test_add_replaces_an_expired_key(backend, key):
+    assert backend.add(key, b"first", ttl=0.2)
+    time.sleep(0.3)
+    assert backend.add(key, b"second")
+    assert backend.get(key) == b"second"
+
+
+def test_incr_ttl_applies_when_created(backend, key):
+    assert backend.incr(key, ttl=0.2) == 1
+    # A later increment does not extend the window
+    assert backend.incr(key, ttl=10) == 2
+    time.sleep(0.3)
+    assert backend.incr(key, ttl=10) == 1
+
+
+@pytest.fixture
+def tokens_backend(backend, monkeypatch):
+    monkeypatch.setattr(state, "_backend", backend)
+    monkeypatch.setattr(auth.db, "user_tokens", {})
+    return backend
+
+
+def test_tokens_are_written_through_and_saved(tokens_backend, tmp_path, key):
+    path = tmp_path / "user_tokens.json"
+    # A token another worker saved before
+    path.write_text(json.dumps({"other": {"token": "b"}}))
+    auth.set_user_tokens(key, {"token": "a"})
+    auth.save_user_tokens(str(path))
+
+    assert tokens_backend.get_json(f"token:{key}") == {"token": "a"}
+    assert json.loads(path.read_text()) == {"other": {"token": "b"}, key: {"token": "a"}}
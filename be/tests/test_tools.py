@@ -0,0 +1,20 @@
+import pytest
+
+pytest.importorskip("langchain")
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+
+from tools import tools
+
+
+@pytest.fixture
+def echo_llm(monkeypatch):
+    """ An LLM that answers with the prompt it was given """
+    llm = RunnableLambda(lambda prompt: AIMessage("\n".join(m.content for m in prompt.to_messages())))
+    monkeypatch.setattr(tools, "get_llm", lambda **kwargs: llm)
+
+
+def test_braces_reach_the_llm_unchanged(echo_llm):
+    history = [HumanMessage("What is {this}?"), AIMessage("A {{placeholder}}")]
+    answer = tools.natural_language_response("Be {brief}", 'Summary: {"a": 1} and }{', history).content
+    assert answer == 'Be {brief}\nWhat is {this}?\nA {{placeholder}}\nSummary: {"a": 1} and }{'
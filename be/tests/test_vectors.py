@@ -0,0 +1,64 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from src.repo import vectors
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(vectors, "SEARCH_INDEX_DIR", str(tmp_path))
+    monkeypatch.setattr(vectors, "_indexes", vectors.OrderedDict())
+    return tmp_path
+
+
+def _append(index, *ids):
+    rows = np.eye(len(ids), index.dim, dtype=np.float32)
+    return index.append([{"id": i} for i in ids], rows)
+
+
+def test_search_returns_the_closest_rows():
+    index = vectors.get_index("me@example.com", "test", 4)
+    assert _append(index, "a", "b", "c") == 3
+    assert _append(index, "a") == 0
+    hits = index.search(np.array([0, 1, 0, 0], dtype=np.float32), 2)
+    assert [meta["id"] for _, meta in hits] == ["b", "a"]
+    assert index.missing(["a", "d"]) == ["d"]
+
+
+def test_an_account_keeps_one_index(index_dir):
+    index = vectors.get_index("me@example.com", "test", 4)
+    _append(index, "a")
+    vectors._indexes.clear()
+    assert len(vectors.get_index("me@example.com", "test", 4)) == 1
+    assert len(os.listdir(index_dir)) == 1
+
+
+def test_open_indexes_are_bounded(monkeypatch):
+    monkeypatch.setattr(vectors, "SEARCH_INDEX_OPEN", 2)
+    first = vectors.get_index("a@example.com", "test", 4)
+    vectors.get_index("b@example.com", "test", 4)
+    # Using an index makes it the most recent
+    assert vectors.get_index("a@example.com", "test", 4) is first
+    vectors.get_index("c@example.com", "test", 4)
+    assert len(vectors._indexes) == 2
+    assert vectors.get_index("a@example.com", "test", 4) is first
+
+
+def test_prune_deletes_unused_indexes(index_dir):
+    old = vectors.get_index("old@example.com", "test", 4)
+    _append(old, "a")
+    used = vectors.get_index("used@example.com", "test", 4)
+    _append(used, "b")
+    past = time.time() - 2 * 60 * 60
+    for directory in (old.directory, used.directory):
+        for name in os.listdir(directory):
+            os.utime(os.path.join(directory, name), (past, past))
+    used.touch()
+    assert vectors.prune_indexes(60 * 60) == 1
+    assert os.listdir(index_dir) == [os.path.basename(used.directory)]
+    # An index still open in a process whose directory was pruned starts over
+    assert len(old) == 1 and old.missing(["a"]) == ["a"]
+    assert _append(old, "a") == 1
@@ -0,0 +1,26 @@
+from typing import TYPE_CHECKING
+
+from src.services.assistant_sessions import Session
+from tools.prompt_budget import fit_emails
+
+if TYPE_CHECKING:
+    from langchain_core.tools import BaseTool
+
+
+def get_conversation_emails_tool(session: Session) -> "BaseTool":
+    from langchain.tools import tool
+
+    @tool
+    def conversation_emails_tool(reference: str) -> str:
+        """
+        Looks up emails that were already retrieved earlier in this conversation, e.g. "the one
+        from Alice", "the invoice" or "2" (their number in the list). Use it for follow-up
+        questions instead of searching the mailbox again. Returns the emails' full text.
+        """
+        emails = fit_emails(session.find_emails(reference)).emails
+        if not emails:
+            return "No emails were retrieved in this conversation yet."
+        return "\n\n".join(f"From: {e['from']}\nSubject: {e['subject']}\nDate: {e['date']}\nContent: {e['raw']}"
+                             for e in emails)
+
+    return conversation_emails_tool
@@ -1,87 +1,111 @@
 import logging
 import os
-from datetime import datetime
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.tools import tool
-from langchain_core.tools import BaseTool
+from typing import TYPE_CHECKING
 
+from src.services.assistant_sessions import Session
 from src.services.email import get_email
+from src.services.priority import prioritize, top_k
+from src.services.threads import format_conversation, get_threads
+from src.utils.cache import SharedCache
+from src.utils.dedup import collapse_near_duplicates, duplicates_note
+from src.utils.etag import make_etag
+from src.utils.singleflight import flights
+from tools.llm import get_llm
+from tools.prompt_budget import FieldBudget, fit_emails, truncate
+
+if TYPE_CHECKING:
+    from langchain_core.tools import BaseTool
 
 logger: logging.Logger = logging.getLogger('uvicorn.error')
 
+# (user, digest of the summarized emails) -> summary, so an unchanged inbox is not re-summarized
+_summary_cache = SharedCache("summary", maxsize=256, ttl=60 * 60, snapshot=True)
+# Emails summarized in full; the others are only listed by subject
+SUMMARY_TOP_K = int(os.getenv("SUMMARY_TOP_K", "6"))
+
 
 def fetch_emails(user_id: str):
     emails_data = get_email(user_id, 10, False, None)
+    if isinstance(emails_data, list):
+        emails_data = prioritize(user_id, emails_data)
 
     processed_emails = []
     for email in emails_data:
-        # Check for legacy format with "payload"
-        if "payload" in email:
-            headers = email.get("payload", {}).get("headers", [])
-            sender = subject = date_str = None
-            for header in headers:
-                if header.get("name") == "From":
-                    sender = header.get("value")
-                elif header.get("name") == "Subject":
-                    subject = header.get("value")
-                elif header.get("name") == "Date":
-                    date_str = header.get("value")
-            raw = email.get("raw", "")
-        else:
-            # New format: keys are at the root level
-            sender = email.get("from", "Unknown Sender")
-            subject = email.get("subject", "No Subject")
-            raw = email.get("raw", "")
-            date_str = None
-
-        try:
-            date_obj = (
-                datetime.strptime(date_str, "%a, %d %b %Y %H:%M:%S %z")
-                if date_str
-                else datetime.now()
-            )
-        except Exception:
-            date_obj = datetime.now()
-
+        # Records come with the sender and the parsed date
         processed_emails.append(
             {
-                "id": email.get("id", str(date_obj.timestamp())),
-                "subject": subject or "No Subject",
-                "sender": sender or "Unknown Sender",
-                "summary": raw,
-                "priority": (
-                    "High" if "IMPORTANT" in email.get(
-                        "labelIds", []) else "Low"
-                ),
-                "date": date_obj,
+                "id": email.id,
+                "threadId": email.thread_id,
+                "subject": email.subject or "No Subject",
+                "sender": email.sender or "Unknown Sender",
+                "summary": email.raw or "",
+                "priority": email.priority or ("High" if "IMPORTANT" in email.label_ids else "Low"),
+                "priorityScore": email.priority_score or 0.0,
+                "date": email.date,
             }
         )
     return processed_emails
 
 
+def with_thread_context(user_id: str, emails: list[dict]) -> list[dict]:
+    """
+    Replaces each email's text with its whole conversation, quoted history removed, and keeps
+    one entry per thread so the prompt does not repeat the same messages.
+    """
+    thread_ids = list(dict.fromkeys(e["threadId"] for e in emails if e.get("threadId")))
+    if not thread_ids:
+        return emails
+    try:
+        threads = get_threads(user_id, thread_ids)
+    except Exception as e:
+        logger.warning(f"Could not load threads, summarizing single messages: {e}")
+        return emails
+    result = []
+    seen = set()
+    for email in emails:
+        thread = threads.get(email.get("threadId"))
+        if thread is None:
+            result.append(email)
+        elif thread["id"] not in seen:
+            seen.add(thread["id"])
+            result.append(dict(email, summary=format_conversation(thread["messages"])))
+    return result
+
+
 def summarize_emails(emails):
-    # Load environment variables
     logger.info("summarising emails %s", emails)
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-    # Initialize Gemini LLM
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-001",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        google_api_key=GOOGLE_API_KEY,
-    )
-
+    llm = get_llm()
+
+    # Near-identical emails (notifications, newsletters) appear once, represented by the
+    # highest-priority copy and a count
+    ranked = top_k(emails, len(emails))
+    emails = collapse_near_duplicates(ranked, [f"{e['subject']}\n{e['summary'] or ''}" for e in ranked])
+    if len(emails) < len(ranked):
+        logger.info(f"Summarizing {len(emails)} distinct emails out of {len(ranked)}")
+
+    # The most important emails in full, best first; the rest only by sender and subject
+    detailed = top_k(emails, SUMMARY_TOP_K)
+    detailed_ids = {email["id"] for email in detailed}
+    # Whole threads are summarized here, so bodies may use more than the default budget
+    detailed = fit_emails(detailed, fields=FieldBudget(body_head=900, body_tail=300), body_key="summary",
+                          sender_key="sender", scores=[email["priorityScore"] for email in detailed]).emails
     combined = ""
-    for email in emails:
+    for email in detailed:
         combined += (
             f"From: {email['sender']}\n"
             f"Subject: {email['subject']}\n"
-            f"Summary: {email['summary']}\n\n"
+            f"Priority: {email['priority']}\n"
+            f"Summary: {email['summary']}\n"
         )
+        if email["duplicates"]:
+            combined += f"Also received: {duplicates_note(email)}\n"
+        combined += "\n"
+    others = [email for email in emails if email["id"] not in detailed_ids]
+    if others:
+        combined += "Other, lower-priority emails:\n" + "".join(
+            f"- {truncate(email['subject'], 40)} (from {truncate(email['sender'], 20)})"
+            + (f"; also {duplicates_note(email)}" if email["duplicates"] else "") + "\n"
+            for email in others)
 
     prompt = """
 You are an intelligent assistant summarizing an inbox. Below are the details of recent emails:
@@ -91,6 +115,8 @@ You are an intelligent assistant summarizing an inbox. Below are the details of
 Please provide a well-structured and concise summary of what these emails are about. Highlight any high-priority messages or actions needed.
 """
 
+    from langchain.prompts import ChatPromptTemplate
+
     try:
         prompt_template = ChatPromptTemplate.from_template(prompt)
         chain = prompt_template | llm
@@ -100,16 +126,39 @@ Please provide a well-structured and concise summary of what these emails are ab
         return f"Error generating summary: {e}"
 
 
-def get_generate_inbox_summary_tool(user_id: str) -> BaseTool:
+def get_inbox_summary(user_id: str) -> str:
+    """ Summarizes the user's recent emails, reusing the summary while the inbox is unchanged """
+    # The assistant, the prefetcher and a second tab asking at once share one summary run
+    return flights.do((user_id, "summary"), _inbox_summary, user_id)
+
+
+def _inbox_summary(user_id: str) -> str:
+    emails = fetch_emails(user_id)
+    if isinstance(emails, str):
+        # Return error message if fetching fails
+        return emails
+    emails = with_thread_context(user_id, emails)
+    key = (user_id, make_etag([(e["id"], e["subject"], e["summary"]) for e in emails]))
+    summary = _summary_cache.get(key)
+    if summary is None:
+        summary = summarize_emails(emails)
+        if not summary.startswith("Error generating summary"):
+            _summary_cache.set(key, summary)
+    return summary
+
+
+def get_generate_inbox_summary_tool(user_id: str, session: Session | None = None) -> "BaseTool":
+    from langchain.tools import tool
 
     @tool
     def generate_inbox_summary() -> str:
         """Fetches recent emails via an API call (using cookies from st.context.headers) and summarizes them using an LLM."""
-        emails = fetch_emails(user_id)
-        if isinstance(emails, str):
-            # Return error message if fetching fails
-            return emails
-        response = summarize_emails(emails)
+        response = get_inbox_summary(user_id)
+        if session is not None:
+            # The listing the summary was made from; served from the mailbox cache
+            emails = get_email(user_id, 10, False, None)
+            if isinstance(emails, list):
+                session.remember_emails(emails)
         logger.info("generate_inbox_summary response: %s", response)
         return response
 
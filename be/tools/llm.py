@@ -0,0 +1,28 @@
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+
+def get_llm(temperature: float = 0) -> "BaseChatModel":
+    """
+    Returns the chat model used by the tools.
+    Set LLM_PROVIDER=fake to use the deterministic offline model from the benchmarks.
+    """
+    if os.getenv("LLM_PROVIDER") == "fake":
+        from benchmarks.fake_llm import FakeChatModel
+        return FakeChatModel(latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "0")))
+
+    # Imported on first use: the Gemini client (and gRPC under it) takes seconds to load
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-001",
+        temperature=temperature,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        google_api_key=GOOGLE_API_KEY,
+    )
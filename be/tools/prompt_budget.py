@@ -0,0 +1,107 @@
+"""
+Keeps LLM prompts within a token budget. Token counts are estimated locally (about one
+token per word or punctuation mark), which is close enough for English mail and costs
+one regex pass instead of a tokenizer call.
+
+The Streamlit app's own prompts use it through POST /assistant/fit-emails.
+"""
+import logging
+import os
+import re
+from dataclasses import dataclass
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+# Tokens the emails of one prompt may use in total
+PROMPT_BUDGET_TOKENS = int(os.getenv("PROMPT_BUDGET_TOKENS", "6000"))
+# Labels and separators the prompt adds around each email
+EMAIL_OVERHEAD_TOKENS = 12
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_TOKEN.findall(text))
+
+
+def truncate(text: str, head: int, tail: int = 0) -> str:
+    """ Keeps the first `head` and last `tail` tokens of a text, marking the cut with […] """
+    if not text:
+        return ""
+    starts = [m.start() for m in _TOKEN.finditer(text)]
+    if len(starts) <= head + tail:
+        return text
+    kept = text[:starts[head]].rstrip() if head else ""
+    if tail:
+        return f"{kept} […] {text[starts[-tail]:]}".lstrip()
+    return f"{kept} […]"
+
+
+@dataclass(frozen=True)
+class FieldBudget:
+    """ Tokens each field of an email may use in a prompt """
+    subject: int = 40
+    sender: int = 20
+    body_head: int = 400
+    body_tail: int = 100
+    # What the bodies of the least important emails shrink to when the prompt is over budget
+    body_min: int = 60
+
+
+@dataclass
+class FittedEmails:
+    emails: list[dict]
+    tokens: int
+    truncated: int
+    dropped: int
+
+
+def fit_emails(emails: list[dict], budget: int = PROMPT_BUDGET_TOKENS, fields: FieldBudget = FieldBudget(),
+               body_key: str = "raw", sender_key: str = "from", scores: list[float] | None = None) -> FittedEmails:
+    """
+    Returns copies of the emails (same order) whose subject, sender and body fit their field
+    budgets. If they still exceed `budget` tokens, the bodies of the lowest-scored emails
+    (by default the last ones) are shortened to `fields.body_min`, then those emails are left out.
+    """
+    if scores is None:
+        scores = [-i for i in range(len(emails))]
+    fitted, costs, truncated = [], [], set()
+    for i, email in enumerate(emails):
+        body = email.get(body_key) or ""
+        short = truncate(body, fields.body_head, fields.body_tail)
+        if short != body:
+            truncated.add(i)
+        email = dict(email, subject=truncate(email.get("subject") or "", fields.subject),
+                     **{sender_key: truncate(email.get(sender_key) or "", fields.sender), body_key: short})
+        fitted.append(email)
+        costs.append(_cost(email, body_key, sender_key))
+
+    total = sum(costs)
+    least_important = sorted(range(len(emails)), key=lambda i: scores[i])
+    for i in least_important:
+        if total <= budget:
+            break
+        body = fitted[i][body_key]
+        short = truncate(body, fields.body_min)
+        if short != body:
+            truncated.add(i)
+            fitted[i][body_key] = short
+            total -= costs[i]
+            costs[i] = _cost(fitted[i], body_key, sender_key)
+            total += costs[i]
+    dropped = set()
+    for i in least_important:
+        if total <= budget or len(dropped) == len(emails) - 1:
+            break
+        dropped.add(i)
+        total -= costs[i]
+
+    kept = [email for i, email in enumerate(fitted) if i not in dropped]
+    logger.info(f"Prompt emails use ~{total} tokens: {len(kept)} emails, "
+                f"{len(truncated - dropped)} shortened, {len(dropped)} left out")
+    return FittedEmails(kept, total, len(truncated - dropped), len(dropped))
+
+
+def _cost(email: dict, body_key: str, sender_key: str) -> int:
+    return (estimate_tokens(email["subject"]) + estimate_tokens(email[sender_key])
+            + estimate_tokens(email[body_key]) + EMAIL_OVERHEAD_TOKENS)
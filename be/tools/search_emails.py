@@ -2,32 +2,30 @@ import json
 import logging
 import os
 import re
+from typing import TYPE_CHECKING
+
+from src.services.assistant_sessions import Session
 from src.services.email import get_email
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.tools import tool
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.tools import BaseTool
+from src.services.semantic_search import rank_candidates
+from src.utils.singleflight import flights
+from tools.llm import get_llm
+from tools.prompt_budget import fit_emails
+
+if TYPE_CHECKING:
+    from langchain_core.tools import BaseTool
 
 logger: logging.Logger = logging.getLogger('uvicorn.error')
 
+# Emails the LLM reads per search, picked by the local semantic index
+SEARCH_TOP_K = int(os.getenv("SEARCH_TOP_K", "8"))
+
 
 def generate_keywords(query):
     """
     Uses the LLM to extract keywords from the user's query.
     The LLM returns a comma-separated list of keywords.
     """
-    # Load environment variables
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-    # Initialize Gemini LLM
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-001",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        google_api_key=GOOGLE_API_KEY,
-    )
+    llm = get_llm()
 
     prompt = f"""
 Extract keywords from the following user query for email search.
@@ -49,34 +47,27 @@ def search_emails_llm(emails, query):
     Uses the LLM to filter and return only the emails that match the query.
     Returns the results as a JSON array (a Python list of dictionaries).
     """
-    # Load environment variables
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-    # Initialize Gemini LLM
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-001",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        google_api_key=GOOGLE_API_KEY,
-    )
+    llm = get_llm()
 
     email_summaries = ""
 
     if not emails or isinstance(emails, str):
         return ""  # Return an empty list if no emails were fetched
 
+    # Every candidate is shown, near-identical ones too: a search for one order or invoice
+    # must not get a lookalike instead
+    emails = [dict(email, content=email.get("raw") or email.get("snippet") or "No content available.")
+              for email in emails]
+    # Candidates come best first; the last ones are shortened first if the prompt is too long
+    emails = fit_emails(emails, body_key="content").emails
+
     for i, email in enumerate(emails):
         from_field = email.get("from", "Unknown Sender")
         subject = email.get("subject", "No Subject")
         date_str = email.get("date", "Unknown")
-        content = email.get("raw")
-        if content is None:
-            content = email.get("snippet", "No content available.")
         email_summaries += (
             f"[Email {i+1}]\nFrom: {from_field}\nSubject: {subject}\nDate: {date_str}\n"
-            f"Content: {content}\n\n"
+            f"Content: {email['content']}\n\n"
         )
 
     prompt = """
@@ -120,6 +111,8 @@ def search_emails_llm(emails, query):
     Please output ONLY the JSON array with no additional text.
     """
 
+    from langchain.prompts import ChatPromptTemplate
+
     try:
         prompt_template = ChatPromptTemplate.from_template(prompt)
         chain = prompt_template | llm
@@ -130,7 +123,30 @@ def search_emails_llm(emails, query):
         raise e
 
 
-def get_search_emails_tool(user_id: str) -> BaseTool:
+def search_emails(user_id: str, query: str) -> tuple[str, list[dict]]:
+    """
+    Runs the keyword extraction, fetch and LLM filtering pipeline for one query. Returns the
+    LLM's answer and the emails it was given.
+    """
+    # Identical concurrent searches (ignoring case and spacing) share one pipeline run
+    normalized = " ".join(query.lower().split())
+    return flights.do((user_id, "search", normalized), _search_emails, user_id, query)
+
+
+def _search_emails(user_id: str, query: str) -> tuple[str, list[dict]]:
+    keywords = generate_keywords(query)
+    emails = get_email(user_id, 10, True, keywords)
+    if not isinstance(emails, list):
+        emails = []
+    # Keyword matches plus indexed mail that is related without sharing the query's words;
+    # only the closest ones go into the prompt
+    candidates = rank_candidates(user_id, query, emails, SEARCH_TOP_K)
+    logger.info(f"Searching {len(candidates)} of {len(emails)} keyword matches and indexed emails")
+    return search_emails_llm(candidates, query), candidates
+
+
+def get_search_emails_tool(user_id: str, session: Session | None = None) -> "BaseTool":
+    from langchain.tools import tool
 
     @tool
     def search_emails_tool(query: str) -> str:
@@ -138,14 +154,12 @@ def get_search_emails_tool(user_id: str) -> BaseTool:
         Searches the user's emails via an API call using cookies from st.context.headers.
         Returns the search results as a JSON array (a Python list of dictionaries).
         """
-        keywords = generate_keywords(query)
-        emails = get_email(user_id, 10, True, keywords)
-        logger.info("Fetched emails: %s", emails)
-        result = search_emails_llm(emails, query)
+        result, candidates = search_emails(user_id, query)
+        if session is not None:
+            # Follow-up questions can refer to these without searching again
+            session.remember_emails(candidates)
         cleaned_output = re.sub(r"```(?:json|python)?",
                                 "", result).strip("` \n")
-        json_string = json.dumps(cleaned_output)
-        escaped_json = json_string.replace("{", "{{").replace("}", "}}")
-        return escaped_json
+        return json.dumps(cleaned_output)
 
     return search_emails_tool
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Callable
+
+from src.services.threads import format_conversation, get_thread
+from src.utils.cache import SharedCache
+from tools.llm import get_llm
+from tools.prompt_budget import truncate
+
+logger: logging.Logger = logging.getLogger('uvicorn.error')
+
+TONES = ("Professional", "Friendly", "Concise")
+MAX_VARIATIONS = 3
+# Nudges that keep concurrently generated variations from converging on the same text
+VARIATION_HINTS = [
+    "",
+    "Take a different angle from the most obvious reply, e.g. lead with a question or next step.",
+    "Keep it noticeably shorter and more direct than a typical reply.",
+]
+
+# Tokens of the email answered and of the earlier messages (newest kept) put in the prompt
+REPLY_CONTENT_TOKENS = (1200, 300)
+REPLY_CONVERSATION_TOKENS = 1500
+
+# (user, message id, tone, hash of instructions, sign-off and thread, count, variation) -> reply text
+_reply_cache = SharedCache("replies", maxsize=1024, ttl=24 * 60 * 60, snapshot=True)
+
+
+def reply_prompt(content: str, sender_name: str, tone: str, instructions: str, sign_off: str,
+                 hint: str = "", conversation: str = "") -> str:
+    earlier = ""
+    if conversation:
+        conversation = truncate(conversation, 0, REPLY_CONVERSATION_TOKENS)
+        earlier = f"\nEarlier messages in this thread, oldest first:\n---\n{conversation}\n---\n"
+    content = truncate(content, *REPLY_CONTENT_TOKENS)
+    prompt = f"""
+You are an assistant that generates smart email replies.
+
+IMPORTANT: Only output the final reply text.
+{earlier}
+Email:
+"{content}"
+Instructions: "{instructions}"
+Generate a {tone.lower()} reply:
+1. Start with "Dear {sender_name},"
+2. End with "Best regards," then on the next line "{sign_off}"
+3. Address the content
+"""
+    if hint:
+        prompt += f"4. {hint}\n"
+    return prompt
+
+
+def clean_reply(text: str) -> str:
+    lines = text.strip().splitlines()
+    cleaned = [l for l in lines if not any(x in l for x in ["IMPORTANT:", "===Variation"])]
+    return "\n".join(cleaned).strip()
+
+
+def _reply_digest(instructions: str, sign_off: str, conversation: str) -> str:
+    return hashlib.sha1(f"{instructions}\x00{sign_off}\x00{conversation}".encode()).hexdigest()
+
+
+def reply_context(user_id: str, email: dict) -> tuple[str, str]:
+    """
+    Returns the thread's earlier messages as a transcript and the email's own text, both with
+    quoted history removed. Falls back to the email alone when the thread cannot be loaded.
+    """
+    content = email.get("raw") or email.get("snippet") or ""
+    if not email.get("threadId"):
+        return "", content
+    try:
+        messages = get_thread(user_id, email["threadId"])["messages"]
+    except Exception as e:
+        logger.warning(f"Could not load the thread, replying without it: {e}")
+        return "", content
+    index = next((i for i, m in enumerate(messages) if m["id"] == email["id"]), None)
+    if index is None:
+        return format_conversation(messages), content
+    return format_conversation(messages[:index]), messages[index]["raw"] or content
+
+
+def generate_draft(user_id: str, email: dict, tone: str, instructions: str, sign_off: str,
+                   take_budget: Callable[[], bool] | None = None) -> str | None:
+    """
+    Generates a single reply synchronously (used by the background draft job). It shares the
+    cache entry of generate_replies with count=1, so asking for the same reply later is free.
+    `take_budget` is only asked when the LLM has to be called; None is returned if it refuses.
+    """
+    conversation, content = reply_context(user_id, email)
+    key = (user_id, email["id"], tone, _reply_digest(instructions, sign_off, conversation), 1, 0)
+    cached = _reply_cache.get(key)
+    if cached is not None:
+        return cached
+    if take_budget is not None and not take_budget():
+        return None
+    sender_name = email.get("from", "Unknown Sender")
+    prompt = reply_prompt(content, sender_name, tone, instructions, sign_off, conversation=conversation)
+    response = get_llm().invoke(prompt)
+    text = clean_reply(response.content)
+    _reply_cache.set(key, text)
+    return text
+
+
+async def generate_replies(user_id: str, email: dict, tone: str, instructions: str, sign_off: str,
+                           count: int = 1) -> AsyncIterator[dict]:
+    """
+    Generates `count` reply variations for `email` concurrently and yields each one as soon as it
+    is ready: {"index", "text", "cached"} or {"index", "error"}. Finished variations are cached.
+    """
+    sender_name = email.get("from", "Unknown Sender")
+    conversation, content = await asyncio.to_thread(reply_context, user_id, email)
+    digest = _reply_digest(instructions, sign_off, conversation)
+    keys = [(user_id, email["id"], tone, digest, count, index) for index in range(count)]
+
+    pending = []
+    for index, key in enumerate(keys):
+        cached = _reply_cache.get(key)
+        if cached is not None:
+            yield {"index": index, "text": cached, "cached": True}
+        else:
+            pending.append(index)
+    if not pending:
+        return
+
+    # A little temperature lets the variations differ; a single reply stays deterministic
+    llm = get_llm(temperature=0.7 if count > 1 else 0)
+
+    async def generate(index: int) -> dict:
+        hint = VARIATION_HINTS[index] if count > 1 else ""
+        prompt = reply_prompt(content, sender_name, tone, instructions, sign_off, hint, conversation)
+        try:
+            response = await llm.ainvoke(prompt)
+        except Exception as e:
+            logger.error(f"Reply variation {index} failed: {e}")
+            return {"index": index, "error": str(e)}
+        text = clean_reply(response.content)
+        _reply_cache.set(keys[index], text)
+        return {"index": index, "text": text, "cached": False}
+
+    for next_done in asyncio.as_completed([generate(index) for index in pending]):
+        yield await next_done
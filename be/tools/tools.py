@@ -1,53 +1,70 @@
 import logging
-import os
-from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import ToolMessage, BaseMessage
-from langchain.prompts import ChatPromptTemplate
+from typing import TYPE_CHECKING
 
+from src.services.assistant_sessions import Session, load_session, save_session
+from src.services.email import current_history_id, get_gmail_service
+from tools.conversation_emails import get_conversation_emails_tool
 from tools.search_emails import get_search_emails_tool
 from tools.inbox_summary import get_generate_inbox_summary_tool
+from tools.llm import get_llm
+from tools.prompt_budget import PROMPT_BUDGET_TOKENS, truncate
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
 
 # Load environment variables
 logger: logging.Logger = logging.getLogger("uvicorn.error")
 
 
-def call_tool(user_id: str, query: str, system: str) -> str:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+def _mailbox_version(user_id: str) -> str | None:
+    """ The mailbox historyId, which tool results are reused under; None if it cannot be read """
+    try:
+        return current_history_id(user_id, get_gmail_service(user_id))
+    except Exception as e:
+        logger.warning(f"Could not read the mailbox historyId, not reusing tool results: {e}")
+        return None
+
+
+def call_tool(user_id: str, query: str, system: str, session_id: str | None = None) -> tuple[str, str]:
     """
-    Call the appropriate tool based on the query.
+    Call the appropriate tool based on the query, within the user's conversation session.
+    Returns the answer and the session id to send with the next turn.
     """
-    # Initialize the Gemini LLM (using ChatGoogleGenerativeAI)
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-001",
-        temperature=0,
-        max_tokens=None,
-        timeout=None,
-        max_retries=2,
-        google_api_key=GOOGLE_API_KEY,
-    )
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 
-    # Import your pre-built tools.
-    # Make sure these functions (search_emails_tool and generate_inbox_summary) are defined and available.
-    # For example, they could be imported from a module named "my_tools".
+    # Earlier turns, tool results and retrieved emails of this conversation
+    session = load_session(user_id, session_id)
+    history = [HumanMessage(t["content"]) if t["role"] == "user" else AIMessage(t["content"])
+               for t in session.turns]
+    context = session.context()
+
+    # Initialize the Gemini LLM (using ChatGoogleGenerativeAI)
+    llm = get_llm()
 
     # Define the list of available tools.
-    generate_inbox_summary = get_generate_inbox_summary_tool(user_id)
-    search_emails_tool = get_search_emails_tool(user_id)
+    generate_inbox_summary = get_generate_inbox_summary_tool(user_id, session)
+    search_emails_tool = get_search_emails_tool(user_id, session)
     tools = [search_emails_tool, generate_inbox_summary]
+    if session.emails:
+        # Follow-ups about emails already found are looked up locally
+        tools.append(get_conversation_emails_tool(session))
 
     # Define a prompt that instructs the agent how to choose between tools.
     # The prompt provides high-level instructions:
     # - Use search_emails_tool if the query looks like a targeted email search.
     # - Use generate_inbox_summary if the query asks for a general summary of the inbox.
+    # - Use conversation_emails_tool for emails already retrieved in this conversation.
+    # With the conversation so far and its emails in view, the model can also answer directly.
+    request = f"{context}\n\nUser: {query}" if context else query
     llm_with_tools = llm.bind_tools(tools)
-    function_call_response = llm_with_tools.invoke(query)
+    function_call_response = llm_with_tools.invoke([*history, HumanMessage(request)])
 
     results: list[ToolMessage] = []
-    tool_calls = getattr(function_call_response, "tool_calls", None)
+    tool_calls = getattr(function_call_response, "tool_calls", None) or []
     if len(tool_calls) == 0:
-        human_response = natural_language_response(system, query)
-        return human_response.content
+        answer = natural_language_response(system, request, history).content
+        return _finish_turn(user_id, session, query, answer)
+    mailbox = _mailbox_version(user_id)
     for tool_call in tool_calls:
         tool_name = tool_call["name"]
         tool_args = tool_call["args"]
@@ -57,14 +74,17 @@ def call_tool(user_id: str, query: str, system: str) -> str:
         if tool_func is None:
             raise Exception(f"Tool '{tool_name}' not found.")
 
-        # Run the tool
-        output = tool_func.invoke(tool_args)
+        # The same call earlier in the conversation is not run again while the mailbox is unchanged
+        output = session.tool_result(tool_name, tool_args, mailbox)
+        if output is None:
+            output = tool_func.invoke(tool_args)
+            session.remember_tool_result(tool_name, tool_args, mailbox, output)
+        else:
+            logger.info(f"Reusing the result of {tool_name} from earlier in the conversation")
         results.append(ToolMessage(
             tool_call_id=tool_call["id"], content=output))
 
-    print("Invoke completed successfully.")
-
-    tool_output = results[0].content
+    tool_output = truncate("\n\n".join(r.content for r in results), PROMPT_BUDGET_TOKENS)
     tool_query = f"""The user asked: {query}
     
     After processing their requests, the tool returned the following:\n\n{tool_output}
@@ -72,24 +92,29 @@ def call_tool(user_id: str, query: str, system: str) -> str:
     Return response that suits your personality, tone, and style.
     """
     logger.info(f"Tool query: {tool_query}")
-    human_response = natural_language_response(system, tool_query)
+    human_response = natural_language_response(system, tool_query, history)
 
-    return human_response.content
+    return _finish_turn(user_id, session, query, human_response.content)
 
 
-def natural_language_response(system: str, query: str) -> BaseMessage:
-    GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+def _finish_turn(user_id: str, session: Session, query: str, answer: str) -> tuple[str, str]:
+    session.add_turn("user", query)
+    session.add_turn("assistant", answer)
+    save_session(user_id, session)
+    return answer, session.id
 
-    llm_for_output = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash-001",
-        temperature=0.7,
-        google_api_key=GOOGLE_API_KEY,
-    )
 
+def natural_language_response(system: str, query: str, history: list | None = None) -> "BaseMessage":
+    from langchain.prompts import ChatPromptTemplate
+
+    llm_for_output = get_llm(temperature=0.7)
+
+    # The system prompt and the query (which holds mail text) are template variables, so braces
+    # in them are not read as placeholders; message objects (the history) are passed through as they are
     post_tool_prompt = ChatPromptTemplate.from_messages(
-        [("system", system), ("human", query)]
+        [("system", "{system}"), *(history or []), ("human", "{query}")]
     )
     chain = post_tool_prompt | llm_for_output
-    human_response = chain.invoke({})
+    human_response = chain.invoke({"system": system or "", "query": query})
     logger.info(f"Result summary: {human_response}")
     return human_response
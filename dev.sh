@@ -2,7 +2,11 @@
 
 # Run FastAPI in the background
 cd be
-uvicorn main:app --host 0.0.0.0 --port 8101 &
+WORKERS=${WEB_CONCURRENCY:-1}
+if [ "$WORKERS" -gt 1 ] && [ -z "$STATE_BACKEND_URL" ]; then
+    export STATE_BACKEND_URL="sqlite:///state.db"
+fi
+uvicorn main:app --host 0.0.0.0 --port 8101 --workers "$WORKERS" &
 cd ..
 
 # Run Streamlit (foreground)
@@ -0,0 +1,405 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import unquote
+
+import requests
+import streamlit as st
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+load_dotenv()
+ip_address = os.getenv("IP_ADDRESS", "localhost")  # default fallback to localhost
+API_BASE_URL = os.getenv("API_BASE_URL", f"http://{ip_address}:8101")
+
+# (connect, read) timeouts in seconds; the assistant runs several LLM calls per request
+DEFAULT_TIMEOUT = (3.05, 60)
+ASSISTANT_TIMEOUT = (3.05, 300)
+
+# How long cached backend reads are reused across reruns, in seconds
+EMAIL_CACHE_TTL = int(os.getenv("EMAIL_CACHE_TTL", "60"))
+CALENDAR_CACHE_TTL = int(os.getenv("CALENDAR_CACHE_TTL", "120"))
+
+# Mail event listeners stop after this many seconds without a page asking for them
+MAIL_LISTENER_IDLE = 300
+# Seconds between reconnects of a mail event stream, doubling while they keep ending early
+MAIL_RECONNECT_DELAY = 1
+MAIL_RECONNECT_MAX_DELAY = 60
+
+
+def get_all_cookies() -> dict[str, str]:
+    """Return cookies as a dictionary using st.context.headers."""
+    headers = st.context.headers
+    if headers is None or "cookie" not in headers:
+        return {}
+    cookie_string = headers["cookie"]
+    cookie_kv_pairs = cookie_string.split(";")
+    cookie_dict = {}
+    for kv in cookie_kv_pairs:
+        if "=" in kv:
+            key, value = kv.split("=", 1)
+            cookie_dict[key.strip()] = unquote(value.strip())
+    return cookie_dict
+
+
+def get_user_key() -> str:
+    """Return the current user's backend session key (the 'key' cookie)."""
+    return get_all_cookies().get("key", "")
+
+
+class ApiClient:
+    """
+    Thin typed wrapper around the MailMate backend.
+    One instance (and its connection pool) is shared by every Streamlit session, so the
+    user's auth cookie is sent per request and never stored on the shared session.
+    """
+
+    def __init__(self, base_url: str = API_BASE_URL, pool_size: int = 32):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        # Never keep cookies from responses: the session is shared between users
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # (user key, path, params) -> (ETag, payload) for conditional GETs
+        self._validators: OrderedDict[tuple, tuple[str, object]] = OrderedDict()
+        self._validators_lock = threading.Lock()
+        self.max_validators = 512
+        self._listeners: dict[str, "MailEventListener"] = {}
+        self._listeners_lock = threading.Lock()
+        # User key -> mailbox historyId of the last email listing fetched
+        self.history_ids: dict[str, str] = {}
+
+    def _request(self, method: str, path: str, timeout=DEFAULT_TIMEOUT, user_key: str | None = None,
+                 **kwargs) -> requests.Response:
+        key = get_user_key() if user_key is None else user_key
+        headers = kwargs.pop("headers", {})
+        headers["Cookie"] = f"key={key}"
+        response = self.session.request(
+            method, f"{self.base_url}{path}", headers=headers, timeout=timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _get_json(self, path: str, params: dict, user_key: str | None = None):
+        """
+        GET with If-None-Match. When the backend answers 304 Not Modified, the payload
+        remembered for the same user, path and params is returned instead.
+        """
+        key = get_user_key() if user_key is None else user_key
+        cache_key = (key, path, tuple(sorted(
+            (k, tuple(v) if isinstance(v, list) else v) for k, v in params.items())))
+        with self._validators_lock:
+            cached = self._validators.get(cache_key)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self._request("GET", path, params=params, user_key=key, headers=headers)
+        if response.headers.get("X-History-Id"):
+            self.history_ids[key] = response.headers["X-History-Id"]
+        if response.status_code == 304 and cached:
+            return cached[1]
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            with self._validators_lock:
+                self._validators[cache_key] = (etag, data)
+                self._validators.move_to_end(cache_key)
+                while len(self._validators) > self.max_validators:
+                    self._validators.popitem(last=False)
+        return data
+
+    # Email
+
+    def get_emails(self, count: int = 10, include_read: bool = False,
+                   keywords: list[str] | None = None, user_key: str | None = None) -> list[dict]:
+        params = {"count": count, "includeRead": str(include_read).lower()}
+        if keywords:
+            params["q"] = keywords
+        data = self._get_json("/email/", params, user_key=user_key)
+        # The API returns a dict with a 'message' key containing the email array
+        if isinstance(data, dict):
+            data = data.get("message", [])
+        return [_with_date(email) for email in data]
+
+    def stream_events(self, user_key: str | None = None, last_event_id: str | None = None):
+        """Yield events from /email/events as dicts; blocks between events."""
+        headers = {"Accept": "text/event-stream"}
+        if last_event_id:
+            headers["Last-Event-ID"] = last_event_id
+        # No read timeout: the server sends keep-alive comments on idle streams
+        response = self._request("GET", "/email/events", timeout=(3.05, None), user_key=user_key,
+                                 headers=headers, stream=True)
+        with response:
+            data = []
+            for line in response.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line == "":
+                    if data:
+                        yield json.loads("\n".join(data))
+                    data = []
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif line.startswith(":"):
+                    yield {"type": "keep-alive"}
+
+    def _listener(self, user_key: str) -> "MailEventListener":
+        with self._listeners_lock:
+            listener = self._listeners.get(user_key)
+            if listener is None or not listener.is_alive():
+                listener = self._listeners[user_key] = MailEventListener(self, user_key)
+                listener.start()
+        listener.last_used = time.monotonic()
+        return listener
+
+    def mail_version(self, user_key: str) -> str:
+        """Return a token that changes whenever the user's event stream reports a change."""
+        return self._listener(user_key).version if user_key else ""
+
+    def mail_events(self, user_key: str) -> list[dict]:
+        """Return the recent events (new messages, label changes) seen for the user."""
+        return list(self._listener(user_key).events) if user_key else []
+
+    def semantic_search(self, query: str, k: int = 10) -> list[dict]:
+        """Indexed emails closest in meaning to the query, best first, each with a "score"."""
+        return self._request("GET", "/email/search", params={"q": query, "k": k}).json().get("results", [])
+
+    def get_drafts(self, message_id: str) -> list[dict]:
+        """Reply drafts the backend prepared in advance for a high-priority message."""
+        return self._request("GET", f"/email/{message_id}/drafts").json().get("drafts", [])
+
+    def stream_replies(self, message_id: str, tone: str = "Professional", instructions: str = "",
+                       sign_off: str = "Jerome", count: int = 1):
+        """Yield reply variations ({"index", "text"} or {"index", "error"}) as the backend finishes them."""
+        payload = {"tone": tone, "instructions": instructions, "signOff": sign_off, "count": count}
+        response = self._request("POST", f"/email/{message_id}/replies", json=payload,
+                                 timeout=ASSISTANT_TIMEOUT, stream=True)
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def mark_as_read(self, ids: list[str]) -> dict:
+        return self._request("POST", "/email/mark-as-read", json={"ids": ids}).json()
+
+    def send_email(self, to: str, subject: str, body: str,
+                   id: str | None = None, thread_id: str | None = None,
+                   idempotency_key: str | None = None) -> dict:
+        """Queue an email in the backend's outbox; returns the job's {"id", "status", ...}."""
+        payload = {"to": to, "subject": subject, "body": body}
+        if id and thread_id:
+            payload["id"] = id
+            payload["threadId"] = thread_id
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        return self._request("POST", "/email/send", json=payload, headers=headers).json()
+
+    def send_status(self, job_id: str) -> dict:
+        return self._request("GET", f"/email/send/{job_id}").json()
+
+    def wait_for_send(self, job_id: str, timeout: float = 10.0) -> dict:
+        """Poll a queued email until it is sent or failed, or `timeout` seconds have passed."""
+        deadline = time.monotonic() + timeout
+        status = self.send_status(job_id)
+        while status["status"] in ("queued", "sending") and time.monotonic() < deadline:
+            time.sleep(0.5)
+            status = self.send_status(job_id)
+        return status
+
+    # Calendar
+
+    def get_events(self, start: str | None = None, end: str | None = None,
+                   user_key: str | None = None) -> list[dict]:
+        params = {k: v for k, v in {"start": start, "end": end}.items() if v}
+        return self._get_json("/calendar/", params, user_key=user_key)
+
+    def add_event(self, summary: str, start: str, end: str, description: str = "",
+                  location: str | None = None) -> dict:
+        payload = {
+            "summary": summary,
+            "start": {"dateTime": start},
+            "end": {"dateTime": end},
+            "description": description,
+        }
+        if location:
+            payload["location"] = location
+        return self._request("POST", "/calendar/event", json=payload).json()
+
+    def suggest_slots(self, start: str, end: str, duration_minutes: int = 60, count: int = 3,
+                      preferred: str | None = None, time_zone: str = "Asia/Singapore",
+                      user_key: str | None = None) -> list[dict]:
+        """Free {"start", "end"} slots within working hours between start and end, closest to `preferred` first."""
+        payload = {"start": start, "end": end, "durationMinutes": duration_minutes, "count": count,
+                   "timeZone": time_zone}
+        if preferred:
+            payload["preferred"] = preferred
+        return self._request("POST", "/calendar/suggest-slots", json=payload,
+                             user_key=user_key).json().get("slots", [])
+
+    def calendar_version(self, user_key: str) -> str:
+        """Return the ETag of the user's last fetched event listing, which changes with their events."""
+        with self._validators_lock:
+            cached = self._validators.get((user_key, "/calendar/", ()))
+        return cached[0] if cached else ""
+
+    # Assistant
+
+    def chat(self, messages: str, system: str | None = None,
+             session_id: str | None = None) -> tuple[str, str | None]:
+        """Send one turn; pass the returned session id with the next turn to continue the conversation."""
+        payload = {"messages": messages, "system": system, "sessionId": session_id}
+        response = self._request("POST", "/assistant/chat", json=payload, timeout=ASSISTANT_TIMEOUT)
+        return response.text, response.headers.get("X-Session-Id")
+
+    def fit_emails(self, emails: list[dict], body_key: str = "raw", sender_key: str = "from",
+                   scores: list[float] | None = None, **fields: int) -> dict:
+        """
+        Fit emails into the backend's prompt token budget. Returns {"emails", "tokens",
+        "truncated", "dropped"}; the emails are shortened copies (same order, possibly
+        fewer) that keep all their other fields. `fields` overrides the per-field budgets
+        (subject, sender, bodyHead, bodyTail, bodyMin).
+        """
+        # Only the budgeted fields travel; the rest (dates, ids) are merged back here
+        payload = {
+            "emails": [{"index": i, "subject": e.get("subject") or "", sender_key: e.get(sender_key) or "",
+                        body_key: e.get(body_key) or ""} for i, e in enumerate(emails)],
+            "bodyKey": body_key, "senderKey": sender_key, "scores": scores, **fields,
+        }
+        fitted = self._request("POST", "/assistant/fit-emails", json=payload).json()
+        fitted["emails"] = [
+            {**emails[e["index"]], "subject": e["subject"], sender_key: e[sender_key], body_key: e[body_key]}
+            for e in fitted["emails"]
+        ]
+        return fitted
+
+    def truncate(self, text: str, head: int, tail: int = 0) -> str:
+        """Keep the first `head` and last `tail` tokens of a text, as the backend counts them."""
+        fitted = self.fit_emails([{"raw": text}], bodyHead=head, bodyTail=tail)
+        return fitted["emails"][0]["raw"]
+
+
+class MailEventListener(threading.Thread):
+    """
+    Follows one user's /email/events stream in the background. Every event bumps
+    `version`, which is part of the email cache key, so the next rerun refetches
+    (cheaply, via the backend's ETag) only after the mailbox actually changed.
+    """
+
+    def __init__(self, client: ApiClient, user_key: str):
+        super().__init__(daemon=True, name="mail-events")
+        self.client = client
+        self.user_key = user_key
+        self.version = ""
+        self.received = 0
+        self.events: deque[dict] = deque(maxlen=100)
+        self.last_used = time.monotonic()
+
+    def run(self):
+        last_event_id = None
+        delay = MAIL_RECONNECT_DELAY
+        while time.monotonic() - self.last_used < MAIL_LISTENER_IDLE:
+            # Until the stream names one, start from the listing the user already has, so the
+            # backend replays what changed since it was fetched
+            last_event_id = last_event_id or self.client.history_ids.get(self.user_key)
+            try:
+                for event in self.client.stream_events(self.user_key, last_event_id):
+                    if time.monotonic() - self.last_used >= MAIL_LISTENER_IDLE:
+                        return
+                    if event["type"] == "keep-alive":
+                        # The stream has been healthy for a while
+                        delay = MAIL_RECONNECT_DELAY
+                        continue
+                    last_event_id = event.get("historyId") or last_event_id
+                    if event["type"] != "ready":
+                        self.events.append(event)
+                        self.received += 1
+                        self.version = str(self.received)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code in (401, 403, 404):
+                    return
+            except requests.RequestException:
+                pass
+            # The stream ended, by an error or by the server (an error event, a shutdown);
+            # back off rather than reconnecting in a tight loop
+            time.sleep(delay)
+            delay = min(delay * 2, MAIL_RECONNECT_MAX_DELAY)
+
+
+@st.cache_resource
+def get_api_client() -> ApiClient:
+    """Return the process-wide API client (shared connection pool with keep-alive)."""
+    return ApiClient()
+
+
+# Cached reads. The user key is an explicit argument so that every user gets their own
+# cache entries; widgets that only change local state then rerun without refetching.
+
+@st.cache_data(ttl=EMAIL_CACHE_TTL, show_spinner=False)
+def _cached_emails(user_key: str, count: int, include_read: bool, keywords: tuple[str, ...],
+                   mail_version: str = "") -> list[dict]:
+    return get_api_client().get_emails(count, include_read, list(keywords) or None, user_key=user_key)
+
+
+def _with_date(email: dict) -> dict:
+    """The email with its ISO "date" parsed once here, so the views get a datetime (None if missing)."""
+    try:
+        date = datetime.fromisoformat(email["date"]) if email.get("date") else None
+    except (TypeError, ValueError):
+        date = None
+    return {**email, "date": date}
+
+
+@st.cache_data(ttl=CALENDAR_CACHE_TTL, show_spinner=False)
+def _cached_events(user_key: str, start: str | None, end: str | None) -> list[dict]:
+    return get_api_client().get_events(start, end, user_key=user_key)
+
+
+@st.cache_data(ttl=CALENDAR_CACHE_TTL, show_spinner=False)
+def _cached_slots(user_key: str, start: str, end: str, duration_minutes: int, preferred: str | None,
+                  calendar_version: str = "") -> list[dict]:
+    return get_api_client().suggest_slots(start, end, duration_minutes, preferred=preferred, user_key=user_key)
+
+
+def cached_emails(count: int = 10, include_read: bool = False,
+                  keywords: list[str] | None = None) -> list[dict]:
+    """
+    Return emails for the current user, reusing results younger than EMAIL_CACHE_TTL
+    unless the mail event stream reported a change in the meantime.
+    """
+    user_key = get_user_key()
+    return _cached_emails(user_key, count, include_read, tuple(keywords or ()),
+                          get_api_client().mail_version(user_key))
+
+
+def new_mail_events() -> list[dict]:
+    """Return the recent mail events (new messages, label changes) seen for the current user."""
+    return get_api_client().mail_events(get_user_key())
+
+
+def cached_events(start: str | None = None, end: str | None = None) -> list[dict]:
+    """Return calendar events for the current user, reusing results younger than CALENDAR_CACHE_TTL."""
+    return _cached_events(get_user_key(), start, end)
+
+
+def cached_slots(start: str, end: str, duration_minutes: int, preferred: str | None = None) -> list[dict]:
+    """
+    Return free slots for the current user, reusing them across reruns until the user's
+    calendar listing changes (or CALENDAR_CACHE_TTL passes).
+    """
+    user_key = get_user_key()
+    return _cached_slots(user_key, start, end, duration_minutes, preferred,
+                         get_api_client().calendar_version(user_key))
+
+
+def invalidate_emails(count: int = 10, include_read: bool = False, keywords: list[str] | None = None):
+    """Drop the current user's cached email list, e.g. after marking messages as read."""
+    user_key = get_user_key()
+    _cached_emails.clear(user_key, count, include_read, tuple(keywords or ()),
+                         get_api_client().mail_version(user_key))
+
+
+def invalidate_events(start: str | None = None, end: str | None = None):
+    """Drop the current user's cached events, e.g. after adding an event."""
+    _cached_events.clear(get_user_key(), start, end)
@@ -6,16 +6,14 @@ import os
 import re
 import ast
 from datetime import datetime, timedelta, timezone
-import requests
 from langchain_google_genai import ChatGoogleGenerativeAI
-from urllib.parse import unquote
+
+from api_client import cached_emails, cached_events, cached_slots, get_api_client, invalidate_events
 
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 
-ip_address = os.getenv("IP_ADDRESS", "localhost")  # default fallback to localhost
-
 # Fallback to session_state if not found in .env
 if not GOOGLE_API_KEY:
     GOOGLE_API_KEY = st.session_state.get("google_api_key")
@@ -31,14 +29,21 @@ if not GOOGLE_API_KEY:
 if "added_events" not in st.session_state:
     st.session_state.added_events = set()
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash-001",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    google_api_key=GOOGLE_API_KEY,
-)
+
+
+@st.cache_resource
+def get_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-001",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        google_api_key=api_key,
+    )
+
+
+llm = get_llm(GOOGLE_API_KEY)
 
 st.set_page_config(page_title="Calendar Sync", page_icon="📅")
 st.title("📅 Calendar Sync")
@@ -46,12 +51,7 @@ st.title("📅 Calendar Sync")
 info_container = st.empty()
 info_container.info("📌 Analyzing emails from API using LLM to detect calendar events.")
 
-# Endpoints
-CALENDAR_API_URL = (
-    f"http://{ip_address}:8101/calendar/event"  # Used for both GET and POST
-)
-EMAIL_API_URL = f"http://{ip_address}:8101/email"  # Endpoint to fetch emails
-events_URL = f"http://{ip_address}:8101/calendar"  # GET endpoint to fetch existing Google Calendar events
+api = get_api_client()
 
 # Load or update embed_url
 calendar_json_path = "calendar.json"
@@ -103,30 +103,10 @@ else:
     )
 
 
-def get_all_cookies():
-    """Return cookies as a dictionary using st.context.headers."""
-    headers = st.context.headers
-    if headers is None or "cookie" not in headers:
-        return {}
-    cookie_string = headers["cookie"]
-    cookie_kv_pairs = cookie_string.split(";")
-    cookie_dict = {}
-    for kv in cookie_kv_pairs:
-        if "=" in kv:
-            key, value = kv.split("=", 1)
-            cookie_dict[key.strip()] = unquote(value.strip())
-    return cookie_dict
-
-
 def fetch_emails():
-    """Fetch emails from the API endpoint."""
+    """Fetch emails from the API endpoint (cached per user)."""
     try:
-        cookies = get_all_cookies()
-        cookies_request = {"key": cookies.get("key", "")}
-        response = requests.get(EMAIL_API_URL, cookies=cookies_request)
-        response.raise_for_status()
-        data = response.json()
-        emails_data = data.get("message", [])
+        emails_data = cached_emails()
     except Exception as e:
         st.error(f"Failed to fetch emails from API: {e}")
         return []
@@ -138,15 +118,8 @@ def fetch_emails():
         subject = email.get("subject", "No Subject")
         raw = email.get("raw", "")
         thread_id = email.get("threadId", "")
-        date_str = email.get("date", None)
-        try:
-            date_obj = (
-                datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S%z")
-                if date_str
-                else datetime.now()
-            )
-        except Exception:
-            date_obj = datetime.now()
+        # api_client parses the date
+        date_obj = email.get("date") or datetime.now()
         email_id = email.get("id", str(date_obj.timestamp()))
         processed_emails.append(
             {
@@ -155,7 +128,7 @@ def fetch_emails():
                 "from": sender,
                 "raw": raw,
                 "threadId": thread_id,
-                "priority": (
+                "priority": email.get("priority") or (
                     "High" if "IMPORTANT" in email.get("labelIds", []) else "Low"
                 ),
                 "date": date_obj,
@@ -170,35 +143,23 @@ def fetch_emails():
 
 def get_existing_events():
     """
-    Fetch existing Google Calendar events from the calendar API using cookies.
+    Fetch existing Google Calendar events through the shared API client (cached per user).
     The endpoint returns events in JSON format with ISO datetime strings.
     """
-    cookies = get_all_cookies()
-    cookies_request = {"key": cookies.get("key", "")}
     try:
-        response = requests.get(events_URL, cookies=cookies_request)
-
-        response.raise_for_status()
-        return response.json()
+        return cached_events()
     except Exception as e:
         st.error(f"Error fetching existing events: {e}")
         return []
 
 
-def extract_event_from_email_llm(email):
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def _extract_event(email_id: str, subject: str, body: str, today_str: str) -> dict:
     """
-    Use the LLM to extract calendar event details from an email.
-
-    The prompt instructs the LLM to return a JSON object with:
-    - "title": the event title,
-    - "date_time": the event date and time in "YYYY-MM-DD HH:MM" format,
-    - "description": a brief description of the event.
-
-    If no event is detected, output an empty JSON object: {}.
+    Cached LLM extraction, keyed by the email itself so reruns never re-ask the LLM (nor
+    the backend to shorten the body). Errors propagate (and are therefore not cached).
     """
-    subject = email.get("subject", "")
-    body = email.get("raw", "")
-    today_str = datetime.now().strftime("%Y-%m-%d")
+    body = api.truncate(body, 600, 200)
     prompt = f"""
 You are an assistant that extracts calendar event details from emails.
 Today is {today_str}. Use this information to correctly infer the event year when only the month and day are provided.
@@ -221,24 +182,152 @@ Example output:
 
 Only output the JSON object.
 """
+    response = llm.invoke(prompt)
+
+    output = response.content.strip()
+    output = re.sub(r"```(?:json|python)?", "", output).strip("` \n")
     try:
-        response = llm.invoke(prompt)
+        event_data = json.loads(output)
+    except Exception:
+        event_data = ast.literal_eval(output)
+    if isinstance(event_data, dict):
+        return event_data
+    else:
+        return {}
 
-        output = response.content.strip()
-        output = re.sub(r"```(?:json|python)?", "", output).strip("` \n")
-        try:
-            event_data = json.loads(output)
-        except Exception:
-            event_data = ast.literal_eval(output)
-        if isinstance(event_data, dict):
-            return event_data
-        else:
-            return {}
+
+def extract_event_from_email_llm(email):
+    """
+    Use the LLM to extract calendar event details from an email.
+
+    The prompt instructs the LLM to return a JSON object with:
+    - "title": the event title,
+    - "date_time": the event date and time in "YYYY-MM-DD HH:MM" format,
+    - "description": a brief description of the event.
+
+    If no event is detected, output an empty JSON object: {}.
+    """
+    try:
+        return dict(_extract_event(
+            email.get("id", ""),
+            email.get("subject", ""),
+            email.get("raw") or "",
+            datetime.now().strftime("%Y-%m-%d"),
+        ))
     except Exception as e:
         st.error(f"LLM extraction error: {e}")
         return {}
 
 
+def find_collision(start_time, end_time, existing_events):
+    """Return the first existing event overlapping [start_time, end_time), with its bounds."""
+    for existing in existing_events:
+        try:
+            existing_start = datetime.fromisoformat(existing["start"]["dateTime"])
+            existing_end = datetime.fromisoformat(existing["end"]["dateTime"])
+        except Exception:
+            continue
+        # Check if the new event overlaps with an existing event.
+        if start_time < existing_end and end_time > existing_start:
+            return existing, existing_start, existing_end
+    return None
+
+
+@st.fragment
+def render_detected_event(event):
+    """
+    Renders one detected event card. Runs as a fragment so that its widgets only rerun
+    this card; adding an event reruns the whole page, as it changes the other cards' collisions.
+    """
+    # The LLM date is now timezone-aware in Asia/Singapore.
+    start_time = event["date_time"]
+    end_time = start_time + timedelta(hours=1)
+
+    if event["unique_id"] in st.session_state.added_events:
+        st.success(f"Event '{event.get('title', '')}' added to Google Calendar!")
+        return
+
+    collision = find_collision(start_time, end_time, get_existing_events())
+    collision_message = ""
+    if collision:
+        existing, existing_start, existing_end = collision
+        collision_message = (
+            f"Collision with '{existing.get('summary', 'Unnamed event')}' "
+            f"from {existing_start.strftime('%Y-%m-%d %H:%M')} to {existing_end.strftime('%Y-%m-%d %H:%M')}."
+        )
+
+    with st.container():
+        st.markdown(
+            f"""
+            <div style='border: 1px solid #ddd; padding: 15px; margin-bottom: 15px;
+                        border-radius: 8px; background-color: #f9f9f9;'>
+                <h4 style='margin-bottom: 10px;'>{event.get("title", "")}</h4>
+                <p style='margin: 5px 0;'><strong>Date & Time:</strong> {start_time.strftime("%A, %B %d, %Y %I:%M %p")}</p>
+                <p style='margin: 5px 0;'><strong>Description:</strong> {event.get("description", "")}</p>
+                <p style='margin: 5px 0; color: {"red" if collision else "green"};'>
+                    {"Collision detected: " + collision_message if collision else "No conflict detected."}
+                </p>
+            </div>
+            """,
+            unsafe_allow_html=True,
+        )
+        if collision:
+            # Offer the free slots closest to the requested time instead
+            for slot in suggest_alternatives(start_time, end_time):
+                slot_start = datetime.fromisoformat(slot["start"])
+                slot_end = datetime.fromisoformat(slot["end"])
+                if st.button(f"Add at {slot_start.strftime('%a, %b %d %I:%M %p')} instead",
+                             key=f"{event.get('unique_id')}_{slot['start']}"):
+                    add_to_calendar(event, slot_start, slot_end)
+            return
+        if st.button("Add to Google Calendar", key=event.get("unique_id")):
+            add_to_calendar(event, start_time, end_time)
+
+
+def suggest_alternatives(start_time, end_time, days: int = 7):
+    """Free slots of the event's length in the week from its day, closest to the requested time first."""
+    window_start = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    try:
+        # Cached per event and calendar version, so reruns of the card do not ask again
+        return cached_slots(
+            start=window_start.isoformat(),
+            end=(window_start + timedelta(days=days)).isoformat(),
+            duration_minutes=int((end_time - start_time).total_seconds() // 60),
+            preferred=start_time.isoformat(),
+        )
+    except Exception as e:
+        st.warning(f"Could not look up free slots: {e}")
+        return []
+
+
+def add_to_calendar(event, start_time, end_time):
+    # Re-check collision against fresh events before adding.
+    invalidate_events()
+    collision = find_collision(start_time, end_time, get_existing_events())
+    if collision:
+        existing, existing_start, existing_end = collision
+        st.error(
+            f"There is a collision with '{existing.get('summary', 'Unnamed event')}' "
+            f"from {existing_start.strftime('%Y-%m-%d %H:%M')} to {existing_end.strftime('%Y-%m-%d %H:%M')}."
+        )
+        return
+    try:
+        api.add_event(
+            summary=event.get("title", ""),
+            start=start_time.isoformat(),
+            end=end_time.isoformat(),
+            description=event.get("description", ""),
+        )
+        # Add this event to the set of added events
+        st.session_state.added_events.add(event["unique_id"])
+        invalidate_events()
+        # A full rerun, so every card re-checks its collisions against the new event; the
+        # emails and the LLM extraction come from their caches
+        st.rerun()
+    except Exception as e:
+        st.error(f"Error adding event: {e}")
+
+
 # Process emails from the API
 emails = fetch_emails()
 detected_events = []
@@ -262,112 +351,12 @@ for email in emails:
 
 info_container.empty()
 
-# Fetch existing calendar events immediately for collision detection.
-existing_events = get_existing_events()
-
 if not detected_events:
     st.info("No new events detected from emails.")
 else:
     st.markdown("### Detected Events")
-    events_to_remove = []  # Track events that get added during this session
-
     for event in detected_events:
-        # The LLM date is now timezone-aware in Asia/Singapore.
-        start_time = event["date_time"]
-        end_time = start_time + timedelta(hours=1)
-
-        collision_found = False
-        collision_message = ""
-        for existing in existing_events:
-            try:
-                existing_start = datetime.fromisoformat(existing["start"]["dateTime"])
-                existing_end = datetime.fromisoformat(existing["end"]["dateTime"])
-            except Exception:
-                continue
-            # Check if the new event overlaps with an existing event.
-            if start_time < existing_end and end_time > existing_start:
-                collision_found = True
-                collision_message = (
-                    f"Collision with '{existing.get('summary', 'Unnamed event')}' "
-                    f"from {existing_start.strftime('%Y-%m-%d %H:%M')} to {existing_end.strftime('%Y-%m-%d %H:%M')}."
-                )
-                break
-
-        with st.container():
-            st.markdown(
-                f"""
-                <div style='border: 1px solid #ddd; padding: 15px; margin-bottom: 15px;
-                            border-radius: 8px; background-color: #f9f9f9;'>
-                    <h4 style='margin-bottom: 10px;'>{event.get("title", "")}</h4>
-                    <p style='margin: 5px 0;'><strong>Date & Time:</strong> {start_time.strftime("%A, %B %d, %Y %I:%M %p")}</p>
-                    <p style='margin: 5px 0;'><strong>Description:</strong> {event.get("description", "")}</p>
-                    <p style='margin: 5px 0; color: {"red" if collision_found else "green"};'>
-                        {"Collision detected: " + collision_message if collision_found else "No conflict detected."}
-                    </p>
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
-            # Only show the "Add to Google Calendar" button if no collision is detected.
-            if not collision_found:
-                if st.button("Add to Google Calendar", key=event.get("unique_id")):
-                    # Re-check collision before adding.
-                    collision_found = False
-                    for existing in existing_events:
-                        try:
-                            existing_start = datetime.fromisoformat(
-                                existing["start"]["dateTime"]
-                            )
-                            existing_end = datetime.fromisoformat(
-                                existing["end"]["dateTime"]
-                            )
-                        except Exception:
-                            continue
-                        if start_time < existing_end and end_time > existing_start:
-                            collision_found = True
-                            collision_message = (
-                                f"There is a collision with '{existing.get('summary', 'Unnamed event')}' "
-                                f"from {existing_start.strftime('%Y-%m-%d %H:%M')} to {existing_end.strftime('%Y-%m-%d %H:%M')}."
-                            )
-                            break
-
-                    if collision_found:
-                        st.error(collision_message)
-                    else:
-                        payload = {
-                            "summary": event.get("title", ""),
-                            "start": {"dateTime": start_time.isoformat()},
-                            "end": {"dateTime": end_time.isoformat()},
-                            "description": event.get("description", ""),
-                        }
-                        cookies = get_all_cookies()
-                        cookies_request = {"key": cookies.get("key", "")}
-                        try:
-                            response = requests.post(
-                                CALENDAR_API_URL, json=payload, cookies=cookies_request
-                            )
-                            response.raise_for_status()
-                            st.success(
-                                f"Event '{event.get('title', '')}' added to Google Calendar!"
-                            )
-
-                            # Add this event to the set of added events
-                            st.session_state.added_events.add(event["unique_id"])
-                            events_to_remove.append(event["unique_id"])
-
-                            # Optionally, update existing_events to include the new event.
-                            new_event = {
-                                "start": {"dateTime": start_time.isoformat()},
-                                "end": {"dateTime": end_time.isoformat()},
-                                "summary": event.get("title", ""),
-                            }
-                            existing_events.append(new_event)
-                        except Exception as e:
-                            st.error(f"Error adding event: {e}")
-
-    # Trigger a rerun to refresh the UI and remove added events
-    if events_to_remove:
-        st.rerun()
+        render_detected_event(event)
 
 st.markdown("---")
 st.markdown("### My Google Calendar")
@@ -1,15 +1,14 @@
 import streamlit as st
-import requests
 from datetime import datetime
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 import os
-from urllib.parse import unquote
+
+from api_client import cached_emails, get_api_client, invalidate_emails, new_mail_events
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-ip_address = os.getenv("IP_ADDRESS", "localhost")  # default fallback to localhost
 
 # Fallback to session_state if not found in .env
 if not GOOGLE_API_KEY:
@@ -22,48 +21,32 @@ if not GOOGLE_API_KEY:
     )
     st.stop()
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash-001",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    google_api_key=GOOGLE_API_KEY,
-)
 
-st.set_page_config(page_title="Inbox Summary", page_icon="📨")
-st.title("📨 Inbox Summary")
 
+@st.cache_resource
+def get_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-001",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        google_api_key=api_key,
+    )
 
-# Function to retrieve cookies from Streamlit context
-def get_all_cookies():
-    headers = st.context.headers
-    if headers is None or "cookie" not in headers:
-        return {}
 
-    cookie_string = headers["cookie"]
-    cookie_kv_pairs = cookie_string.split(";")
-    cookie_dict = {}
-    for kv in cookie_kv_pairs:
-        if "=" in kv:
-            key, value = kv.split("=", 1)
-            cookie_dict[key.strip()] = unquote(value.strip())
-    return cookie_dict
+llm = get_llm(GOOGLE_API_KEY)
 
+st.set_page_config(page_title="Inbox Summary", page_icon="📨")
+st.title("📨 Inbox Summary")
 
-# Function to fetch emails via API using cookies
-def fetch_emails():
-    try:
-        cookies = get_all_cookies()
-        cookies_request = {"key": cookies.get("key", "")}
-        response = requests.get(
-            f"http://{ip_address}:8101/email", cookies=cookies_request
-        )
-        response.raise_for_status()
-        data = response.json()
+api = get_api_client()
 
-        emails_data = data.get("message", [])
 
+# Function to fetch emails via the shared API client (cached per user)
+def fetch_emails():
+    try:
+        emails_data = cached_emails()
     except Exception as e:
         st.error(f"Failed to fetch emails from API: {e}")
         return []
@@ -75,17 +58,9 @@ def fetch_emails():
         sender = email.get("from", "Unknown Sender")
         subject = email.get("subject", "No Subject")
         raw = email.get("raw", "")
-        date_str = email.get("date", None)
-
-        try:
-            date_obj = (
-                datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S%z")
-                if date_str
-                else datetime.now()
-            )
-        except Exception:
-            date_obj = datetime.now()
 
+        # api_client parses the date
+        date_obj = email.get("date") or datetime.now()
         email_id = email.get("id", str(date_obj.timestamp()))
 
         processed_emails.append(
@@ -94,9 +69,13 @@ def fetch_emails():
                 "subject": subject,
                 "sender": sender,
                 "summary": raw,
-                "priority": (
+                "priority": email.get("priority") or (
                     "High" if "IMPORTANT" in email.get("labelIds", []) else "Low"
                 ),
+                # The backend's priority score; emails without one rank by their label
+                "priorityScore": email.get("priorityScore") if email.get("priorityScore") is not None else (
+                    1.0 if "IMPORTANT" in email.get("labelIds", []) else 0.0
+                ),
                 "date": date_obj,
             }
         )
@@ -116,30 +95,19 @@ def mark_emails_as_read():
         st.warning("No unread emails to mark as read.")
         return
 
-    payload = {"ids": unread_ids}
-    cookies = get_all_cookies()
-    cookies_request = {"key": cookies.get("key", "")}
-
     try:
-        response = requests.post(
-            f"http://{ip_address}:8101/email/mark-as-read",
-            json=payload,
-            cookies=cookies_request,
-        )
-        response.raise_for_status()
+        api.mark_as_read(unread_ids)
         st.success("✅ Unread emails marked as read.")
         # Optionally clear unread state
         st.session_state["unread_email"] = []
+        invalidate_emails()
     except Exception as e:
         st.error(f"❌ Failed to mark emails as read: {e}")
 
 
-# Summarize emails using LLM
-def summarize_emails(emails):
-    email_contents = ""
-    for email in emails:
-        email_contents += f"From: {email['sender']}\nSubject: {email['subject']}\nSummary: {email['summary']}\n\n"
-
+# Summarize emails using LLM; cached on the email contents so reruns reuse the summary
+@st.cache_data(ttl=10 * 60, show_spinner=False)
+def _summarize(email_contents: str) -> str:
     prompt = f"""
         You are a thoughtful assistant analyzing a user's inbox. Below are the contents of recent emails:
 
@@ -162,11 +130,26 @@ def summarize_emails(emails):
         Present your output in a clear, concise format (e.g., bullet points or short sections) suitable for a busy user skimming for insight.
     """
 
+    prompt_template = ChatPromptTemplate.from_template(prompt)
+    chain = prompt_template | llm
+    response = chain.invoke({})
+    return response.content
+
+
+def summarize_emails(emails):
     try:
-        prompt_template = ChatPromptTemplate.from_template(prompt)
-        chain = prompt_template | llm
-        response = chain.invoke({})
-        return response.content
+        fitted = api.fit_emails(emails, body_key="summary", sender_key="sender",
+                                scores=[email["priorityScore"] for email in emails])
+    except Exception as e:
+        return f"Error generating summary: {e}"
+    emails = fitted["emails"]
+    st.caption(f"Prompt uses ~{fitted['tokens']} tokens for {len(emails)} emails"
+               + (f" ({fitted['dropped']} left out)" if fitted["dropped"] else ""))
+    email_contents = ""
+    for email in emails:
+        email_contents += f"From: {email['sender']}\nSubject: {email['subject']}\nSummary: {email['summary']}\n\n"
+    try:
+        return _summarize(email_contents)
     except Exception as e:
         return f"Error generating summary: {e}"
 
@@ -175,16 +158,44 @@ def summarize_emails(emails):
 if "emails" not in st.session_state:
     st.session_state["emails"] = fetch_emails()
     st.session_state["last_fetch_time"] = datetime.now()
+    st.session_state["seen_history_id"] = max(
+        (int(e.get("historyId") or 0) for e in new_mail_events()), default=0)
+
+
+@st.fragment(run_every=15)
+def new_mail_notice():
+    """Checks the locally buffered mail events; never calls the backend for the list itself."""
+    events = new_mail_events()
+    seen = st.session_state.get("seen_history_id", 0)
+    unseen = [e for e in events if int(e.get("historyId") or 0) > seen]
+    arrived = sum(1 for e in unseen if e.get("type") == "messageAdded" and "INBOX" in e.get("labelIds", []))
+    if not arrived:
+        return
+    if st.button(f"📬 {arrived} new email(s) — refresh"):
+        st.session_state["emails"] = fetch_emails()
+        st.session_state["last_fetch_time"] = datetime.now()
+        st.session_state["seen_history_id"] = max(int(e.get("historyId") or 0) for e in unseen)
+        st.rerun()
+
+
+new_mail_notice()
 
 st.markdown("---")
 st.subheader("📜 AI-Generated Inbox Summary")
 
-if st.button("📄 Generate Summary with LLM"):
-    with st.spinner("Summarizing emails..."):
-        summary = summarize_emails(st.session_state["emails"])
-    with st.expander("📖 View Full Summary", expanded=True):
-        st.markdown(summary)
 
-if st.button("✅ Mark All as Read"):
-    with st.spinner("Marking emails as read..."):
-        mark_emails_as_read()
+@st.fragment
+def summary_actions():
+    """Buttons rerun only this fragment, not the page's email fetch."""
+    if st.button("📄 Generate Summary with LLM"):
+        with st.spinner("Summarizing emails..."):
+            summary = summarize_emails(st.session_state["emails"])
+        with st.expander("📖 View Full Summary", expanded=True):
+            st.markdown(summary)
+
+    if st.button("✅ Mark All as Read"):
+        with st.spinner("Marking emails as read..."):
+            mark_emails_as_read()
+
+
+summary_actions()
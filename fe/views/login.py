@@ -1,8 +1,9 @@
 import streamlit as st
 from streamlit_javascript import st_javascript
-import os
 from dotenv import load_dotenv
 
+from api_client import API_BASE_URL, get_all_cookies
+
 load_dotenv()
 # Page config
 st.set_page_config(page_title="Login", page_icon="🔐", layout="centered")
@@ -11,37 +12,12 @@ st.set_page_config(page_title="Login", page_icon="🔐", layout="centered")
 st.sidebar.header("🔑 Google API Configuration")
 api_key_input = st.sidebar.text_input("Enter your Google API Key", type="password")
 
-# default fallback to localhost
-ip_address = os.getenv("IP_ADDRESS", "localhost")
-
 # Store the API key in session state
 if api_key_input:
     st.session_state["google_api_key"] = api_key_input
     st.sidebar.success("API Key saved in session.")
 
 
-def get_all_cookies():
-    """
-    Returns the cookies as a dictionary using st.context.headers.
-    """
-    from urllib.parse import unquote
-
-    # Use st.context.headers instead of _get_websocket_headers
-    headers = st.context.headers
-    # Ensure the cookie header exists (note: header keys are often lowercase)
-    if headers is None or "cookie" not in headers:
-        return {}
-
-    cookie_string = headers["cookie"]
-    cookie_kv_pairs = cookie_string.split(";")
-    cookie_dict = {}
-    for kv in cookie_kv_pairs:
-        if "=" in kv:
-            key, value = kv.split("=", 1)
-            cookie_dict[key.strip()] = unquote(value.strip())
-    return cookie_dict
-
-
 # Styling (optional: adjust padding as needed)
 st.markdown(
     """
@@ -81,7 +57,7 @@ login = st.button(
     "🔐 Login", key="login", help="Click to log in", use_container_width=True
 )
 
-login_url = f"http://{ip_address}:8101/auth/login"
+login_url = f"{API_BASE_URL}/auth/login"
 
 if login:
     st.markdown(
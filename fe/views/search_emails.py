@@ -5,16 +5,15 @@ import pandas as pd
 import ast
 import re
 import os
-import requests
 from datetime import date
-from urllib.parse import quote_plus, unquote
 from langchain_community.chat_models import ChatOllama
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+from api_client import cached_emails, get_api_client
+
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-ip_address = os.getenv("IP_ADDRESS", "localhost")  # default fallback to localhost
 
 # Fallback to session_state if not found in .env
 if not GOOGLE_API_KEY:
@@ -27,35 +26,31 @@ if not GOOGLE_API_KEY:
     )
     st.stop()
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash-001",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    google_api_key=GOOGLE_API_KEY,
-)
+
+
+@st.cache_resource
+def get_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-001",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        google_api_key=api_key,
+    )
+
+
+llm = get_llm(GOOGLE_API_KEY)
 
 # Set up Streamlit page
 st.set_page_config(page_title="Search Emails", page_icon="🔍")
 st.title("🔍 Search Emails")
 
 
-def get_all_cookies():
-    """
-    Returns the cookies as a dictionary using st.context.headers.
-    """
-    headers = st.context.headers  # Use st.context.headers as per your reference
-    if headers is None or "cookie" not in headers:
-        return {}
-    cookie_string = headers["cookie"]
-    cookie_kv_pairs = cookie_string.split(";")
-    cookie_dict = {}
-    for kv in cookie_kv_pairs:
-        if "=" in kv:
-            key, value = kv.split("=", 1)
-            cookie_dict[key.strip()] = unquote(value.strip())
-    return cookie_dict
+@st.cache_data(ttl=10 * 60, show_spinner=False)
+def ask_llm(prompt: str) -> str:
+    """Invoke the LLM, reusing the answer when the same prompt is asked again."""
+    return llm.invoke(prompt).content
 
 
 def generate_keywords(query):
@@ -69,8 +64,7 @@ Return the keywords as a comma-separated list.
 User Query: "{query}"
 """
     try:
-        response = llm.invoke(prompt)
-        keywords_str = response.content.strip()
+        keywords_str = ask_llm(prompt).strip()
         # Split by comma and filter out empty strings
         keywords_list = [kw.strip() for kw in keywords_str.split(",") if kw.strip()]
         return keywords_list
@@ -81,28 +75,22 @@ User Query: "{query}"
 
 def fetch_emails(query):
     """
-    Generates keywords from the query and builds the API URL.
-    Calls the email API with cookies and returns the email data.
+    Generates keywords from the query and calls the email API with them.
+    Returns the keyword matches followed by related emails from the semantic index.
     """
     keywords = generate_keywords(query)
-    base_url = f"http://{ip_address}:8101/email?includeRead=true"
-    for kw in keywords:
-        base_url += f"&q={quote_plus(kw)}"
-    cookies = get_all_cookies()
-    cookies_request = {"key": cookies.get("key", "")}
     try:
-        response = requests.get(base_url, cookies=cookies_request)
-        response.raise_for_status()
-        data = response.json()
-        # The API returns a dict with a 'message' key containing the email array; fallback if not present.
-        if isinstance(data, dict) and "message" in data:
-            emails = data["message"]
-        else:
-            emails = data
-        return emails
+        emails = cached_emails(include_read=True, keywords=keywords)
     except Exception as e:
         st.error(f"Failed to fetch emails from API: {e}")
         return []
+    # Related emails that do not contain the keywords, from the backend's local index
+    try:
+        hits = get_api_client().semantic_search(query)
+    except Exception:
+        hits = []
+    seen = {email["id"] for email in emails}
+    return emails + [hit for hit in hits if hit["id"] not in seen]
 
 
 def search_emails_llm(
@@ -119,10 +107,18 @@ def search_emails_llm(
     if not emails:
         return "No emails match your query.", "[]"
 
+    try:
+        fitted = get_api_client().fit_emails(emails)
+    except Exception as e:
+        return f"Could not prepare the search prompt: {e}", "[]"
+    emails = fitted["emails"]
+    st.caption(f"Prompt uses ~{fitted['tokens']} tokens for {len(emails)} emails"
+               + (f" ({fitted['dropped']} left out)" if fitted["dropped"] else ""))
+
     for i, email in enumerate(emails):
         from_field = email.get("from", "Unknown Sender")
         subject = email.get("subject", "No Subject")
-        date_str = email.get("date", "Unknown")
+        date_str = email.get("date") or "Unknown"
         content = email.get("raw")
         if content is None:
             content = email.get("snippet", "No content available.")
@@ -176,8 +172,7 @@ Filters:
 - Keywords: {keywords or "None"}
 """
     try:
-        response = llm.invoke(prompt)
-        output = response.content.strip()
+        output = ask_llm(prompt).strip()
         # For debugging, you could uncomment the next line to see the raw output.
         # st.write("LLM Raw Output:", output)
 
@@ -201,58 +196,64 @@ Filters:
         return f"Error during LLM search: {e}", "[]"
 
 
-# UI inputs
-query = st.text_input(
-    "Ask a question or search your emails:",
-    placeholder="e.g. What did John say about the quarterly report?",
-)
+@st.fragment
+def search_panel():
+    """Typing in the filters or searching reruns only this panel."""
+    # UI inputs
+    query = st.text_input(
+        "Ask a question or search your emails:",
+        placeholder="e.g. What did John say about the quarterly report?",
+    )
 
-with st.expander("🔧 Advanced Filters"):
-    col1, col2 = st.columns(2)
-    with col1:
-        sender = st.text_input("Sender", placeholder="e.g. john@company.com")
-        sentiment = st.selectbox(
-            "Sentiment", ["Any", "Positive", "Neutral", "Negative"]
-        )
-    with col2:
-        start_date = st.date_input("Start Date", value=None)
-        end_date = st.date_input("End Date", value=None)
-    keywords = st.text_input("Keywords", placeholder="e.g. budget, deadline, proposal")
-
-# Search action
-if st.button("Search"):
-    st.markdown("---")
-    st.subheader("📬 Search Results")
-    with st.spinner("Querying your inbox..."):
-        emails = fetch_emails(query)
-        summary_text, json_output = search_emails_llm(
-            emails=emails,
-            query=query,
-            sender=sender if sender else None,
-            sentiment=sentiment if sentiment != "Any" else None,
-            start_date=start_date if start_date else None,
-            end_date=end_date if end_date else None,
-            keywords=keywords if keywords else None,
-        )
-    # Display the natural language summary.
-    st.markdown(summary_text)
-
-    # Provide an expander for the table view of the JSON emails.
-    with st.expander("Show detailed emails (table view)"):
-        try:
-            # Attempt to parse the JSON portion into a Python list.
-            parsed_data = ast.literal_eval(json_output)
-            if isinstance(parsed_data, list) and all(
-                isinstance(item, dict) for item in parsed_data
-            ):
-                df = pd.DataFrame(parsed_data)
-                st.table(df)
-            else:
-                st.warning("Unexpected data format in JSON output.")
+    with st.expander("🔧 Advanced Filters"):
+        col1, col2 = st.columns(2)
+        with col1:
+            sender = st.text_input("Sender", placeholder="e.g. john@company.com")
+            sentiment = st.selectbox(
+                "Sentiment", ["Any", "Positive", "Neutral", "Negative"]
+            )
+        with col2:
+            start_date = st.date_input("Start Date", value=None)
+            end_date = st.date_input("End Date", value=None)
+        keywords = st.text_input("Keywords", placeholder="e.g. budget, deadline, proposal")
+
+    # Search action
+    if st.button("Search"):
+        st.markdown("---")
+        st.subheader("📬 Search Results")
+        with st.spinner("Querying your inbox..."):
+            emails = fetch_emails(query)
+            summary_text, json_output = search_emails_llm(
+                emails=emails,
+                query=query,
+                sender=sender if sender else None,
+                sentiment=sentiment if sentiment != "Any" else None,
+                start_date=start_date if start_date else None,
+                end_date=end_date if end_date else None,
+                keywords=keywords if keywords else None,
+            )
+        # Display the natural language summary.
+        st.markdown(summary_text)
+
+        # Provide an expander for the table view of the JSON emails.
+        with st.expander("Show detailed emails (table view)"):
+            try:
+                # Attempt to parse the JSON portion into a Python list.
+                parsed_data = ast.literal_eval(json_output)
+                if isinstance(parsed_data, list) and all(
+                    isinstance(item, dict) for item in parsed_data
+                ):
+                    df = pd.DataFrame(parsed_data)
+                    st.table(df)
+                else:
+                    st.warning("Unexpected data format in JSON output.")
+                    st.markdown(f"```markdown\n{json_output}\n```")
+            except Exception as e:
+                st.warning(f"Error parsing JSON output: {e}")
                 st.markdown(f"```markdown\n{json_output}\n```")
-        except Exception as e:
-            st.warning(f"Error parsing JSON output: {e}")
-            st.markdown(f"```markdown\n{json_output}\n```")
+
+
+search_panel()
 
 st.markdown("---")
 st.caption(
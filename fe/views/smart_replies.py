@@ -1,7 +1,9 @@
 import requests
 import streamlit as st
+import hashlib
 import json
 import re
+import uuid
 from langchain_community.chat_models import ChatOllama
 from datetime import datetime
 import os
@@ -9,6 +11,8 @@ from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from email.utils import parseaddr
 
+from api_client import cached_emails, get_api_client
+
 # Load environment variables
 dotenv_path = os.getenv("DOTENV_PATH", None)
 if dotenv_path:
@@ -17,8 +21,6 @@ else:
     load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
-ip_address = os.getenv("IP_ADDRESS", "localhost")  # default fallback
-EMAIL_API_URL = f"http://{ip_address}:8101/email"  # Endpoint to fetch emails
 
 # Fallback to session_state for API key
 if not GOOGLE_API_KEY:
@@ -29,15 +31,22 @@ if not GOOGLE_API_KEY:
     )
     st.stop()
 
+
+
 # Initialize LLM
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash-001",
-    temperature=0,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    google_api_key=GOOGLE_API_KEY,
-)
+@st.cache_resource
+def get_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-001",
+        temperature=0,
+        max_tokens=None,
+        timeout=None,
+        max_retries=2,
+        google_api_key=api_key,
+    )
+
+
+llm = get_llm(GOOGLE_API_KEY)
 
 # Page config
 st.set_page_config(page_title="Smart Replies", page_icon="✉️")
@@ -49,30 +58,18 @@ if "generated_variations" not in st.session_state:
 if "generated_compose_variations" not in st.session_state:
     st.session_state.generated_compose_variations = None
 
+api = get_api_client()
 
-def get_all_cookies():
-    from urllib.parse import unquote
 
-    headers = st.context.headers
-    if headers is None or "cookie" not in headers:
-        return {}
-    cookie_string = headers["cookie"]
-    cookie_kv_pairs = cookie_string.split(";")
-    cookie_dict = {}
-    for kv in cookie_kv_pairs:
-        if "=" in kv:
-            key, value = kv.split("=", 1)
-            cookie_dict[key.strip()] = unquote(value.strip())
-    return cookie_dict
+@st.cache_data(ttl=10 * 60, show_spinner=False)
+def ask_llm(prompt: str) -> str:
+    """Invoke the LLM, reusing the answer when the same prompt is asked again."""
+    return llm.invoke(prompt).content
 
 
 def fetch_emails():
     try:
-        cookies = get_all_cookies()
-        response = requests.get(EMAIL_API_URL, cookies=cookies)
-        response.raise_for_status()
-        data = response.json()
-        emails_data = data.get("message", [])
+        emails_data = cached_emails()
     except Exception as e:
         st.error(f"Failed to fetch emails from API: {e}")
         return []
@@ -84,15 +81,8 @@ def fetch_emails():
         subject = email.get("subject", "No Subject")
         raw = email.get("raw", "")
         thread_id = email.get("threadId", "")
-        date_str = email.get("date", None)
-        try:
-            date_obj = (
-                datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S%z")
-                if date_str
-                else datetime.now()
-            )
-        except Exception:
-            date_obj = datetime.now()
+        # api_client parses the date
+        date_obj = email.get("date") or datetime.now()
         email_id = email.get("id", str(date_obj.timestamp()))
         # fallback to To header
         if "payload" in email:
@@ -109,7 +99,7 @@ def fetch_emails():
                 "from": sender,
                 "raw": raw,
                 "threadId": thread_id,
-                "priority": (
+                "priority": email.get("priority") or (
                     "High" if "IMPORTANT" in email.get("labelIds", []) else "Low"
                 ),
                 "date": date_obj,
@@ -136,12 +126,52 @@ else:
             if st.button("Reply to this email", key=f"select_{i}"):
                 st.session_state.selected_email = em
                 st.session_state.generated_variations = None
+                if em["priority"] == "High":
+                    # High-priority mail usually has a draft waiting already
+                    try:
+                        drafts = api.get_drafts(em["id"])
+                    except requests.RequestException:
+                        drafts = []
+                    if drafts:
+                        st.session_state.generated_variations = [
+                            d["text"] for d in drafts
+                        ]
+
+def send_and_report(to: str, subject: str, body: str, id=None, thread_id=None):
+    """Queue an email and report whether the backend managed to send it."""
+    # One idempotency key per email until its send has an outcome: a double click, or a rerun
+    # while it is still queued, returns the same job, but sending it again once it was sent
+    # or failed queues a new one
+    content = hashlib.sha256(json.dumps([to, subject, body, id]).encode()).hexdigest()
+    keys = st.session_state.setdefault("send_keys", {})
+    key = keys.setdefault(content, uuid.uuid4().hex)
+    try:
+        job = api.send_email(
+            to=to, subject=subject, body=body, id=id, thread_id=thread_id,
+            idempotency_key=key,
+        )
+        with st.spinner("Sending..."):
+            status = api.wait_for_send(job["id"])
+    except requests.HTTPError as e:
+        st.error(f"❌ Failed: {e.response.status_code} - {e.response.text}")
+        return
+    except requests.RequestException as e:
+        st.error(f"❌ Failed to reach the backend: {e}")
+        return
+    if status["status"] in ("sent", "failed"):
+        keys.pop(content, None)
+    if status["status"] == "sent":
+        st.success(f"✅ Email sent to {to}!")
+    elif status["status"] == "failed":
+        st.error(f"❌ Failed: {status['error']}")
+    else:
+        st.info(f"📤 Queued; it will be sent to {to} shortly.")
 
-# Reply interface
-if "selected_email" in st.session_state:
-    em = st.session_state.selected_email
-    sender_name = em.get("from", "Unknown Sender")
 
+# Reply interface
+@st.fragment
+def reply_panel(em):
+    """Tone, variation and send widgets rerun only this panel, not the inbox fetch."""
     st.markdown("---")
     st.subheader("Compose Reply")
     additional_instructions = st.text_input(
@@ -155,54 +185,29 @@ if "selected_email" in st.session_state:
     if not sign_off:
         sign_off = "Jerome"
     if st.button("Generate Reply"):
-        prompt = None
-        content = em.get("raw", "")
-        if multi:
-            prompt = f"""
-You are an assistant that generates smart email replies.
-
-IMPORTANT: Only output the final reply text.
-
-Email:
-"{content}"
-Instructions: "{additional_instructions}"
-Generate 3 {tone.lower()} variations labeled:
-===Variation 1===
-===Variation 2===
-===Variation 3===
-Each must:
-1. Start with "Dear {sender_name},"
-2. End with "Best regards," then on the next line "{sign_off}"
-3. Address the content
-"""
-        else:
-            prompt = f"""
-You are an assistant that generates smart email replies.
-
-IMPORTANT: Only output the final reply text.
-
-Email:
-"{content}"
-Instructions: "{additional_instructions}"
-Generate a {tone.lower()} reply:
-1. Start with "Dear {sender_name},"
-2. End with "Best regards," then on the next line "{sign_off}"
-3. Address the content
-"""
-        response = llm.invoke(prompt)
-        out = response.content.strip()
-        lines = out.splitlines()
-        cleaned = [
-            l for l in lines if not any(x in l for x in ["IMPORTANT:", "===Variation"])
-        ]
-        result = "\n".join(cleaned).strip()
-        if multi:
-            parts = re.split(r"===\s*Variation\s*\d+\s*===", result)
-            st.session_state.generated_variations = [
-                p.strip() for p in parts if p.strip()
-            ]
-        else:
-            st.session_state.generated_variations = [result]
+        # The backend generates the variations concurrently; show each one as it arrives
+        count = 3 if multi else 1
+        slots = [st.empty() for _ in range(count)]
+        for slot in slots:
+            slot.info("⏳ Generating...")
+        variations = [None] * count
+        try:
+            for item in api.stream_replies(
+                em["id"], tone, additional_instructions, sign_off, count
+            ):
+                idx = item["index"]
+                if "error" in item:
+                    slots[idx].error(f"❌ Variation {idx + 1} failed: {item['error']}")
+                    continue
+                variations[idx] = item["text"]
+                slots[idx].text_area(
+                    f"Version {idx + 1}", value=item["text"], height=100, disabled=True
+                )
+        except requests.RequestException as e:
+            st.error(f"❌ Failed to generate reply: {e}")
+        for slot in slots:
+            slot.empty()
+        st.session_state.generated_variations = [v for v in variations if v]
 
     if st.session_state.generated_variations:
         opts = st.session_state.generated_variations
@@ -220,63 +225,61 @@ Generate a {tone.lower()} reply:
             st.text_area("Reply", value=opts[0], height=150, key="rv0")
             sel = 0
         if st.button("Send Email"):
-            reply_body = opts[sel]
-            payload = {
-                "to": em.get("from"),
-                "subject": em.get("subject"),
-                "body": reply_body,
-                "id": em.get("id"),
-                "threadId": em.get("threadId"),
-            }
-            r = requests.post(
-                f"http://{ip_address}:8101/email/send",
-                json=payload,
-                cookies=get_all_cookies(),
+            send_and_report(
+                to=em.get("from"),
+                subject=em.get("subject"),
+                body=opts[sel],
+                id=em.get("id"),
+                thread_id=em.get("threadId"),
             )
-            if r.status_code == 200:
-                st.success(f"✅ Reply sent to {em.get('from')}!")
-            else:
-                st.error(f"❌ Failed: {r.status_code} - {r.text}")
     if st.button(
         "Clear Selection",
         key="clr",
         on_click=lambda: st.session_state.pop("selected_email", None),
     ):
-        st.experimental_rerun()
+        st.rerun()
+
+
+if "selected_email" in st.session_state:
+    reply_panel(st.session_state.selected_email)
 
 st.markdown("---")
 
+
 # Compose new email
-st.subheader("📝 Compose New Email")
-
-to_address = st.text_input("📬 To", placeholder="recipient@example.com")
-email_subject = st.text_input("📝 Subject", placeholder="Meeting Follow-up")
-compose_content = st.text_area(
-    "✍️ What's this email about?", placeholder="Your idea or points to cover..."
-)
-sign_off_compose = st.text_input(
-    "Your sign-off name:", placeholder="e.g. Jerome", key="compose_signoff"
-)
-if not sign_off_compose:
-    sign_off_compose = "Jerome"
-compose_instructions = st.text_input(
-    "Additional instructions (optional):", placeholder="e.g. more formal"
-)
-compose_tone = st.radio(
-    "Choose tone:", ["Professional", "Friendly", "Concise"], key="compose_tone"
-)
-compose_variation = st.checkbox("Generate multiple variations", key="compose_multi")
-
-if st.button("🪄 Generate Email"):
-    if not to_address.strip():
-        st.warning("Please enter recipient address.")
-    elif not email_subject.strip():
-        st.warning("Please enter subject.")
-    elif not compose_content.strip():
-        st.warning("Please provide content.")
-    else:
-        if compose_variation:
-            prompt = f"""
+@st.fragment
+def compose_panel():
+    """The compose form reruns on its own, without refetching the inbox."""
+    st.subheader("📝 Compose New Email")
+
+    to_address = st.text_input("📬 To", placeholder="recipient@example.com")
+    email_subject = st.text_input("📝 Subject", placeholder="Meeting Follow-up")
+    compose_content = st.text_area(
+        "✍️ What's this email about?", placeholder="Your idea or points to cover..."
+    )
+    sign_off_compose = st.text_input(
+        "Your sign-off name:", placeholder="e.g. Jerome", key="compose_signoff"
+    )
+    if not sign_off_compose:
+        sign_off_compose = "Jerome"
+    compose_instructions = st.text_input(
+        "Additional instructions (optional):", placeholder="e.g. more formal"
+    )
+    compose_tone = st.radio(
+        "Choose tone:", ["Professional", "Friendly", "Concise"], key="compose_tone"
+    )
+    compose_variation = st.checkbox("Generate multiple variations", key="compose_multi")
+
+    if st.button("🪄 Generate Email"):
+        if not to_address.strip():
+            st.warning("Please enter recipient address.")
+        elif not email_subject.strip():
+            st.warning("Please enter subject.")
+        elif not compose_content.strip():
+            st.warning("Please provide content.")
+        else:
+            if compose_variation:
+                prompt = f"""
 You are an assistant that writes professional emails.
 
 IMPORTANT: Only output final emails.
@@ -291,8 +294,8 @@ Each must:
 1. Start with greeting
 2. End with "Best regards," then on the next line "{sign_off_compose}"
 """
-        else:
-            prompt = f"""
+            else:
+                prompt = f"""
 You are an assistant that writes professional emails.
 
 IMPORTANT: Only output final email.
@@ -303,42 +306,35 @@ Generate one {compose_tone.lower()} email:
 1. Start with greeting
 2. End with "Best regards," then on the next line "{sign_off_compose}"
 """
-        response = llm.invoke(prompt)
-        out = response.content.strip()
-        lines = out.splitlines()
-        cleaned = [
-            l for l in lines if not any(x in l for x in ["IMPORTANT:", "===Variation"])
-        ]
-        result = "\n".join(cleaned).strip()
-        if compose_variation:
-            parts = re.split(r"===\s*Variation\s*\d+\s*===", result)
-            st.session_state.generated_compose_variations = [
-                p.strip() for p in parts if p.strip()
+            out = ask_llm(prompt).strip()
+            lines = out.splitlines()
+            cleaned = [
+                l for l in lines if not any(x in l for x in ["IMPORTANT:", "===Variation"])
             ]
+            result = "\n".join(cleaned).strip()
+            if compose_variation:
+                parts = re.split(r"===\s*Variation\s*\d+\s*===", result)
+                st.session_state.generated_compose_variations = [
+                    p.strip() for p in parts if p.strip()
+                ]
+            else:
+                st.session_state.generated_compose_variations = [result]
+
+    # Display compose drafts
+    if st.session_state.get("generated_compose_variations"):
+        drafts = st.session_state["generated_compose_variations"]
+        st.markdown("#### ✨ AI-Generated Draft(s)")
+        for i, d in enumerate(drafts, 1):
+            st.text_area(f"Draft {i}", value=d, height=180, key=f"cd{i}")
+        if len(drafts) > 1:
+            choice = st.radio(
+                "Select draft to send:", [f"Draft {i}" for i in range(1, len(drafts) + 1)]
+            )
+            sel = int(choice.split()[-1]) - 1
         else:
-            st.session_state.generated_compose_variations = [result]
-
-# Display compose drafts
-if st.session_state.get("generated_compose_variations"):
-    drafts = st.session_state["generated_compose_variations"]
-    st.markdown("#### ✨ AI-Generated Draft(s)")
-    for i, d in enumerate(drafts, 1):
-        st.text_area(f"Draft {i}", value=d, height=180, key=f"cd{i}")
-    if len(drafts) > 1:
-        choice = st.radio(
-            "Select draft to send:", [f"Draft {i}" for i in range(1, len(drafts) + 1)]
-        )
-        sel = int(choice.split()[-1]) - 1
-    else:
-        sel = 0
-    if st.button("Send Composed Email"):
-        body = drafts[sel]
-        r = requests.post(
-            f"http://{ip_address}:8101/email/send",
-            json={"to": to_address, "subject": email_subject, "body": body},
-            cookies=get_all_cookies(),
-        )
-        if r.status_code == 200:
-            st.success(f"✅ Email sent to {to_address}!")
-        else:
-            st.error(f"❌ Failed: {r.status_code} - {r.text}")
+            sel = 0
+        if st.button("Send Composed Email"):
+            send_and_report(to=to_address, subject=email_subject, body=drafts[sel])
+
+
+compose_panel()
@@ -1,8 +1,9 @@
 import streamlit as st
-from urllib.parse import unquote
 import os
 from dotenv import load_dotenv
 
+from api_client import get_all_cookies
+
 # Load .env
 load_dotenv()
 ip_address = os.getenv("IP_ADDRESS", "127.0.0.1")  # default fallback to localhost
@@ -29,21 +30,6 @@ redirect = st.button(
 
 
 # Handle Cookies
-def get_all_cookies():
-    headers = st.context.headers
-    if headers is None or "cookie" not in headers:
-        return {}
-
-    cookie_string = headers["cookie"]
-    cookie_kv_pairs = cookie_string.split(";")
-    cookie_dict = {}
-    for kv in cookie_kv_pairs:
-        if "=" in kv:
-            key, value = kv.split("=", 1)
-            cookie_dict[key.strip()] = unquote(value.strip())
-    return cookie_dict
-
-
 cookies = get_all_cookies()
 key = cookies.get("key")
 
@@ -10,7 +10,13 @@ python run_server.py &
 source /venv/another/bin/activate
 cd /app/be
 echo "Starting FastAPI BE on port 8101..."
-uvicorn main:app --host 0.0.0.0 --port 8101 &
+# WEB_CONCURRENCY > 1 runs several workers; they share tokens, OAuth state, caches and
+# rate limits through STATE_BACKEND_URL (a SQLite file on this host unless set, e.g. redis://...)
+WORKERS=${WEB_CONCURRENCY:-1}
+if [ "$WORKERS" -gt 1 ] && [ -z "$STATE_BACKEND_URL" ]; then
+    export STATE_BACKEND_URL="sqlite:////app/be/state.db"
+fi
+uvicorn main:app --host 0.0.0.0 --port 8101 --workers "$WORKERS" &
 
 # Start FE (Streamlit) - shared venv
 cd /app/fe